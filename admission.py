@@ -0,0 +1,124 @@
+"""
+Admission control and load shedding.
+
+Requests are sorted into priority classes by method and path (see the rules
+in main.py). Each class has its own concurrency limit and a bounded wait
+queue, so a burst of slow aggregates or uploads cannot take every
+threadpool slot away from cheap reads. When a class is saturated, requests
+wait up to `queue_timeout` seconds and are then rejected with
+503 + Retry-After instead of piling up.
+"""
+import asyncio
+import json
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, Optional
+
+
+class PriorityClass:
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float, retry_after: int = 1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._active = 0
+        self._queued = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting in the queue if needed; False means the request should be shed"""
+        if self._semaphore.locked():
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                return False
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._timed_out += 1
+                return False
+            finally:
+                self._queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self._active += 1
+        self._admitted += 1
+        return True
+
+    def release(self):
+        self._active -= 1
+        self._semaphore.release()
+
+    def metrics(self):
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+        }
+
+
+class AdmissionRule:
+    """Requests whose path matches `pattern` (fnmatch style) and method is in `methods` go to `class_name`"""
+
+    def __init__(self, pattern: str, class_name: Optional[str], methods: Optional[Iterable[str]] = None):
+        self.pattern = pattern
+        self.class_name = class_name
+        self.methods = {method.upper() for method in methods} if methods else None
+
+    def matches(self, method: str, path: str) -> bool:
+        return (self.methods is None or method in self.methods) and fnmatchcase(path, self.pattern)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, classes: Dict[str, PriorityClass], rules: Iterable[AdmissionRule]):
+        self.app = app
+        self.classes = classes
+        self.rules = list(rules)
+
+    def classify(self, method: str, path: str) -> Optional[PriorityClass]:
+        """First matching rule wins; a rule with class_name None exempts the request"""
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return self.classes[rule.class_name] if rule.class_name else None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        priority_class = self.classify(scope["method"], scope["path"])
+        if priority_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await priority_class.acquire():
+            body = json.dumps({"detail": "Server is busy, please retry"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(priority_class.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            priority_class.release()
+
+
+def admission_metrics(classes: Dict[str, PriorityClass]):
+    return {name: priority_class.metrics() for name, priority_class in classes.items()}
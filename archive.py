@@ -0,0 +1,124 @@
+"""
+Hot/cold archival of visits and their patients.
+
+Visits older than the horizon (ARCHIVE_AFTER_DAYS, default 365) are moved,
+together with their patients, into the `visits_archive` and
+`patients_archive` tables in batched transactions. Rows keep their ids, and
+each batch is copied with INSERT ... SELECT, so nothing passes through the
+application. Read paths in crud.py that return history (a doctor's visits, a
+visit's patients, unique-patient aggregation, patient listings) union the
+archive in transparently. Archived rows are read-only: patients cannot be
+added to an archived visit, and a doctor's archived visit on a date is found
+instead of creating a new one. Migrations keep new visit and patient ids above
+the archived ones, so an id always names a single row.
+
+Run with: python archive.py [--days N] [--batch-size N] [--dry-run]
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+import models
+from cache import bump_version
+from changelog import UPSERT, record_change, write_changes_from_select
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+
+_VISIT_COLUMNS = ["id", "date", "doctor_id"]
+_PATIENT_COLUMNS = ["id", "name", "contact", "fee_status", "visit_id", "serial_no"]
+
+
+def archive_cutoff(days: int = ARCHIVE_AFTER_DAYS) -> date:
+    return date.today() - timedelta(days=days)
+
+
+def _copy(db: Session, source, target, columns, condition, archived_at):
+    """INSERT INTO target (columns, archived_at) SELECT columns, :archived_at FROM source WHERE condition"""
+    source_table = source.__table__
+    query = select(*(source_table.c[name] for name in columns), literal(archived_at)).where(condition)
+    db.execute(insert(target.__table__).from_select(columns + ["archived_at"], query))
+
+
+def archive_batch(db: Session, cutoff: date, batch_size: int = 500):
+    """
+    Move up to `batch_size` visits dated before `cutoff`, with their patients, in one transaction.
+    Returns (visits moved, patients moved).
+    """
+    # Locking the visits keeps patients from being added to them mid-move
+    visit_ids = db.execute(
+        select(models.Visit.id)
+        .where(models.Visit.date < cutoff)
+        .order_by(models.Visit.id)
+        .limit(batch_size)
+        .with_for_update()
+    ).scalars().all()
+    if not visit_ids:
+        return 0, 0
+
+    archived_at = datetime.utcnow()
+    _copy(db, models.Visit, models.ArchivedVisit, _VISIT_COLUMNS, models.Visit.id.in_(visit_ids), archived_at)
+    _copy(db, models.Patient, models.ArchivedPatient, _PATIENT_COLUMNS,
+          models.Patient.visit_id.in_(visit_ids), archived_at)
+    # Delta sync clients get the moved rows from the archive (see changelog.ARCHIVES)
+    for visit_id in visit_ids:
+        record_change(db, "visits", UPSERT, visit_id, visit_id=visit_id)
+    write_changes_from_select(db, "patients", UPSERT, select(models.Patient.id, models.Patient.visit_id).where(
+        models.Patient.visit_id.in_(visit_ids)
+    ))
+
+    patients_moved = db.execute(delete(models.Patient).where(models.Patient.visit_id.in_(visit_ids))).rowcount
+    db.execute(delete(models.Visit).where(models.Visit.id.in_(visit_ids)))
+    bump_version(db, "visits", "patients", "visits_archive", "patients_archive")
+    db.commit()
+    return len(visit_ids), patients_moved
+
+
+def archive_visits(db: Session, cutoff: date, batch_size: int = 500, max_batches: int = None):
+    """Archive in batches until nothing before `cutoff` is left (or `max_batches` ran)"""
+    totals = {"visits": 0, "patients": 0, "batches": 0}
+    while max_batches is None or totals["batches"] < max_batches:
+        visits, patients = archive_batch(db, cutoff, batch_size)
+        if not visits:
+            break
+        totals["visits"] += visits
+        totals["patients"] += patients
+        totals["batches"] += 1
+    return totals
+
+
+def count_archivable(db: Session, cutoff: date):
+    return db.query(func.count(models.Visit.id)).filter(models.Visit.date < cutoff).scalar()
+
+
+def table_sizes(db: Session):
+    """Row counts of the hot and archive tables"""
+    sizes = {}
+    for model in (models.Visit, models.Patient, models.ArchivedVisit, models.ArchivedPatient):
+        sizes[model.__tablename__] = db.query(func.count(model.id)).scalar()
+    return sizes
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Move old visits and their patients to the archive tables")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive visits older than this")
+    parser.add_argument("--batch-size", type=int, default=500, help="visits moved per transaction")
+    parser.add_argument("--max-batches", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    args = parser.parse_args()
+
+    cutoff = archive_cutoff(args.days)
+    db = SessionLocal()
+    try:
+        if args.dry_run:
+            print(f"{count_archivable(db, cutoff)} visits dated before {cutoff} would be archived")
+        else:
+            totals = archive_visits(db, cutoff, args.batch_size, args.max_batches)
+            print(f"Archived {totals['visits']} visits and {totals['patients']} patients "
+                  f"dated before {cutoff} in {totals['batches']} batches")
+        for table, rows in table_sizes(db).items():
+            print(f"{table}: {rows} rows")
+    finally:
+        db.close()
@@ -0,0 +1,164 @@
+"""
+Prebuilt public site bundle.
+
+The homepage needs doctors, available schedules and active gallery images.
+Instead of three queries per page load, they are serialized into one JSON
+document (plus gzip/brotli variants) that is rebuilt only when one of the
+three tables changes. A request that notices a change still gets the previous
+bundle immediately while a background thread builds the new one.
+
+With PUBLIC_BUNDLE_PATH set, every build is also written to disk (with
+precompressed siblings), so a freshly started worker serves the last bundle
+without touching the database.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from fastapi import Request
+from pydantic import TypeAdapter
+import crud
+import schemas
+from cache import CachedBody, cached_body_response, current_versions, version_etag
+from compression import compress, decompress, supported_encodings
+from database import SessionLocal
+from singleflight import flights
+
+BUNDLE_TABLES = ["doctors", "doctor_schedules", "gallery_images"]
+PUBLIC_BUNDLE_PATH = os.getenv("PUBLIC_BUNDLE_PATH")    # e.g. cache/public_bundle.json
+PUBLIC_BUNDLE_CACHE_CONTROL = os.getenv("PUBLIC_BUNDLE_CACHE_CONTROL", "public, no-cache")
+
+_ENCODING_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+_adapter = TypeAdapter(schemas.PublicBundleResponse)
+
+logger = logging.getLogger(__name__)
+
+
+def _version_string(versions: tuple) -> str:
+    return ".".join(str(version) for version in versions)
+
+
+def _not_older(versions: tuple, than: tuple) -> bool:
+    return all(new >= old for new, old in zip(versions, than))
+
+
+def _decompresses_to(variant: bytes, encoding: str, body: bytes) -> bool:
+    try:
+        return decompress(variant, encoding) == body
+    except Exception:
+        return False
+
+
+class PublicBundle:
+    def __init__(self, path: str = None):
+        self.path = path
+        self._current = None    # (versions, CachedBody)
+        self._building = False
+        self._lock = threading.Lock()
+        self._loaded_from_disk = False
+
+    def get(self):
+        """(versions, CachedBody) of the newest bundle available without waiting, building it if there is none"""
+        versions = current_versions(BUNDLE_TABLES)
+        current = self._current or self._load_from_disk()
+        if current is None:
+            # Nothing to serve yet: concurrent first requests share one build
+            return flights.do(("public-bundle", versions), lambda: self._build(versions))
+        if current[0] != versions:
+            self._rebuild_in_background(versions)
+        return current
+
+    def _build(self, versions):
+        # Versions are read before the data, so a concurrent write can only make the bundle look older
+        db = SessionLocal()
+        try:
+            document = _adapter.validate_python({
+                "version": _version_string(versions),
+                "generated_at": datetime.utcnow(),
+                "doctors": crud.get_doctors(db),
+                "schedules": crud.get_available_schedules(db),
+                "gallery": crud.get_gallery_images(db, 0, None, active_only=True),
+            }, from_attributes=True)
+        finally:
+            db.close()
+
+        body = _adapter.dump_json(document)
+        cached = CachedBody(body, {encoding: compress(body, encoding) for encoding in supported_encodings()})
+        with self._lock:
+            # A slow build of older versions must not replace a newer bundle
+            installed = self._current is None or _not_older(versions, self._current[0])
+            if installed:
+                self._current = (versions, cached)
+        if installed and self.path:
+            self._write_to_disk(cached)
+        return versions, cached
+
+    def _rebuild_in_background(self, versions):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                flights.do(("public-bundle", versions), lambda: self._build(versions))
+            except Exception:
+                logger.exception("Public bundle rebuild failed")
+            finally:
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=run, name="public-bundle", daemon=True).start()
+
+    def _write_to_disk(self, cached: CachedBody):
+        """Write the bundle and its compressed variants atomically (readers never see a partial file)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        files = [(self.path, cached.body)] + [
+            (self.path + suffix, cached.encoded(encoding))
+            for encoding, suffix in _ENCODING_SUFFIXES.items() if encoding in supported_encodings()
+        ]
+        for path, content in files:
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(content)
+            os.replace(temporary, path)
+
+    def _load_from_disk(self):
+        """Last bundle written by any worker, read once per process"""
+        if not self.path or self._loaded_from_disk:
+            return None
+        self._loaded_from_disk = True
+        try:
+            with open(self.path, "rb") as f:
+                body = f.read()
+            versions = tuple(int(part) for part in json.loads(body)["version"].split("."))
+            variants = {}
+            for encoding in supported_encodings():
+                variant_path = self.path + _ENCODING_SUFFIXES[encoding]
+                if os.path.exists(variant_path):
+                    with open(variant_path, "rb") as f:
+                        variant = f.read()
+                    # Another worker may have replaced the files between reads
+                    if _decompresses_to(variant, encoding, body):
+                        variants[encoding] = variant
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable public bundle at %s: %s", self.path, e)
+            return None
+
+        with self._lock:
+            if self._current is None:
+                self._current = (versions, CachedBody(body, variants))
+            return self._current
+
+
+public_bundle = PublicBundle(PUBLIC_BUNDLE_PATH)
+
+
+def public_bundle_response(request: Request):
+    versions, cached = public_bundle.get()
+    return cached_body_response(request, cached, version_etag(versions), PUBLIC_BUNDLE_CACHE_CONTROL)
@@ -0,0 +1,226 @@
+"""
+Per-worker response caches kept coherent across processes.
+
+Every cached table has a row in `data_versions`. Writes bump it in the same
+transaction as the change (`bump_version`), and each worker re-reads all
+counters with one cheap SELECT at most every CACHE_POLL_INTERVAL seconds.
+A cache entry is only served while the versions it was built from are
+current, so workers share nothing but the counter table.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+import models
+from compression import choose_encoding, compress
+from database import engine, read_engine, is_pinned_to_primary
+from singleflight import flights
+
+load_dotenv()
+
+# Tables whose contents are cached or versioned
+VERSIONED_TABLES = [
+    "doctors", "visits", "patients", "doctor_schedules", "gallery_images",
+    "visits_archive", "patients_archive",
+]
+
+
+class VersionTracker:
+    def __init__(self, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self._versions = {}
+        self._last_poll = 0.0
+        self._expired = True
+        self._local_commits = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> int:
+        """Current version of `name`, refreshed from the database when the last poll is too old"""
+        if self._expired or time.monotonic() - self._last_poll >= self.poll_interval:
+            self.refresh()
+        return self._versions.get(name, 0)
+
+    def refresh(self):
+        # Versions come from the same database as the cached data, so with a lagging
+        # replica an entry can only be tagged older than its contents, never newer
+        query = select(models.DataVersion.name, models.DataVersion.version)
+        with self._lock:
+            try:
+                with read_engine.connect() as conn:
+                    rows = conn.execute(query).all()
+            except OperationalError:
+                if read_engine is engine:
+                    raise
+                with engine.connect() as conn:
+                    rows = conn.execute(query).all()
+            self._versions = dict(rows)
+            self._last_poll = time.monotonic()
+            self._expired = False
+
+    def expire(self):
+        """Force a re-read on next access (used after this worker commits a write)"""
+        self._expired = True
+
+    def note_local_commit(self, names: Iterable[str]):
+        """Count a commit by this worker that bumped `names` (lets listeners tell local writes from other workers')"""
+        with self._lock:
+            for name in names:
+                self._local_commits[name] = self._local_commits.get(name, 0) + 1
+            self._expired = True
+
+    def local_commits(self, name: str) -> int:
+        return self._local_commits.get(name, 0)
+
+
+tracker = VersionTracker(float(os.getenv("CACHE_POLL_INTERVAL", "1.0")))
+
+
+def bump_version(db: Session, *names: str):
+    """Increment the version of each table in `names` as part of the current transaction (one statement)"""
+    db.execute(
+        update(models.DataVersion)
+        .where(models.DataVersion.name.in_(names))
+        .values(version=models.DataVersion.version + 1)
+    )
+    db.info.setdefault("versions_bumped", set()).update(names)
+
+
+@event.listens_for(Session, "after_commit")
+def _expire_local_versions(session):
+    names = session.info.pop("versions_bumped", None)
+    if names:
+        tracker.note_local_commit(names)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_version_bumps(session, previous_transaction):
+    session.info.pop("versions_bumped", None)
+
+
+class VersionedCache:
+    """Bounded LRU cache whose entries are tied to table versions"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, versions: tuple, loader: Callable):
+        """
+        Return the entry for `key` if it was built at `versions`, else rebuild it.
+        Versions must be read before loading, so a concurrent write can only make the entry look older.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        # Concurrent misses for the same entry build it once
+        value = flights.do(("cache", key, versions), loader)
+        with self._lock:
+            self._entries[key] = (versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def current_versions(tables: Iterable[str]) -> tuple:
+    return tuple(tracker.get(table) for table in tables)
+
+
+def version_etag(versions: tuple) -> str:
+    """Weak ETag for a representation built from `versions` (same for every encoding)"""
+    return 'W/"' + ".".join(str(version) for version in versions) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison against the request's If-None-Match header"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+response_cache = VersionedCache(int(os.getenv("CACHE_MAX_ENTRIES", "256")))
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+
+class CachedBody:
+    """A cached JSON body plus its compressed variants, each built at most once"""
+
+    def __init__(self, body: bytes, variants: dict = None):
+        self.body = body
+        self._variants = dict(variants or {})
+
+    def encoded(self, encoding: str) -> bytes:
+        variant = self._variants.get(encoding)
+        if variant is None:
+            variant = self._variants[encoding] = compress(self.body, encoding)
+        return variant
+
+
+def cached_body_response(request: Request, cached: CachedBody, etag: str, cache_control: str = "no-cache") -> Response:
+    """Serve prebuilt JSON bytes: 304 on a matching ETag, else the best precompressed variant"""
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is None or len(cached.body) < COMPRESSION_MIN_SIZE:
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+
+    headers["Content-Encoding"] = encoding
+    return Response(content=cached.encoded(encoding), media_type="application/json", headers=headers)
+
+
+_adapters = {}
+
+
+def cached_json(request: Request, key, tables: Iterable[str], loader: Callable, response_type) -> Response:
+    """
+    Serve `loader()` serialized as `response_type`, caching the JSON bytes (and
+    their compressed variants) until one of `tables` changes.
+    Requests whose If-None-Match carries the current version ETag get a 304
+    without touching the database. Clients pinned to the primary after a
+    write bypass the shared cache.
+    """
+    adapter = _adapters.get(response_type)
+    if adapter is None:
+        adapter = _adapters[response_type] = TypeAdapter(response_type)
+
+    if is_pinned_to_primary(request):
+        body = adapter.dump_json(adapter.validate_python(loader(), from_attributes=True))
+        return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-cache"})
+
+    versions = current_versions(tables)
+    etag = version_etag(versions)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"})
+
+    def build():
+        return CachedBody(adapter.dump_json(adapter.validate_python(loader(), from_attributes=True)))
+
+    return cached_body_response(request, response_cache.get_or_load(key, versions, build), etag)
@@ -0,0 +1,229 @@
+"""
+Append-only change log for client delta sync.
+
+Write paths call `record_change(db, table, op, *ids)`; the entries are
+inserted with one statement just before the transaction commits, so the log
+and the data always agree. `GET /changes/?since=<cursor>` returns the latest
+state of every row changed after the cursor, grouped by table, plus the new
+cursor.
+
+Sync protocol: call without `since` to get the current cursor, download the
+collections, then poll with `since`. A `reset` response means the cursor is
+older than the compacted part of the log and the client must download again.
+
+Old entries are removed by `python changelog.py --compact`; the highest
+removed id is kept in `data_versions` as `change_log_floor`, raised before
+the first entry is deleted. Bulk writes that bypass the ORM (archive.py,
+migrations) log their rows with `write_changes`; rows moved to the archive
+tables are served from there.
+
+Patient and visit entries also carry the visit they belong to and the
+process that wrote them, so live event streams (events.py) can tell which
+visits another worker changed.
+"""
+import argparse
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pydantic import TypeAdapter
+from sqlalchemy import delete, event, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+import models
+import schemas
+from fieldsets import partial_model
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Seconds after which a gap in the ids is treated as a rolled-back transaction
+# rather than one that has not committed yet
+CHANGE_LOG_SETTLE_SECONDS = float(os.getenv("CHANGE_LOG_SETTLE_SECONDS", "5"))
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+FLOOR_NAME = "change_log_floor"
+
+# Identifies entries written by this process
+ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# Table name -> (model, response schema) used to serialize changed rows
+ENTITIES = {
+    "doctors": (models.Doctor, schemas.DoctorResponse),
+    "visits": (models.Visit, partial_model(schemas.VisitResponse, ("id", "date", "doctor_id"))),
+    "patients": (models.Patient, schemas.PatientResponse),
+    "doctor_schedules": (models.DoctorSchedule, schemas.DoctorScheduleResponse),
+    "gallery_images": (models.GalleryImage, schemas.GalleryImageResponse),
+}
+
+# Where rows of a table live once archive.py has moved them
+ARCHIVES = {"visits": models.ArchivedVisit, "patients": models.ArchivedPatient}
+
+_adapters = {table: TypeAdapter(List[schema]) for table, (_, schema) in ENTITIES.items()}
+
+
+def record_change(db: Session, table: str, op: str, *row_ids: int, visit_id: Optional[int] = None):
+    """Log changed rows of `table` (in visit `visit_id`); written in the current transaction when it commits"""
+    if table not in ENTITIES:
+        raise ValueError(f"Unknown table: {table}")
+    db.info.setdefault("changes", []).extend((table, row_id, op, visit_id) for row_id in row_ids)
+
+
+def write_changes(conn, changes):
+    """Insert (table, row_id, op, visit_id) entries now, with one statement (a Session or Connection)"""
+    if changes:
+        changed_at = datetime.utcnow()
+        conn.execute(insert(models.ChangeLogEntry), [
+            {"table_name": table, "row_id": row_id, "op": op, "changed_at": changed_at,
+             "visit_id": visit_id, "origin": ORIGIN}
+            for table, row_id, op, visit_id in changes
+        ])
+
+
+def write_changes_from_select(conn, table: str, op: str, rows):
+    """Log every (row_id, visit_id) that the select `rows` returns, with one INSERT ... SELECT"""
+    row_id, visit_id = rows.subquery().c
+    conn.execute(insert(models.ChangeLogEntry).from_select(
+        ["table_name", "row_id", "op", "changed_at", "visit_id", "origin"],
+        select(literal(table), row_id, literal(op), literal(datetime.utcnow()), visit_id, literal(ORIGIN)),
+    ))
+
+
+@event.listens_for(Session, "before_commit")
+def _write_change_log(session):
+    write_changes(session, session.info.pop("changes", None))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_changes(session, previous_transaction):
+    session.info.pop("changes", None)
+
+
+def latest_cursor(db: Session) -> int:
+    # The log may be empty after compaction; the floor is still a valid cursor
+    return max(db.query(func.max(models.ChangeLogEntry.id)).scalar() or 0, change_log_floor(db))
+
+
+def change_log_floor(db: Session) -> int:
+    return db.query(models.DataVersion.version).filter(models.DataVersion.name == FLOOR_NAME).scalar() or 0
+
+
+def entries_after(db: Session, since: int, limit: int = 500):
+    """
+    (entries, cursor, has_more, waiting): up to `limit` entries after `since` in id order.
+    Ids are assigned before commit, so a recent gap may be a transaction still in
+    flight: the entries stop there (`waiting`) and a later call picks it up.
+    """
+    log = models.ChangeLogEntry
+    entries = db.query(
+        log.id, log.table_name, log.row_id, log.op, log.changed_at, log.visit_id, log.origin
+    ).filter(log.id > since).order_by(log.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+
+    settled_before = datetime.utcnow() - timedelta(seconds=CHANGE_LOG_SETTLE_SECONDS)
+    cursor = since
+    settled = []
+    waiting = False
+    for entry in entries[:limit]:
+        if entry.id != cursor + 1 and entry.changed_at > settled_before:
+            has_more = False
+            waiting = True
+            break
+        cursor = entry.id
+        settled.append(entry)
+    return settled, cursor, has_more, waiting
+
+
+def read_changes(db: Session, since: Optional[int], limit: int = 500):
+    """Changes after cursor `since`, collapsed to the latest state of each row"""
+    if since is None or since < change_log_floor(db):
+        return {"cursor": latest_cursor(db), "reset": True, "has_more": False, "changes": {}}
+
+    entries, cursor, has_more, _ = entries_after(db, since, limit)
+    # Compaction may have removed entries between the floor check and the read
+    if since < change_log_floor(db):
+        return {"cursor": latest_cursor(db), "reset": True, "has_more": False, "changes": {}}
+    latest = {(entry.table_name, entry.row_id): entry.op for entry in entries}
+    return {"cursor": cursor, "reset": False, "has_more": has_more, "changes": _collect(db, latest)}
+
+
+def _collect(db: Session, latest: Dict) -> Dict:
+    """Current rows for upserted ids (one query per table); ids whose row is gone count as deleted"""
+    by_table = {}
+    for (table, row_id), op in latest.items():
+        by_table.setdefault(table, {UPSERT: [], DELETE: []})[op].append(row_id)
+
+    changes = {}
+    for table, ops in by_table.items():
+        model, _ = ENTITIES[table]
+        rows = db.query(model).filter(model.id.in_(ops[UPSERT])).all() if ops[UPSERT] else []
+        found = {row.id for row in rows}
+        missing = [row_id for row_id in ops[UPSERT] if row_id not in found]
+        if missing and table in ARCHIVES:
+            archived = db.query(ARCHIVES[table]).filter(ARCHIVES[table].id.in_(missing)).all()
+            rows += archived
+            found.update(row.id for row in archived)
+        if table == "gallery_images" and rows:
+            _set_gallery_positions(db, rows)
+        changes[table] = {
+            "upserted": _adapters[table].dump_python(
+                _adapters[table].validate_python(rows, from_attributes=True), mode="json"
+            ),
+            "deleted": sorted(ops[DELETE] + [row_id for row_id in ops[UPSERT] if row_id not in found]),
+        }
+    return changes
+
+
+def _set_gallery_positions(db: Session, images):
+    """Legacy order_index of each image: its place in the full gallery order (one id scan)"""
+    gallery = models.GalleryImage
+    ordered_ids = db.execute(select(gallery.id).order_by(gallery.rank_key, gallery.id)).scalars()
+    positions = {image_id: position for position, image_id in enumerate(ordered_ids)}
+    for image in images:
+        setattr(image, "order_index", positions[image.id])
+
+
+def compact_change_log(db: Session, older_than: datetime, batch_size: int = 5000):
+    """Delete entries older than `older_than`; clients behind the new floor are told to reset"""
+    log = models.ChangeLogEntry
+    floor = db.query(func.max(log.id)).filter(log.changed_at < older_than).scalar()
+    if floor is None:
+        return 0
+
+    # The floor goes up in the same transaction as the first batch, so no reader
+    # sees entries missing without also being told to reset
+    data_versions = models.DataVersion
+    if db.query(data_versions.name).filter(data_versions.name == FLOOR_NAME).first() is None:
+        db.execute(insert(data_versions).values(name=FLOOR_NAME, version=floor))
+    else:
+        db.execute(
+            update(data_versions)
+            .where(data_versions.name == FLOOR_NAME, data_versions.version < floor)
+            .values(version=floor)
+        )
+
+    removed = 0
+    while True:
+        ids = db.execute(select(log.id).where(log.id <= floor).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        removed += db.execute(delete(log).where(log.id.in_(ids))).rowcount
+        db.commit()
+    db.commit()
+    return removed
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Change log maintenance")
+    parser.add_argument("--compact", action="store_true", help="delete entries older than --days")
+    parser.add_argument("--days", type=int, default=CHANGE_LOG_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.compact:
+            removed = compact_change_log(db, datetime.utcnow() - timedelta(days=args.days))
+            print(f"Removed {removed} change log entries older than {args.days} days")
+        print(f"Cursor: {latest_cursor(db)}, floor: {change_log_floor(db)}")
+    finally:
+        db.close()
@@ -1,17 +1,85 @@
-from sqlalchemy.orm import Session
+import os
+import re
+from sqlalchemy import and_, case, delete, func, or_, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 import models, schemas
-from typing import  Optional
+from ranking import rank_between, rank_sequence, RANK_REBALANCE_LENGTH
+from cache import bump_version, tracker
+from changelog import DELETE, UPSERT, record_change
+from events import patient_event_data, publish_after_commit
+from singleflight import flights
+import timetable
+from fieldsets import columns
+from typing import  List, Optional, Sequence
 from datetime import date
 
+# Seconds a finished unique-patient scan may be served while a new one runs
+UNIQUE_PATIENTS_STALE_FOR = float(os.getenv("UNIQUE_PATIENTS_STALE_FOR", "0"))
+
+
+# Single-statement writes
+def _update_returning(db: Session, model, row_id: int, values: dict):
+    """
+    Update one row and return it: a single UPDATE ... RETURNING where the database
+    supports it, otherwise the UPDATE followed by one SELECT. None if no row matched.
+    """
+    statement = (
+        update(model).where(model.id == row_id).values(values)
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        return db.execute(statement.returning(model)).scalars().first()
+    if db.execute(statement).rowcount == 0:
+        return None
+    return db.get(model, row_id, populate_existing=True)
+
+
+def _delete_returning(db: Session, model, row_id: int, *columns):
+    """Delete one row and return `columns` of it (DELETE ... RETURNING where supported), or None"""
+    if db.get_bind().dialect.delete_returning:
+        return db.execute(delete(model).where(model.id == row_id).returning(*columns)).first()
+    row = db.query(*columns).filter(model.id == row_id).first()
+    if row is not None:
+        db.execute(delete(model).where(model.id == row_id))
+    return row
+
 
 # CRUD Operations for Doctors
-def get_doctors(db: Session):
-    return db.query(models.Doctor).all()
+def _entities(model, fields: Optional[Sequence[str]]):
+    """What to select for a list query: the full entity, or only the requested columns (see fieldsets.py)"""
+    return [model] if fields is None else columns(model, fields)
+
+
+def get_doctors(db: Session, fields: Optional[Sequence[str]] = None):
+    return db.query(*_entities(models.Doctor, fields)).all()
 
 
 def get_doctor(db: Session, doctor_id: int):
     return db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
 
+
+def get_doctors_with_schedules(db: Session):
+    """Get all doctors with their schedules (one query for doctors, one for schedules)"""
+    return db.query(models.Doctor).options(selectinload(models.Doctor.schedules)).all()
+
+
+def normalize_doctor_name(name: str):
+    """Normalize a name for matching, e.g. 'Dr. Shri  Kant' -> 'shri kant'"""
+    name = re.sub(r"^dr\b\.?", "", (name or "").strip().lower())
+    return re.sub(r"[\s._]+", " ", name).strip()
+
+
+def match_doctor_id(db: Session, name: str):
+    """Id of the only doctor whose name matches `name`, or None if there is no unique match"""
+    target = normalize_doctor_name(name)
+    matches = [
+        row.id for row in db.query(models.Doctor.id, models.Doctor.name)
+        if normalize_doctor_name(row.name) == target
+    ]
+    return matches[0] if len(matches) == 1 else None
+
 def create_doctor(db: Session, doctor: schemas.DoctorCreate, image_filename: Optional[str] = None):
     """Create a new doctor with optional image file"""
     # Convert Pydantic model to dict
@@ -23,13 +91,16 @@ def create_doctor(db: Session, doctor: schemas.DoctorCreate, image_filename: Opt
     
     db_doctor = models.Doctor(**doctor_data)
     db.add(db_doctor)
+    bump_version(db, "doctors")
+    db.flush()
+    record_change(db, "doctors", UPSERT, db_doctor.id)
     db.commit()
-    db.refresh(db_doctor)
     return db_doctor
 
 def update_doctor(db: Session, doctor_id: int, doctor: schemas.DoctorCreate, image_filename: Optional[str] = None):
     """Update a doctor with optional image file"""
-    db_doctor = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
+    # The router usually loaded the doctor already; get() reuses it without a query
+    db_doctor = db.get(models.Doctor, doctor_id)
     if not db_doctor:
         return None
     
@@ -41,25 +112,97 @@ def update_doctor(db: Session, doctor_id: int, doctor: schemas.DoctorCreate, ima
     if image_filename is not None:
         setattr(db_doctor, "image_filename", image_filename)
     
+    # Linked schedules keep a copy of the doctor's details for the /schedules API.
+    # Their image is a separate upload (see routers/schedules.py), so it is not copied.
+    schedule_ids = [
+        row.id for row in db.query(models.DoctorSchedule.id).filter(models.DoctorSchedule.doctor_id == doctor_id)
+    ]
+    if schedule_ids:
+        db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id.in_(schedule_ids)).update(
+            {
+                "name": db_doctor.name,
+                "specialization": db_doctor.specialization,
+                "contact_number": db_doctor.phone,
+            }
+        )
+        bump_version(db, "doctor_schedules")
+        record_change(db, "doctor_schedules", UPSERT, *schedule_ids)
+    
+    bump_version(db, "doctors")
+    record_change(db, "doctors", UPSERT, doctor_id)
     db.commit()
-    db.refresh(db_doctor)
     return db_doctor
 
 def delete_doctor(db: Session, doctor_id: int):
-    # First delete all related visits and their patients
-    visits = db.query(models.Visit).filter(models.Visit.doctor_id == doctor_id).all()
-    for visit in visits:
-        delete_visit(db, visit.id)
+    # First delete all related visits and their patients (in the same transaction,
+    # so after-commit work such as removing the doctor's image only runs once it is all gone)
+    visit_ids = [row.id for row in db.query(models.Visit.id).filter(models.Visit.doctor_id == doctor_id)]
+    for visit_id in visit_ids:
+        _delete_visit_rows(db, visit_id)
+
+    # Archived history goes too, or a doctor that later gets the same id would inherit it
+    archived_visit_ids = [
+        row.id for row in db.query(models.ArchivedVisit.id).filter(models.ArchivedVisit.doctor_id == doctor_id)
+    ]
+    if archived_visit_ids:
+        archived_patients = models.ArchivedPatient.visit_id.in_(archived_visit_ids)
+        archived_patient_ids = [row.id for row in db.query(models.ArchivedPatient.id).filter(archived_patients)]
+        db.query(models.ArchivedPatient).filter(archived_patients).delete(synchronize_session=False)
+        db.query(models.ArchivedVisit).filter(models.ArchivedVisit.id.in_(archived_visit_ids)).delete(
+            synchronize_session=False
+        )
+        record_change(db, "patients", DELETE, *archived_patient_ids)
+        record_change(db, "visits", DELETE, *archived_visit_ids)
+        bump_version(db, "visits_archive", "patients_archive")
+    
+    # Unlink schedules, which keep their own copy of the doctor's details
+    schedule_ids = [
+        row.id for row in db.query(models.DoctorSchedule.id).filter(models.DoctorSchedule.doctor_id == doctor_id)
+    ]
+    if schedule_ids:
+        db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id.in_(schedule_ids)).update(
+            {"doctor_id": None}, synchronize_session=False
+        )
+        record_change(db, "doctor_schedules", UPSERT, *schedule_ids)
     
     # Then delete the doctor
     result = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).delete()
+    bump_version(db, "doctors", "doctor_schedules", "visits", "patients")
+    if result:
+        record_change(db, "doctors", DELETE, doctor_id)
     db.commit()
     return result > 0
 
 
+def archive_in_use():
+    """True once archive.py has moved anything, so history reads must include the archive tables"""
+    return tracker.get("visits_archive") > 0
+
+
 # CRUD Operations for Visits
-def get_visits(db: Session, doctor_id: int):
+def _visit_rows(db: Session, visit_model, patient_model, doctor_id: int, fields: Sequence[str]):
+    """Requested visit columns, with totalPatients counted in the same query only if asked for"""
+    query = db.query(*columns(visit_model, fields)).filter(visit_model.doctor_id == doctor_id)
+    if "totalPatients" in fields:
+        query = (
+            query.add_columns(func.count(patient_model.id).label("totalPatients"))
+            .outerjoin(patient_model, patient_model.visit_id == visit_model.id)
+            .group_by(visit_model.id)
+        )
+    return query.all()
+
+
+def get_visits(db: Session, doctor_id: int, fields: Optional[Sequence[str]] = None):
+    if fields is not None:
+        visits = _visit_rows(db, models.Visit, models.Patient, doctor_id, fields)
+        if archive_in_use():
+            visits = _visit_rows(db, models.ArchivedVisit, models.ArchivedPatient, doctor_id, fields) + visits
+        return visits
+    
     visits = db.query(models.Visit).filter(models.Visit.doctor_id == doctor_id).all()
+    if archive_in_use():
+        # Archived visits are older, so they come first
+        visits = db.query(models.ArchivedVisit).filter(models.ArchivedVisit.doctor_id == doctor_id).all() + visits
     
     # Add totalPatients count to each visit
     for visit in visits:
@@ -70,50 +213,191 @@ def get_visits(db: Session, doctor_id: int):
 
 def get_visit(db: Session, visit_id: int):
     visit = db.query(models.Visit).filter(models.Visit.id == visit_id).first()
+    if visit is None and archive_in_use():
+        visit = db.query(models.ArchivedVisit).filter(models.ArchivedVisit.id == visit_id).first()
     if visit:
         setattr(visit, "totalPatients", len(visit.patients))
     return visit
 
 
+def _find_visit_row(db: Session, visit_model, patient_model, doctor_id: int, visit_date: date):
+    return (
+        db.query(visit_model, func.count(patient_model.id))
+        .outerjoin(patient_model, patient_model.visit_id == visit_model.id)
+        .filter(visit_model.doctor_id == doctor_id, visit_model.date == visit_date)
+        .group_by(visit_model.id)
+        .first()
+    )
+
+
+def find_visit(db: Session, doctor_id: int, visit_date: date):
+    """The doctor's visit on `visit_date` (hot or archived) with its patient count, in one indexed query"""
+    row = _find_visit_row(db, models.Visit, models.Patient, doctor_id, visit_date)
+    if row is None and archive_in_use():
+        row = _find_visit_row(db, models.ArchivedVisit, models.ArchivedPatient, doctor_id, visit_date)
+    if row is None:
+        return None
+    visit, total_patients = row
+    setattr(visit, "totalPatients", total_patients)
+    return visit
+
+
 def create_visit(db: Session, visit: schemas.VisitCreate, doctor_id: int):
+    """
+    Returns None if the doctor already has a visit on that date. Raises LookupError
+    if the doctor does not exist; other integrity errors are re-raised.
+    """
+    # Checked up front: SQLite does not enforce foreign keys by default
+    if get_doctor(db, doctor_id) is None:
+        raise LookupError("Doctor not found")
+    # The unique index only covers hot visits
+    if archive_in_use() and _find_visit_row(
+        db, models.ArchivedVisit, models.ArchivedPatient, doctor_id, visit.date
+    ) is not None:
+        return None
     db_visit = models.Visit(**visit.dict(), doctor_id=doctor_id)
     db.add(db_visit)
+    bump_version(db, "visits")
+    try:
+        db.flush()
+    except IntegrityError:
+        # Tell the unique (doctor_id, date) violation apart from e.g. a foreign key failure
+        db.rollback()
+        if find_visit(db, doctor_id, visit.date) is not None:
+            return None
+        # The doctor may have been deleted meanwhile
+        if get_doctor(db, doctor_id) is None:
+            raise LookupError("Doctor not found")
+        raise
+    record_change(db, "visits", UPSERT, db_visit.id, visit_id=db_visit.id)
     db.commit()
-    db.refresh(db_visit)
     # Add totalPatients for response
     setattr(db_visit, "totalPatients", 0)
     return db_visit
 
 
-def delete_visit(db: Session, visit_id: int):
-    # First, delete associated patients
-    db.query(models.Patient).filter(models.Patient.visit_id == visit_id).delete()
+def get_or_create_visit(db: Session, doctor_id: int, visit_date: date):
+    """
+    Return (visit, created) for the doctor's visit on `visit_date`, or (None, False)
+    if the doctor does not exist. Concurrent callers race on the unique
+    (doctor_id, date) index; the loser returns the winner's visit.
+    """
+    visit = find_visit(db, doctor_id, visit_date)
+    if visit is not None:
+        return visit, False
+    if get_doctor(db, doctor_id) is None:
+        return None, False
+
+    db_visit = models.Visit(doctor_id=doctor_id, date=visit_date)
+    db.add(db_visit)
+    bump_version(db, "visits")
+    try:
+        db.flush()
+    except IntegrityError:
+        # Start a new transaction so the other desk's committed row is visible
+        db.rollback()
+        return find_visit(db, doctor_id, visit_date), False
+    record_change(db, "visits", UPSERT, db_visit.id, visit_id=db_visit.id)
+    db.commit()
+    setattr(db_visit, "totalPatients", 0)
+    return db_visit, True
+
+
+def _delete_visit_rows(db: Session, visit_id: int):
+    """Delete a visit and its patients without committing; True if the visit existed"""
+    # First, delete associated patients (their ids go to the change log)
+    patients = delete(models.Patient).where(models.Patient.visit_id == visit_id)
+    if db.get_bind().dialect.delete_returning:
+        patient_ids = db.execute(patients.returning(models.Patient.id)).scalars().all()
+    else:
+        patient_ids = [row.id for row in db.query(models.Patient.id).filter(models.Patient.visit_id == visit_id)]
+        db.execute(patients)
     
     # Then delete the visit
     result = db.query(models.Visit).filter(models.Visit.id == visit_id).delete()
-    db.commit()
+    record_change(db, "patients", DELETE, *patient_ids, visit_id=visit_id)
+    for patient_id in patient_ids:
+        publish_after_commit(db, visit_id, "patient.deleted", {"id": patient_id})
+    if result:
+        record_change(db, "visits", DELETE, visit_id, visit_id=visit_id)
+        publish_after_commit(db, visit_id, "visit.deleted", {"id": visit_id})
     return result > 0
 
 
+def delete_visit(db: Session, visit_id: int):
+    result = _delete_visit_rows(db, visit_id)
+    bump_version(db, "visits", "patients")
+    db.commit()
+    return result
+
+
 # CRUD Operations for Patients
-def get_all_patients(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Patient).offset(skip).limit(limit).all()
+def _patient_columns(patient_model):
+    return (
+        patient_model.id, patient_model.name, patient_model.contact, patient_model.fee_status,
+        patient_model.visit_id, patient_model.serial_no
+    )
 
 
-def get_patients(db: Session, visit_id: int):
+def _union_by_id(*queries):
+    """UNION ALL of `queries` (hot and archive rows), ordered by id"""
+    rows = union_all(*queries).subquery()
+    return select(rows).order_by(rows.c.id)
+
+
+def get_all_patients(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None):
+    if not archive_in_use():
+        return db.query(*_entities(models.Patient, fields)).offset(skip).limit(limit).all()
+
+    # Hot and archived patients paged together by id
+    query = _union_by_id(*(
+        select(*(_patient_columns(model) if fields is None else columns(model, fields)))
+        for model in (models.Patient, models.ArchivedPatient)
+    )).offset(skip).limit(limit)
+    return db.execute(query).all()
+
+
+def get_patients(db: Session, visit_id: int, fields: Optional[Sequence[str]] = None):
     try:
-        patients = db.query(models.Patient).filter(models.Patient.visit_id == visit_id).all()
+        patients = db.query(*_entities(models.Patient, fields)).filter(models.Patient.visit_id == visit_id).all()
+        if not patients and archive_in_use():
+            patients = db.query(*_entities(models.ArchivedPatient, fields)).filter(
+                models.ArchivedPatient.visit_id == visit_id
+            ).all()
         return patients
     except Exception as e:
         print(f"Database error getting patients: {str(e)}")
         raise
 
 
+def next_serial_no(db: Session, visit_id: int):
+    return (db.query(func.max(models.Patient.serial_no)).filter(models.Patient.visit_id == visit_id).scalar() or 0) + 1
+
+
+def is_archived_visit(db: Session, visit_id: int):
+    return db.query(models.ArchivedVisit.id).filter(models.ArchivedVisit.id == visit_id).first() is not None
+
+
 def create_patient(db: Session, patient: schemas.PatientCreate, visit_id: int, serial_no: int):
+    """Returns None if the visit has been archived (archived visits are read-only)"""
     db_patient = models.Patient(**patient.dict(), visit_id=visit_id, serial_no=serial_no)
     db.add(db_patient)
+    bump_version(db, "patients")
+    try:
+        db.flush()
+    except IntegrityError:
+        # The visit may have been archived (and deleted) since it was looked up
+        db.rollback()
+        if is_archived_visit(db, visit_id):
+            return None
+        raise
+    # Checked after the insert, so a visit archived concurrently is seen
+    if is_archived_visit(db, visit_id):
+        db.rollback()
+        return None
+    record_change(db, "patients", UPSERT, db_patient.id, visit_id=visit_id)
+    publish_after_commit(db, visit_id, "patient.created", patient_event_data(db_patient))
     db.commit()
-    db.refresh(db_patient)
     return db_patient
 
 
@@ -121,37 +405,99 @@ def toggle_patient_fee_status(db: Session, patient_id: int):
     """
     Toggle the fee status of a patient between 'paid' and 'due'
     """
-    patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
+    # Toggled in the UPDATE itself, so concurrent toggles cannot overwrite each other
+    fee_status = case((models.Patient.fee_status == "due", "paid"), else_="due")
+    patient = _update_returning(db, models.Patient, patient_id, {"fee_status": fee_status})
     if not patient:
         return None
     
-    # Toggle the fee status
-    patient.fee_status = "paid" if patient.fee_status == "due" else "due"
+    bump_version(db, "patients")
+    record_change(db, "patients", UPSERT, patient_id, visit_id=patient.visit_id)
+    publish_after_commit(db, patient.visit_id, "patient.fee_toggled", patient_event_data(patient))
     db.commit()
-    db.refresh(patient)
     return patient
 def update_patient(db: Session, patient_id: int, patient_update: schemas.PatientUpdate):
-    patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
+    update_data = patient_update.dict(exclude_unset=True)
+    if not update_data:
+        return db.get(models.Patient, patient_id)
+    
+    patient = _update_returning(db, models.Patient, patient_id, update_data)
     if not patient:
         return None
     
-    update_data = patient_update.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(patient, key, value)
-    
+    bump_version(db, "patients")
+    record_change(db, "patients", UPSERT, patient_id, visit_id=patient.visit_id)
+    publish_after_commit(db, patient.visit_id, "patient.updated", patient_event_data(patient))
     db.commit()
-    db.refresh(patient)
     return patient
 
+def bulk_update_patients(db: Session, updates: List[schemas.PatientBulkUpdateItem]):
+    """
+    Apply explicit target values to many patients in a single transaction.
+    Items with the same payload are grouped into one UPDATE ... WHERE id IN (...)
+    """
+    # Later items for the same id win
+    values_by_id = {}
+    for item in updates:
+        values_by_id[item.id] = item.dict(exclude_unset=True, exclude={"id"})
+
+    if not values_by_id:
+        return []
+
+    # Updated rows come back from UPDATE ... RETURNING where supported, so events carry full
+    # patients; otherwise they are loaded before the UPDATE and given the new values in place
+    returning = db.get_bind().dialect.update_returning
+    loaded = {} if returning else {
+        patient.id: patient
+        for patient in db.query(models.Patient).filter(models.Patient.id.in_(values_by_id.keys())).populate_existing()
+    }
+
+    # Group ids by identical payload so the common case is a single statement
+    groups = {}
+    for patient_id, values in values_by_id.items():
+        if values and (returning or patient_id in loaded):
+            groups.setdefault(tuple(sorted(values.items())), []).append(patient_id)
+
+    updated = []
+    for values, patient_ids in groups.items():
+        statement = (
+            update(models.Patient).where(models.Patient.id.in_(patient_ids)).values(dict(values))
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        if returning:
+            updated += db.execute(statement.returning(models.Patient)).scalars().all()
+            continue
+        db.execute(statement)
+        for patient_id in patient_ids:
+            for key, value in values:
+                set_committed_value(loaded[patient_id], key, value)
+            updated.append(loaded[patient_id])
+
+    existing_ids = set(loaded) | {patient.id for patient in updated}
+    # Items without values were not written; only they still need an existence check
+    unchecked = [patient_id for patient_id, values in values_by_id.items() if not values and returning]
+    if unchecked:
+        existing_ids.update(row.id for row in db.query(models.Patient.id).filter(models.Patient.id.in_(unchecked)))
+    
+    for patient in updated:
+        record_change(db, "patients", UPSERT, patient.id, visit_id=patient.visit_id)
+        publish_after_commit(db, patient.visit_id, "patient.updated", patient_event_data(patient))
+    bump_version(db, "patients")
+    db.commit()
+
+    return [{"id": patient_id, "updated": patient_id in existing_ids} for patient_id in values_by_id]
+
 def delete_patient(db: Session, patient_id: int):
     """
     Delete a patient by ID
     """
-    patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
+    patient = _delete_returning(db, models.Patient, patient_id, models.Patient.visit_id)
     if not patient:
         return False
     
-    db.delete(patient)
+    bump_version(db, "patients")
+    record_change(db, "patients", DELETE, patient_id, visit_id=patient.visit_id)
+    publish_after_commit(db, patient.visit_id, "patient.deleted", {"id": patient_id})
     db.commit()
     return True
 
@@ -161,121 +507,388 @@ def get_unique_patients(db: Session):
     Get all unique patients with information about which doctors they've visited.
     A patient is considered unique based on their name and contact information.
     """
-    # Get all patients
-    all_patients = get_all_patients(db)
+    # One joined query instead of a visit lookup per patient
+    query = (
+        select(*_patient_columns(models.Patient), models.Visit.doctor_id)
+        .outerjoin(models.Visit, models.Patient.visit_id == models.Visit.id)
+    )
+    if archive_in_use():
+        query = _union_by_id(query, (
+            select(*_patient_columns(models.ArchivedPatient), models.ArchivedVisit.doctor_id)
+            .outerjoin(models.ArchivedVisit, models.ArchivedPatient.visit_id == models.ArchivedVisit.id)
+        ))
+    else:
+        query = query.order_by(models.Patient.id)
+    rows = db.execute(query).all()
     
     # Create a dictionary to store unique patients
     unique_patients_dict = {}
     
-    for patient in all_patients:
+    for row in rows:
         # Create a unique key based on name and contact
-        key = f"{patient.name}-{patient.contact}"
+        key = f"{row.name}-{row.contact}"
         
-        # Get the associated visit
-        visit = get_visit(db, patient.visit_id)
+        if key not in unique_patients_dict:
+            # First time seeing this patient
+            unique_patients_dict[key] = {
+                "id": row.id,
+                "name": row.name,
+                "contact": row.contact,
+                "fee_status": row.fee_status,
+                "visit_id": row.visit_id,
+                "serial_no": row.serial_no,
+                "doctor_visits": []
+            }
         
-        if visit:
-            doctor_id = visit.doctor_id
-            
-            if key not in unique_patients_dict:
-                # First time seeing this patient
-                unique_patients_dict[key] = {
-                    "id": patient.id,
-                    "name": patient.name,
-                    "contact": patient.contact,
-                    "fee_status": patient.fee_status,
-                    "doctor_visits": set([doctor_id])
-                }
-            else:
-                # We've seen this patient before, just add the doctor
-                unique_patients_dict[key]["doctor_visits"].add(doctor_id)
-    
-    # Convert sets to lists for JSON serialization
-    for patient in unique_patients_dict.values():
-        patient["doctor_visits"] = list(patient["doctor_visits"])
+        # Record each doctor once, in the order they were first visited
+        doctor_visits = unique_patients_dict[key]["doctor_visits"]
+        if row.doctor_id is not None and row.doctor_id not in doctor_visits:
+            doctor_visits.append(row.doctor_id)
     
     return list(unique_patients_dict.values())
 
 
+def get_unique_patients_shared(db: Session):
+    """
+    get_unique_patients, with concurrent calls collapsed into a single scan.
+    The result is shared between callers and must not be modified.
+    """
+    return flights.do("unique-patients", lambda: get_unique_patients(db), stale_for=UNIQUE_PATIENTS_STALE_FOR)
+
+
+def count_visits(db: Session, doctor_id: int):
+    count = db.query(func.count(models.Visit.id)).filter(models.Visit.doctor_id == doctor_id).scalar()
+    if archive_in_use():
+        count += db.query(func.count(models.ArchivedVisit.id)).filter(models.ArchivedVisit.doctor_id == doctor_id).scalar()
+    return count
+
+
 # CRUD Operations for Doctor Schedules
-def get_schedules(db: Session, skip: int = 0, limit: int = 100):
+def get_schedules(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None):
     """Get all doctor schedules"""
-    return db.query(models.DoctorSchedule).offset(skip).limit(limit).all()
+    return db.query(*_entities(models.DoctorSchedule, fields)).offset(skip).limit(limit).all()
+
+def get_available_schedules(db: Session):
+    return db.query(models.DoctorSchedule).filter(models.DoctorSchedule.is_available == True).all()
+
+def get_schedule(db: Session, schedule_id: int):
+    return db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == schedule_id).first()
+
+def _lock_schedules(db: Session):
+    """
+    Bump the schedules version before checking for conflicts: the row lock it takes
+    serializes schedule writes across workers until commit. Returns the new version.
+    
+    The bump must be the first statement of its transaction. Under REPEATABLE READ
+    (InnoDB's default) the first read fixes the snapshot, and one taken before the
+    lock would miss a schedule the previous lock holder just committed. So any
+    transaction the caller opened with lookups is ended first, and everything the
+    conflict check depends on is read after the lock.
+    """
+    db.commit()
+    bump_version(db, "doctor_schedules")
+    version = db.query(models.DataVersion.version).filter(
+        models.DataVersion.name == "doctor_schedules"
+    ).scalar()
+    timetable.schedule_intervals.sync(db, version - 1)
+    return version
+
+def _check_schedule_conflict(db: Session, key, start_time, end_time, exclude_id: Optional[int] = None):
+    conflict_id = timetable.schedule_intervals.find_conflict(key, start_time, end_time, exclude_id)
+    if conflict_id is not None:
+        db.rollback()
+        raise timetable.ScheduleConflict(conflict_id)
 
 def create_schedule(db: Session, schedule: schemas.DoctorScheduleCreate, image_filename: Optional[str] = None):
-    """Create a new doctor schedule with optional image file"""
+    """
+    Create a new doctor schedule with optional image file.
+    Raises ValueError for an invalid time range and ScheduleConflict for an overlapping slot.
+    """
     schedule_data = schedule.dict()
+    timetable.validate_range(schedule_data["start_time"], schedule_data["end_time"])
+    version = _lock_schedules(db)
+    
+    # Link to the doctor by name when no doctor_id was given
+    if schedule_data.get("doctor_id") is None:
+        schedule_data["doctor_id"] = match_doctor_id(db, schedule_data["name"])
     
     # Add image filename if provided
     if image_filename:
         schedule_data["image_filename"] = image_filename
     
+    key = timetable.slot_key(
+        schedule_data["doctor_id"], schedule_data["name"],
+        schedule_data["day_of_week"], schedule_data["specific_date"]
+    )
+    _check_schedule_conflict(db, key, schedule_data["start_time"], schedule_data["end_time"])
+    
     db_schedule = models.DoctorSchedule(**schedule_data)
     db.add(db_schedule)
+    db.flush()
+    record_change(db, "doctor_schedules", UPSERT, db_schedule.id)
     db.commit()
-    db.refresh(db_schedule)
+    
+    timetable.schedule_intervals.apply(
+        version, db_schedule.id, key, db_schedule.start_time, db_schedule.end_time
+    )
     return db_schedule
 
 def update_schedule(db: Session, schedule_id: int, schedule: schemas.DoctorScheduleUpdate, image_filename: Optional[str] = None):
-    """Update a doctor schedule with optional image file"""
-    db_schedule = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == schedule_id).first()
+    """
+    Update a doctor schedule with optional image file.
+    Raises ValueError for an invalid time range and ScheduleConflict for an overlapping slot.
+    """
+    version = _lock_schedules(db)
+    # Read after the lock, so the merged values reflect the latest committed row
+    db_schedule = db.query(models.DoctorSchedule).filter(
+        models.DoctorSchedule.id == schedule_id
+    ).populate_existing().first()
     if not db_schedule:
+        db.rollback()
         return None
     
-    # Update schedule data
+    # Check the merged values before touching the row
     update_data = schedule.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_schedule, key, value)
+    merged = {
+        field: update_data.get(field, getattr(db_schedule, field))
+        for field in ("doctor_id", "name", "day_of_week", "specific_date", "start_time", "end_time")
+    }
+    try:
+        timetable.validate_range(merged["start_time"], merged["end_time"])
+    except ValueError:
+        db.rollback()
+        raise
+    key = timetable.slot_key(merged["doctor_id"], merged["name"], merged["day_of_week"], merged["specific_date"])
+    _check_schedule_conflict(db, key, merged["start_time"], merged["end_time"], exclude_id=schedule_id)
+    
+    # Update schedule data
+    for key_name, value in update_data.items():
+        setattr(db_schedule, key_name, value)
     
     # Update image filename if provided
     if image_filename is not None:
         setattr(db_schedule, "image_filename", image_filename)
     
+    record_change(db, "doctor_schedules", UPSERT, schedule_id)
     db.commit()
-    db.refresh(db_schedule)
+    
+    timetable.schedule_intervals.apply(version, schedule_id, key, db_schedule.start_time, db_schedule.end_time)
     return db_schedule
 
 def delete_schedule(db: Session, schedule_id: int):
+    version = _lock_schedules(db)
     result = db.query(models.DoctorSchedule).filter(models.DoctorSchedule.id == schedule_id).delete()
+    if result:
+        record_change(db, "doctor_schedules", DELETE, schedule_id)
     db.commit()
+    timetable.schedule_intervals.apply(version, schedule_id)
     return result > 0
 
 
 # CRUD Operations for Gallery
-def get_gallery_images(db: Session, skip: int = 0, limit: int = 100, active_only: bool = True):
-    query = db.query(models.GalleryImage)
+def get_gallery_images(db: Session, skip: int = 0, limit: int = 100, active_only: bool = True,
+                       fields: Optional[Sequence[str]] = None):
+    query = db.query(*_entities(models.GalleryImage, fields))
     if active_only:
         query = query.filter(models.GalleryImage.is_active == True)
     
-    # Order by order_index
-    query = query.order_by(models.GalleryImage.order_index)
+    # Order by rank key (served from the (is_active, rank_key) index)
+    query = query.order_by(models.GalleryImage.rank_key, models.GalleryImage.id)
     
-    return query.offset(skip).limit(limit).all()
+    images = query.offset(skip).limit(limit).all()
+    if fields is None:
+        return _set_positions(images, skip)
+    if "order_index" in fields:
+        # Column rows are read-only, so positions go into plain dicts
+        return [dict(row._asdict(), order_index=position) for position, row in enumerate(images, skip)]
+    return images
+
+
+def _set_positions(images, start: int = 0):
+    """Report each image's place in the (rank-ordered) list as its legacy order_index"""
+    for position, image in enumerate(images, start):
+        setattr(image, "order_index", position)
+    return images
+
+
+def gallery_position(db: Session, image):
+    """Set the image's legacy order_index to its 0-based place in the full gallery order (one count)"""
+    gallery = models.GalleryImage
+    position = db.query(func.count(gallery.id)).filter(or_(
+        gallery.rank_key < image.rank_key,
+        and_(gallery.rank_key == image.rank_key, gallery.id < image.id),
+    )).scalar()
+    setattr(image, "order_index", position)
+    return image
+
+
+def next_gallery_rank(db: Session):
+    """Rank key that places a new image after every existing one"""
+    last_rank = db.query(func.max(models.GalleryImage.rank_key)).scalar()
+    return rank_between(last_rank, None)
 
 
 def get_gallery_image(db: Session, image_id: int):
     return db.query(models.GalleryImage).filter(models.GalleryImage.id == image_id).first()
 
 
+def gallery_neighbours(db: Session, image_id: int, position: int):
+    """(after_id, before_id) that put `image_id` at 0-based `position` of the gallery order"""
+    ordered_ids = [
+        row.id for row in db.query(models.GalleryImage.id).filter(models.GalleryImage.id != image_id).order_by(
+            models.GalleryImage.rank_key, models.GalleryImage.id
+        )
+    ]
+    position = max(0, min(position, len(ordered_ids)))
+    after_id = ordered_ids[position - 1] if position > 0 else None
+    before_id = ordered_ids[position] if position < len(ordered_ids) else None
+    return after_id, before_id
+
+
+def place_gallery_image(db: Session, image_id: int, position: int):
+    """
+    Move an image to a legacy order_index position, committing any pending changes
+    with it. Returns the image (None if it does not exist).
+    """
+    after_id, before_id = gallery_neighbours(db, image_id, position)
+    if after_id is None and before_id is None:
+        # The only image: nothing to move
+        db.commit()
+        return gallery_position(db, get_gallery_image(db, image_id))
+    return move_gallery_image(db, image_id, after_id, before_id)
+
+
 def create_gallery_image(db: Session, image_data):
+    image_data = dict(image_data)
+    position = image_data.pop("order_index", None)
     db_image = models.GalleryImage(**image_data)
+    if db_image.rank_key is None:
+        db_image.rank_key = next_gallery_rank(db)
     db.add(db_image)
+    bump_version(db, "gallery_images")
+    db.flush()
+    record_change(db, "gallery_images", UPSERT, db_image.id)
+    if position is not None:
+        # Legacy clients place images by position; appended above, moved into place here
+        return place_gallery_image(db, db_image.id, position)
     db.commit()
-    db.refresh(db_image)
-    return db_image
+    return gallery_position(db, db_image)
 
 
 def update_gallery_image(db: Session, image_id: int, image_data):
-    db_image = db.query(models.GalleryImage).filter(models.GalleryImage.id == image_id).first()
-    if not db_image:
-        return None
+    """Update image details; a legacy order_index moves the image to that position"""
+    image_data = dict(image_data)
+    position = image_data.pop("order_index", None)
+    if not image_data and position is None:
+        return get_gallery_image(db, image_id)
     
-    for key, value in image_data.items():
-        setattr(db_image, key, value)
+    if image_data:
+        db_image = _update_returning(db, models.GalleryImage, image_id, image_data)
+        if not db_image:
+            return None
+        bump_version(db, "gallery_images")
+        record_change(db, "gallery_images", UPSERT, image_id)
+    elif not get_gallery_image(db, image_id):
+        return None
     
+    if position is not None:
+        return place_gallery_image(db, image_id, position)
     db.commit()
-    db.refresh(db_image)
-    return db_image
+    return gallery_position(db, db_image)
+
+
+def move_gallery_image(db: Session, image_id: int, after_id: Optional[int] = None, before_id: Optional[int] = None):
+    """
+    Move an image so it sits after `after_id` and/or before `before_id`.
+    Only the moved row is written, unless its new key would be too long
+    and the whole gallery has to be rebalanced.
+    """
+    db_image = get_gallery_image(db, image_id)
+    if not db_image:
+        return None
+    if after_id is None and before_id is None:
+        raise ValueError("Either after_id or before_id is required")
+    if image_id in (after_id, before_id):
+        raise ValueError("An image cannot be moved relative to itself")
+
+    others = db.query(models.GalleryImage).filter(models.GalleryImage.id != image_id)
+
+    lower = upper = None
+    if after_id is not None:
+        after = get_gallery_image(db, after_id)
+        if not after:
+            raise ValueError(f"Image {after_id} not found")
+        lower = after.rank_key
+    if before_id is not None:
+        before = get_gallery_image(db, before_id)
+        if not before:
+            raise ValueError(f"Image {before_id} not found")
+        upper = before.rank_key
+
+    # Fill in the missing neighbour with a single indexed lookup
+    if before_id is None:
+        upper = others.filter(models.GalleryImage.rank_key > lower).with_entities(
+            func.min(models.GalleryImage.rank_key)
+        ).scalar()
+    elif after_id is None:
+        lower = others.filter(models.GalleryImage.rank_key < upper).with_entities(
+            func.max(models.GalleryImage.rank_key)
+        ).scalar()
+
+    if lower is not None and upper is not None and lower >= upper:
+        raise ValueError("after_id must come before before_id")
+
+    new_rank = rank_between(lower, upper)
+    if len(new_rank) > RANK_REBALANCE_LENGTH:
+        ordered_ids = [
+            row.id for row in others.with_entities(models.GalleryImage.id).order_by(
+                models.GalleryImage.rank_key, models.GalleryImage.id
+            )
+        ]
+        anchor = ordered_ids.index(after_id) + 1 if after_id is not None else ordered_ids.index(before_id)
+        ordered_ids.insert(anchor, image_id)
+        set_gallery_order(db, ordered_ids)
+        return gallery_position(db, get_gallery_image(db, image_id))
+
+    db_image.rank_key = new_rank
+    bump_version(db, "gallery_images")
+    record_change(db, "gallery_images", UPSERT, image_id)
+    db.commit()
+    return gallery_position(db, db_image)
+
+
+def set_gallery_order(db: Session, image_ids: List[int]):
+    """
+    Rewrite the full gallery order in one transaction.
+    Images not listed keep their relative order after the listed ones.
+    """
+    if len(set(image_ids)) != len(image_ids):
+        raise ValueError("Duplicate image ids in order")
+
+    current_ids = [
+        row.id for row in db.query(models.GalleryImage.id).order_by(
+            models.GalleryImage.rank_key, models.GalleryImage.id
+        )
+    ]
+    unknown = set(image_ids) - set(current_ids)
+    if unknown:
+        raise ValueError(f"Images not found: {sorted(unknown)}")
+
+    listed = set(image_ids)
+    ordered_ids = list(image_ids) + [image_id for image_id in current_ids if image_id not in listed]
+
+    db.bulk_update_mappings(models.GalleryImage, [
+        {"id": image_id, "rank_key": rank_key}
+        for image_id, rank_key in zip(ordered_ids, rank_sequence(len(ordered_ids)))
+    ])
+    bump_version(db, "gallery_images")
+    record_change(db, "gallery_images", UPSERT, *ordered_ids)
+    db.commit()
+
+    return _set_positions(
+        db.query(models.GalleryImage).order_by(models.GalleryImage.rank_key, models.GalleryImage.id)
+        .populate_existing().all()
+    )
 
 
 def delete_gallery_image(db: Session, image_id: int):
@@ -284,5 +897,7 @@ def delete_gallery_image(db: Session, image_id: int):
         return None
     
     db.delete(db_image)
+    bump_version(db, "gallery_images")
+    record_change(db, "gallery_images", DELETE, image_id)
     db.commit()
     return db_image
\ No newline at end of file
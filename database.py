@@ -1,19 +1,85 @@
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 load_dotenv()  # Load from .env
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")  # Optional read replica
 
 engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+# Objects stay loaded after commit, so returning them does not cost another SELECT
+SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
+# Without a replica, reads simply use the primary
+read_engine = create_engine(READ_DATABASE_URL, pool_pre_ping=True) if READ_DATABASE_URL else engine
+
+# After a write, the client's reads stay on the primary for a few seconds (read-your-writes)
+PRIMARY_PIN_COOKIE = "primary_pin"
+PRIMARY_PIN_SECONDS = int(os.getenv("PRIMARY_PIN_SECONDS", "5"))
+
+# How long to stop using a replica that failed to connect
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+_replica_down_until = 0.0
+
+class ReadSession(Session):
+    """
+    Session on the replica that connects on first use, so a route that never
+    queries (e.g. a 304 from the cache) does not check out a connection.
+    Falls back to the primary if the replica cannot be reached.
+    """
+
+    _connection = None
+    _read_bind = None
+
+    def get_bind(self, *args, **kwargs):
+        global _replica_down_until
+        if self._read_bind is None:
+            self._read_bind = engine
+            if time.monotonic() >= _replica_down_until:
+                try:
+                    self._read_bind = self._connection = read_engine.connect()
+                except OperationalError:
+                    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        return self._read_bind
+
+    def close(self):
+        super().close()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+ReadSessionLocal = sessionmaker(class_=ReadSession, autocommit=False, autoflush=False)
+
+def get_db(response: Response):
     db = SessionLocal()
+    db.info["response"] = response
+    try:
+        yield db
+    finally:
+        db.close()
+
+@event.listens_for(SessionLocal, "after_commit")
+def _pin_reads_to_primary(session):
+    response = session.info.get("response")
+    if response is not None and read_engine is not engine:
+        response.set_cookie(PRIMARY_PIN_COOKIE, "1", max_age=PRIMARY_PIN_SECONDS, httponly=True, samesite="lax")
+
+def is_pinned_to_primary(request: Request):
+    return read_engine is not engine and PRIMARY_PIN_COOKIE in request.cookies
+
+def get_read_db(request: Request):
+    """Session for read-only routes: the replica, unless the client just wrote or the replica is down"""
+    if read_engine is not engine and not is_pinned_to_primary(request) and time.monotonic() >= _replica_down_until:
+        db = ReadSessionLocal()
+    else:
+        db = SessionLocal()
     try:
         yield db
     finally:
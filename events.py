@@ -0,0 +1,271 @@
+"""
+Live visit queues over Server-Sent Events.
+
+Patient writes in crud.py queue an event on the session
+(`publish_after_commit`); once the transaction commits, the event is
+serialized once and fanned out to every open stream for that visit.
+Deleting a visit sends `patient.deleted` for each of its patients, then
+`visit.deleted`. Each visit keeps a short replay buffer, so a reconnecting client that sends
+Last-Event-ID gets what it missed. A client that is too far behind, lagging
+on a full queue, or reconnecting to a different worker gets a `resync` event
+and should re-fetch `GET /patients/{visit_id}`.
+
+The broker lives in each worker's memory. When the shared `data_versions`
+counter shows that another worker wrote patients, the broker reads the new
+change log entries (see changelog.py) and sends `resync` only to the streams
+of the visits that changed.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import changelog
+import schemas
+from cache import tracker
+from database import SessionLocal
+
+# Events kept per visit for Last-Event-ID replay
+SSE_HISTORY = int(os.getenv("SSE_HISTORY", "256"))
+# Visits whose history is kept (least recently written are forgotten first)
+SSE_MAX_VISITS = int(os.getenv("SSE_MAX_VISITS", "1024"))
+# Undelivered events per stream before the client is told to resync
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "64"))
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "1000"))
+# How often idle streams look for writes from other workers, and send a keep-alive
+SSE_SYNC_INTERVAL = float(os.getenv("SSE_SYNC_INTERVAL", "2"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+RESYNC = "resync"
+
+
+def format_event(event_id: Optional[str], event_type: str, data) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'), default=str)}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscription:
+    def __init__(self, broker, visit_id: int, loop):
+        self.broker = broker
+        self.visit_id = visit_id
+        self.loop = loop
+        self.queue = asyncio.Queue(SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, frame: bytes):
+        """Runs on the subscriber's event loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Drop the backlog and tell the client to re-fetch instead of buffering without bound
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_event(None, RESYNC, {"reason": "lagging"}))
+
+    async def next_frame(self, timeout: float) -> Optional[bytes]:
+        """Next frame to send, or None if nothing arrived within `timeout`"""
+        try:
+            frame = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if self.queue.empty():
+            self.overflowed = False
+        return frame
+
+
+class VisitEventBroker:
+    def __init__(self, history: int = 256, max_visits: int = 1024, max_subscribers: int = 1000):
+        self.history = history
+        self.max_visits = max_visits
+        self.max_subscribers = max_subscribers
+        self.epoch = uuid.uuid4().hex[:8]    # event ids from another process or worker are not resumable
+        self._visits = OrderedDict()   # visit_id -> (last event number, deque of (number, frame))
+        self._subscribers = {}  # visit_id -> set of Subscription
+        self._count = 0
+        self._lock = threading.Lock()
+        self._published = 0
+        self._dropped = 0
+        self._external = {}     # visit_id -> writes by other processes seen while it had streams
+        self._external_seen = None
+        self._change_cursor = None
+        self._change_backlog = False
+        self._next_poll = 0.0
+        self._poll_lock = threading.Lock()
+
+    def publish(self, visit_id: int, event_type: str, data):
+        """Record an event and push it to the visit's streams (safe from any thread)"""
+        with self._lock:
+            number, buffer = self._visits.pop(visit_id, (0, None))
+            number += 1
+            if buffer is None:
+                buffer = deque(maxlen=self.history)
+            frame = format_event(f"{self.epoch}-{number}", event_type, data)
+            buffer.append((number, frame))
+            self._visits[visit_id] = (number, buffer)
+            if len(self._visits) > self.max_visits:
+                self._visits.popitem(last=False)
+            subscribers = list(self._subscribers.get(visit_id, ()))
+            self._published += 1
+
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, frame)
+            except RuntimeError:    # the stream's loop is already closed
+                self._dropped += 1
+
+    def subscribe(self, visit_id: int, last_event_id: Optional[str] = None):
+        """
+        Open a stream for `visit_id`. Returns (subscription, backlog frames),
+        or (None, None) when the subscriber limit is reached.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None, None
+            subscription = Subscription(self, visit_id, loop)
+            self._subscribers.setdefault(visit_id, set()).add(subscription)
+            self._count += 1
+            backlog = self._backlog(visit_id, last_event_id)
+        return subscription, backlog
+
+    def _backlog(self, visit_id, last_event_id):
+        if not last_event_id:
+            return []
+        epoch, _, number = last_event_id.partition("-")
+        if epoch != self.epoch or not number.isdigit():
+            return [format_event(None, RESYNC, {"reason": "unknown_event_id"})]
+
+        number = int(number)
+        sequence, buffer = self._visits.get(visit_id, (0, ()))
+        if number > sequence or (number < sequence and buffer[0][0] > number + 1):
+            return [format_event(None, RESYNC, {"reason": "history_exceeded"})]
+        return [frame for event_number, frame in buffer if event_number > number]
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.visit_id)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.visit_id]
+                    self._external.pop(subscription.visit_id, None)
+
+    def external_changes(self, visit_id: int) -> int:
+        """Counter that moves when another process changes the visit's queue (blocking; run in an executor)"""
+        self._poll_external_changes()
+        with self._lock:
+            return self._external.get(visit_id, 0)
+
+    def _poll_external_changes(self):
+        """
+        At most once per SSE_SYNC_INTERVAL per worker, however many streams are open.
+        The change log is only read when the patients table changed more often than
+        this worker committed to it, i.e. another worker wrote.
+        """
+        with self._poll_lock:
+            now = time.monotonic()
+            if now < self._next_poll:
+                return
+            self._next_poll = now + SSE_SYNC_INTERVAL
+
+            external = tracker.get("patients") - tracker.local_commits("patients")
+            if external == self._external_seen and not self._change_backlog:
+                return
+            self._external_seen = external
+
+            db = SessionLocal()
+            try:
+                if self._change_cursor is None:
+                    self._change_cursor = changelog.latest_cursor(db)
+                    return
+                entries, self._change_cursor, has_more, waiting = changelog.entries_after(db, self._change_cursor)
+                self._change_backlog = has_more or waiting
+            finally:
+                db.close()
+
+        changed = {
+            entry.visit_id for entry in entries
+            if entry.visit_id is not None and entry.origin != changelog.ORIGIN
+        }
+        with self._lock:
+            for visit_id in changed:
+                if visit_id in self._subscribers:
+                    self._external[visit_id] = self._external.get(visit_id, 0) + 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "subscribers": self._count,
+                "visits": len(self._subscribers),
+                "published": self._published,
+                "dropped": self._dropped,
+            }
+
+
+broker = VisitEventBroker(SSE_HISTORY, SSE_MAX_VISITS, SSE_MAX_SUBSCRIBERS)
+
+
+async def stream_visit_events(subscription: Subscription, backlog):
+    """Async generator of SSE frames for a StreamingResponse"""
+    loop = asyncio.get_running_loop()
+    try:
+        # Tells EventSource clients how long to wait before reconnecting
+        yield b"retry: 3000\n\n"
+        for frame in backlog:
+            yield frame
+
+        generation = await loop.run_in_executor(None, broker.external_changes, subscription.visit_id)
+        idle = 0.0
+        while True:
+            frame = await subscription.next_frame(SSE_SYNC_INTERVAL)
+            if frame is not None:
+                idle = 0.0
+                yield frame
+                continue
+
+            current = await loop.run_in_executor(None, broker.external_changes, subscription.visit_id)
+            if current != generation:
+                generation = current
+                idle = 0.0
+                yield format_event(None, RESYNC, {"reason": "external_write"})
+                continue
+
+            idle += SSE_SYNC_INTERVAL
+            if idle >= SSE_HEARTBEAT_SECONDS:
+                idle = 0.0
+                yield b": keep-alive\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def patient_event_data(patient) -> dict:
+    return schemas.PatientResponse.model_validate(patient).model_dump(mode="json")
+
+
+def publish_after_commit(db: Session, visit_id: int, event_type: str, data):
+    """Queue an event to be published once the session's transaction commits (dropped on rollback)"""
+    db.info.setdefault("visit_events", []).append((visit_id, event_type, data))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_events(session):
+    for visit_id, event_type, data in session.info.pop("visit_events", []):
+        broker.publish(visit_id, event_type, data)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_events(session, previous_transaction):
+    session.info.pop("visit_events", None)
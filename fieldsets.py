@@ -0,0 +1,65 @@
+"""
+Sparse fieldsets for list endpoints (`?fields=id,name`).
+
+The requested names are checked against the endpoint's response schema,
+pushed into the query as a column list (rows instead of full entities), and
+serialized with a response model that has only those fields.
+"""
+from typing import Optional, Sequence, Tuple
+from fastapi import HTTPException, Query
+from pydantic import ConfigDict, create_model
+from sqlalchemy import inspect
+
+
+def parse_fields(fields: Optional[str], schema) -> Optional[Tuple[str, ...]]:
+    """Requested field names in order, without duplicates; None means all fields. Raises ValueError."""
+    if fields is None:
+        return None
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    if not names:
+        raise ValueError("fields must name at least one field")
+    unknown = [name for name in names if name not in schema.model_fields]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(schema.model_fields)}"
+        )
+    return names
+
+
+def fields_param(schema):
+    """Dependency that reads and validates `?fields=` for endpoints returning `schema`"""
+    def dependency(
+        fields: Optional[str] = Query(None, description=f"Comma-separated subset of {schema.__name__} fields")
+    ):
+        try:
+            return parse_fields(fields, schema)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return dependency
+
+
+_partial_models = {}
+
+
+def partial_model(schema, names: Optional[Sequence[str]]):
+    """`schema` restricted to `names` (the schema itself when names is None)"""
+    if names is None:
+        return schema
+    key = (schema, tuple(names))
+    model = _partial_models.get(key)
+    if model is None:
+        model = _partial_models[key] = create_model(
+            f"{schema.__name__}Fields",
+            __config__=ConfigDict(from_attributes=True, populate_by_name=True),
+            **{name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in names}
+        )
+    return model
+
+
+def columns(model, names: Sequence[str]):
+    """
+    Mapped columns of `model` for `names`, always starting with the primary key
+    (names that are not columns, such as computed counts, are left to the caller)
+    """
+    column_names = inspect(model).column_attrs.keys()
+    return [model.id] + [getattr(model, name) for name in names if name in column_names and name != "id"]
@@ -0,0 +1,342 @@
+"""
+Idempotency keys for retried POSTs.
+
+A client that sends `Idempotency-Key: <unique value>` with a create request
+can safely retry it: the first response is stored, and a retry with the same
+key gets that response back (with `Idempotent-Replayed: true`). The handler
+does not run again. The request body is read up front and its SHA-256 is part
+of the key's fingerprint, so reusing a key for a different body (or path)
+gets a 422 instead of someone else's response. The body is hashed as it
+arrives and waits for the handler in memory, or on disk past
+IDEMPOTENCY_SPOOL_BYTES; keyed bodies over IDEMPOTENCY_MAX_BODY_BYTES get a 413.
+
+Keys live in a local SQLite file shared by all workers on the host. Entries
+expire after IDEMPOTENCY_TTL_SECONDS, and the oldest are dropped once there
+are more than IDEMPOTENCY_MAX_KEYS. Server errors (5xx) are not stored, so
+those requests can be retried for real. While a request runs its claim is
+renewed, so only a claim left by a crashed worker expires, after
+IDEMPOTENCY_LOCK_SECONDS. The store is only called from a thread pool.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from fnmatch import fnmatchcase
+from typing import Iterable, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+
+NEW = "new"
+REPLAY = "replay"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+MAX_KEY_LENGTH = 255
+MAX_STORED_BODY = 64 * 1024
+MAX_KEYED_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", str(20 * 1024 * 1024)))
+SPOOL_BODY = int(os.getenv("IDEMPOTENCY_SPOOL_BYTES", str(1024 * 1024)))
+_REPLAY_CHUNK = 64 * 1024
+
+# Per-request headers that must not be replayed
+_UNSTORED_HEADERS = {b"content-length", b"date", b"server", b"x-db-round-trips"}
+
+
+class IdempotencyStore:
+    def __init__(self, path: str, ttl_seconds: float = 86400, max_keys: int = 100000,
+                 lock_seconds: float = 60, purge_interval: float = 60):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.lock_seconds = lock_seconds    # An unfinished entry older than this was abandoned by a crashed worker
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._db = None
+        self._next_purge = 0
+        self._replayed = 0
+        self._conflicts = 0
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, "
+                "headers TEXT, body BLOB, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created_at ON idempotency_keys (created_at)")
+        return self._db
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[tuple]]:
+        """
+        Claim `key` for a request. Returns (NEW, None) if the caller should run it,
+        (REPLAY, (status, headers, body)) for a stored response, or IN_PROGRESS / MISMATCH.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            if now >= self._next_purge:
+                self._purge(db, now)
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT fingerprint, status, headers, body, created_at FROM idempotency_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or (row[1] is None and row[4] < now - self.lock_seconds) or row[4] < now - self.ttl_seconds:
+                    db.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, created_at) VALUES (?, ?, ?)",
+                        (key, fingerprint, now)
+                    )
+                    return NEW, None
+            finally:
+                db.execute("COMMIT")
+
+        fingerprint_stored, status, headers, body, _ = row
+        if fingerprint_stored != fingerprint:
+            return MISMATCH, None
+        if status is None:
+            self._conflicts += 1
+            return IN_PROGRESS, None
+        self._replayed += 1
+        return REPLAY, (status, [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(headers)], body)
+
+    def complete(self, key: str, status: int, headers, body: bytes):
+        stored_headers = json.dumps([
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in headers if name.lower() not in _UNSTORED_HEADERS
+        ])
+        with self._lock:
+            self._connection().execute(
+                "UPDATE idempotency_keys SET status = ?, headers = ?, body = ? WHERE key = ?",
+                (status, stored_headers, body, key)
+            )
+
+    def touch(self, key: str):
+        """Renew an unfinished claim, so it does not look abandoned"""
+        with self._lock:
+            self._connection().execute(
+                "UPDATE idempotency_keys SET created_at = ? WHERE key = ? AND status IS NULL", (time.time(), key)
+            )
+
+    def release(self, key: str):
+        """Forget an unfinished key so the request can be retried"""
+        with self._lock:
+            self._connection().execute("DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,))
+
+    def _purge(self, db, now: float):
+        db.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - self.ttl_seconds,))
+        db.execute(
+            "DELETE FROM idempotency_keys WHERE created_at <= "
+            "(SELECT created_at FROM idempotency_keys ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_keys,)
+        )
+        self._next_purge = now + self.purge_interval
+
+    def metrics(self):
+        with self._lock:
+            keys = self._connection().execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
+        return {"keys": keys, "replayed": self._replayed, "in_progress_conflicts": self._conflicts}
+
+
+idempotency_store = IdempotencyStore(
+    os.getenv("IDEMPOTENCY_STORE_PATH", "idempotency_keys.db"),
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+    max_keys=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000")),
+    lock_seconds=float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60")),
+)
+
+
+async def _send_json(send, status: int, detail: str, extra_headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *extra_headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+_BOUNDARY = re.compile(rb'boundary="?([^";]+)"?')
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class _BodyHash:
+    """
+    SHA-256 of a streamed body, leaving out the multipart boundary (clients pick a
+    new one for every send). A delimiter split across chunks is held back until
+    the next chunk, so the hash does not depend on how the body was chunked.
+    """
+
+    def __init__(self, content_type: bytes):
+        boundary = _BOUNDARY.search(content_type)
+        self._delimiter = b"--" + boundary.group(1) if content_type.startswith(b"multipart/") and boundary else None
+        self._digest = hashlib.sha256()
+        self._pending = b""
+
+    def update(self, chunk: bytes):
+        if self._delimiter is None:
+            self._digest.update(chunk)
+            return
+        *parts, last = (self._pending + chunk).split(self._delimiter)
+        for part in parts:
+            self._digest.update(part)
+            self._digest.update(b"--")
+        keep = max(0, len(last) - len(self._delimiter) + 1)
+        self._digest.update(last[:keep])
+        self._pending = last[keep:]
+
+    def hexdigest(self) -> str:
+        self._digest.update(self._pending)
+        self._pending = b""
+        return self._digest.hexdigest()
+
+
+async def _read_body(scope, receive, body):
+    """
+    Copy the request body into the spooled file `body` and return its hash, or None
+    if the client disconnected. Raises _BodyTooLarge past MAX_KEYED_BODY.
+    """
+    headers = dict(scope["headers"])
+    if int(headers.get(b"content-length", b"0") or 0) > MAX_KEYED_BODY:
+        raise _BodyTooLarge()
+    body_hash = _BodyHash(headers.get(b"content-type", b""))
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_KEYED_BODY:
+            raise _BodyTooLarge()
+        body_hash.update(chunk)
+        if size > SPOOL_BODY:
+            # The file has moved (or is moving) to disk
+            await run_in_threadpool(body.write, chunk)
+        else:
+            body.write(chunk)
+        if not message.get("more_body", False):
+            return body_hash.hexdigest()
+
+
+def _replay_body(body, receive):
+    """A `receive` that hands the app the body spooled by _read_body, then defers to the client"""
+    size = body.tell()
+    body.seek(0)
+    done = False
+
+    async def replay():
+        nonlocal done
+        if done:
+            return await receive()
+        if size > SPOOL_BODY:
+            chunk = await run_in_threadpool(body.read, _REPLAY_CHUNK)
+        else:
+            chunk = body.read(_REPLAY_CHUNK)
+        done = body.tell() >= size
+        return {"type": "http.request", "body": chunk, "more_body": not done}
+    return replay
+
+
+class IdempotencyMiddleware:
+    """Honours Idempotency-Key on POSTs whose path matches one of `patterns` (fnmatch style)"""
+
+    def __init__(self, app, patterns: Iterable[str], store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.patterns = list(patterns)
+        self.store = store
+
+    def _key(self, scope) -> Optional[str]:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return None
+        if not any(fnmatchcase(scope["path"], pattern) for pattern in self.patterns):
+            return None
+        for name, value in scope["headers"]:
+            if name == b"idempotency-key":
+                return value.decode("latin-1")
+        return None
+
+    async def __call__(self, scope, receive, send):
+        key = self._key(scope)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BODY) as body:
+            try:
+                body_hash = await _read_body(scope, receive, body)
+            except _BodyTooLarge:
+                await _send_json(send, 413, f"Requests with an Idempotency-Key are limited to {MAX_KEYED_BODY} bytes")
+                return
+            if body_hash is None:
+                return
+            await self._run(scope, _replay_body(body, receive), send, key, body_hash)
+
+    async def _run(self, scope, receive, send, key: str, body_hash: str):
+        fingerprint = f"POST {scope['path']}?{scope['query_string'].decode('latin-1')} {body_hash}"
+        state, stored = await run_in_threadpool(self.store.begin, key, fingerprint)
+        if state == MISMATCH:
+            await _send_json(send, 422, "Idempotency-Key was already used for a different request")
+            return
+        if state == IN_PROGRESS:
+            await _send_json(
+                send, 409, "A request with this Idempotency-Key is still in progress", [(b"retry-after", b"1")]
+            )
+            return
+        if state == REPLAY:
+            status, headers, body = stored
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": headers + [
+                    (b"content-length", str(len(body)).encode()),
+                    (b"idempotent-replayed", b"true"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        response = {"status": None, "headers": [], "body": bytearray(), "complete": False}
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                if len(response["body"]) <= MAX_STORED_BODY:
+                    response["body"] += message.get("body", b"")
+                response["complete"] = not message.get("more_body", False)
+            await send(message)
+
+        renewal = asyncio.create_task(self._renew(key))
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            renewal.cancel()
+            if (response["complete"] and response["status"] < 500
+                    and len(response["body"]) <= MAX_STORED_BODY):
+                await run_in_threadpool(
+                    self.store.complete, key, response["status"], response["headers"], bytes(response["body"])
+                )
+            else:
+                await run_in_threadpool(self.store.release, key)
+
+    async def _renew(self, key: str):
+        """Keep the claim on `key` fresh for as long as its request runs"""
+        while True:
+            await asyncio.sleep(self.store.lock_seconds / 3)
+            await run_in_threadpool(self.store.touch, key)
@@ -1,19 +1,27 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
-import models
-from database import engine
+from sqlalchemy.orm import Session
+import archive
+import tasks
+from singleflight import flights
+from events import broker
+from admission import AdmissionMiddleware, AdmissionRule, PriorityClass, admission_metrics
+from compression import CompressionMiddleware
+from idempotency import IdempotencyMiddleware, idempotency_store
+from roundtrips import RoundTripMiddleware, round_trip_stats
+from database import engine, get_read_db
+from migrations import run_migrations
+from routers import changes
 from routers import doctors
 from routers import gallery
 from routers import patients
+from routers import public
 from routers import schedules
 from routers import visits
 
 
-# Create tables in the database
-models.Base.metadata.create_all(bind=engine)
-
 # Create upload directories if they don't exist
 os.makedirs("uploads/doctor_images", exist_ok=True)
 os.makedirs("uploads/gallery", exist_ok=True)
@@ -26,6 +34,45 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Admission control: concurrency limits per priority class. The limits add up to
+# AnyIO's default 40 threadpool slots, so one class cannot starve the others.
+admission_classes = {
+    "reads": PriorityClass("reads", max_concurrent=24, max_queue=100, queue_timeout=2.0),
+    "aggregates": PriorityClass("aggregates", max_concurrent=4, max_queue=16, queue_timeout=10.0, retry_after=5),
+    "uploads": PriorityClass("uploads", max_concurrent=4, max_queue=8, queue_timeout=15.0, retry_after=5),
+    "writes": PriorityClass("writes", max_concurrent=8, max_queue=32, queue_timeout=5.0),
+}
+
+# First matching rule wins; None exempts the route
+admission_rules = [
+    AdmissionRule("/metrics", None),
+    AdmissionRule("/patients/*/events", None),    # long-lived streams, limited by SSE_MAX_SUBSCRIBERS
+    AdmissionRule("/patients/unique*", "aggregates", ["GET"]),
+    AdmissionRule("/doctors/*/patient-count", "aggregates", ["GET"]),
+    AdmissionRule("/schedules/conflicts", "aggregates", ["GET"]),
+    AdmissionRule("/metrics/tables", "aggregates", ["GET"]),
+    AdmissionRule("/doctors*", "uploads", ["POST", "PUT"]),
+    AdmissionRule("/schedules*", "uploads", ["POST", "PUT"]),
+    AdmissionRule("/gallery/", "uploads", ["POST"]),
+    AdmissionRule("*", "reads", ["GET", "HEAD"]),
+    AdmissionRule("*", "writes"),
+]
+
+# Innermost, so only requests that reach a handler are counted
+app.add_middleware(RoundTripMiddleware)
+
+# Creates that clients retry over flaky connections (replays skip the handler, so nothing is created or saved twice)
+app.add_middleware(IdempotencyMiddleware, patterns=[
+    "/patients/*",
+    "/visits/*",
+    "/doctors/",
+    "/schedules/",
+    "/gallery/",
+])
+
+# Added before CORS so rejected requests still carry CORS headers
+app.add_middleware(AdmissionMiddleware, classes=admission_classes, rules=admission_rules)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +82,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large text/JSON responses (brotli or gzip, negotiated per request)
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+
 # Mount static files for serving uploads
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
@@ -44,12 +94,43 @@ app.include_router(patients.router)
 app.include_router(visits.router)
 app.include_router(schedules.router)
 app.include_router(gallery.router)
+app.include_router(public.router)
+app.include_router(changes.router)
+
+# Start background workers (replays unfinished tasks from the journal)
+@app.on_event("startup")
+def start_task_queue():
+    tasks.task_queue.start()
+
+@app.on_event("shutdown")
+def stop_task_queue():
+    tasks.task_queue.shutdown()
+
+@app.get("/metrics")
+def metrics():
+    """Per-worker runtime metrics"""
+    return {
+        "single_flight": flights.metrics(),
+        "admission": admission_metrics(admission_classes),
+        "live_events": broker.metrics(),
+        "db_round_trips": round_trip_stats.metrics(),
+        "idempotency": idempotency_store.metrics(),
+    }
+
+@app.get("/metrics/tables")
+def table_metrics(db: Session = Depends(get_read_db)):
+    """Row counts of the hot and archive tables (see archive.py)"""
+    return archive.table_sizes(db)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Medical Services API"}
 
-# Run the application with: uvicorn main:app --reload
+# Run the application with: python main.py (applies migrations, then starts with --reload)
+# With plain `uvicorn main:app`, run `python migrations.py` first
+# For production (multiple workers) use: python serve.py
 if __name__ == "__main__":
     import uvicorn
+    run_migrations(engine)
+    engine.dispose()
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,246 @@
+"""
+Small, idempotent schema migrations.
+
+`Base.metadata.create_all` only creates missing tables, so columns and indexes
+added to existing tables are applied here as well. They run once per deploy,
+before any worker starts (serve.py does this), or by hand:
+
+    python migrations.py
+"""
+from sqlalchemy import MetaData, delete, inspect, insert, select, func, update
+from sqlalchemy.schema import CreateTable
+import models
+from cache import VERSIONED_TABLES
+from changelog import DELETE, UPSERT, write_changes
+from crud import normalize_doctor_name
+from ranking import rank_between, rank_sequence
+
+
+def _add_missing_column(conn, table, column):
+    """Add `column` to `table` if the database does not have it yet"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if column.name in existing:
+        return False
+
+    preparer = conn.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.exec_driver_sql(
+        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+    )
+    return True
+
+
+def _create_missing_index(conn, index):
+    existing = {i["name"] for i in inspect(conn).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(conn)
+
+
+def _migrate_gallery_rank(conn):
+    """Add rank keys to gallery images, seeded from the legacy order_index"""
+    table = models.GalleryImage.__table__
+    _add_missing_column(conn, table, table.c.rank_key)
+    for index in table.indexes:
+        _create_missing_index(conn, index)
+
+    unranked = conn.execute(
+        select(table.c.id).where(table.c.rank_key.is_(None)).order_by(table.c.order_index, table.c.id)
+    ).scalars().all()
+    if not unranked:
+        return
+
+    last_rank = conn.execute(select(func.max(table.c.rank_key))).scalar()
+    if last_rank is None:
+        ranks = rank_sequence(len(unranked))
+    else:
+        ranks = []
+        for _ in unranked:
+            last_rank = rank_between(last_rank, None)
+            ranks.append(last_rank)
+
+    for image_id, rank_key in zip(unranked, ranks):
+        conn.execute(update(table).where(table.c.id == image_id).values(rank_key=rank_key))
+
+
+def _add_missing_foreign_key(conn, table, column):
+    """Add the foreign key constraint of `column` (not supported by SQLite's ALTER TABLE)"""
+    if conn.dialect.name == "sqlite":
+        return
+    existing = inspect(conn).get_foreign_keys(table.name)
+    if any(column.name in fk["constrained_columns"] for fk in existing):
+        return
+
+    preparer = conn.dialect.identifier_preparer
+    for fk in column.foreign_keys:
+        conn.exec_driver_sql(
+            f"ALTER TABLE {preparer.format_table(table)} ADD FOREIGN KEY ({preparer.format_column(column)}) "
+            f"REFERENCES {preparer.format_table(fk.column.table)} ({preparer.format_column(fk.column)})"
+        )
+
+
+def _migrate_schedule_doctor_link(conn):
+    """Link schedules to doctors, matching existing rows by doctor name"""
+    table = models.DoctorSchedule.__table__
+    _add_missing_column(conn, table, table.c.doctor_id)
+    _add_missing_foreign_key(conn, table, table.c.doctor_id)
+    for index in table.indexes:
+        _create_missing_index(conn, index)
+
+    doctors = models.Doctor.__table__
+    ids_by_name = {}
+    for doctor_id, name in conn.execute(select(doctors.c.id, doctors.c.name)):
+        ids_by_name.setdefault(normalize_doctor_name(name), []).append(doctor_id)
+
+    unlinked = conn.execute(select(table.c.id, table.c.name).where(table.c.doctor_id.is_(None))).all()
+    for schedule_id, name in unlinked:
+        matches = ids_by_name.get(normalize_doctor_name(name), [])
+        # Ambiguous names are left unlinked
+        if len(matches) == 1:
+            conn.execute(update(table).where(table.c.id == schedule_id).values(doctor_id=matches[0]))
+
+
+def _merge_duplicate_visits(conn):
+    """
+    Fold duplicate (doctor_id, date) visits into the oldest one, so the unique
+    index can be created. Moved patients are numbered after the kept visit's,
+    and both are written to the change log. Returns True if anything was merged.
+    """
+    visits = models.Visit.__table__
+    patients = models.Patient.__table__
+    duplicates = conn.execute(
+        select(visits.c.doctor_id, visits.c.date)
+        .where(visits.c.doctor_id.is_not(None), visits.c.date.is_not(None))
+        .group_by(visits.c.doctor_id, visits.c.date)
+        .having(func.count() > 1)
+    ).all()
+
+    for doctor_id, visit_date in duplicates:
+        visit_ids = conn.execute(
+            select(visits.c.id)
+            .where(visits.c.doctor_id == doctor_id, visits.c.date == visit_date)
+            .order_by(visits.c.id)
+        ).scalars().all()
+        keep_id, merged_ids = visit_ids[0], visit_ids[1:]
+
+        serial_no = conn.execute(
+            select(func.coalesce(func.max(patients.c.serial_no), 0)).where(patients.c.visit_id == keep_id)
+        ).scalar()
+        moved = conn.execute(
+            select(patients.c.id)
+            .where(patients.c.visit_id.in_(merged_ids))
+            .order_by(patients.c.visit_id, patients.c.serial_no, patients.c.id)
+        ).scalars().all()
+        for patient_id in moved:
+            serial_no += 1
+            conn.execute(
+                update(patients).where(patients.c.id == patient_id).values(visit_id=keep_id, serial_no=serial_no)
+            )
+        conn.execute(delete(visits).where(visits.c.id.in_(merged_ids)))
+        write_changes(conn, [("patients", patient_id, UPSERT, keep_id) for patient_id in moved] + [
+            ("visits", visit_id, DELETE, visit_id) for visit_id in merged_ids
+        ])
+
+    return bool(duplicates)
+
+
+def _migrate_visit_uniqueness(conn):
+    """One visit per doctor per day"""
+    table = models.Visit.__table__
+    if _merge_duplicate_visits(conn):
+        # Invalidate caches in workers that are still running
+        data_versions = models.DataVersion.__table__
+        conn.execute(
+            update(data_versions)
+            .where(data_versions.c.name.in_(["visits", "patients"]))
+            .values(version=data_versions.c.version + 1)
+        )
+    for index in table.indexes:
+        _create_missing_index(conn, index)
+
+
+def _migrate_change_log_scope(conn):
+    """Visit and origin columns used by live event streams (see events.py)"""
+    table = models.ChangeLogEntry.__table__
+    _add_missing_column(conn, table, table.c.visit_id)
+    _add_missing_column(conn, table, table.c.origin)
+    for index in table.indexes:
+        _create_missing_index(conn, index)
+
+
+def _has_sqlite_autoincrement(conn, table):
+    sql = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+    ).scalar()
+    return "AUTOINCREMENT" in (sql or "").upper()
+
+
+def _rebuild_sqlite_table(conn, table):
+    """Recreate `table` from the model with its rows (SQLite cannot add AUTOINCREMENT in place)"""
+    metadata = MetaData()
+    for model_table in models.Base.metadata.sorted_tables:
+        model_table.to_metadata(metadata)
+    rebuilt = metadata.tables[table.name].to_metadata(metadata, name=f"{table.name}_rebuild")
+    conn.execute(CreateTable(rebuilt))
+
+    names = [column.name for column in table.columns]
+    conn.execute(insert(rebuilt).from_select(names, select(*table.columns)))
+    table.drop(conn)
+    preparer = conn.dialect.identifier_preparer
+    conn.exec_driver_sql(f"ALTER TABLE {preparer.format_table(rebuilt)} RENAME TO {preparer.format_table(table)}")
+    for index in table.indexes:
+        index.create(conn)
+
+
+def _reserve_archived_ids(conn):
+    """
+    Keep new visit and patient ids above the archived ones (archive.py keeps ids).
+    SQLite tables get AUTOINCREMENT, whose sequence never goes back; MySQL before
+    8.0 resets AUTO_INCREMENT to max(id) + 1 on restart, so it is moved up again.
+    PostgreSQL sequences never go back either.
+    """
+    for model, archived_model in ((models.Visit, models.ArchivedVisit), (models.Patient, models.ArchivedPatient)):
+        table = model.__table__
+        if conn.dialect.name == "sqlite" and not _has_sqlite_autoincrement(conn, table):
+            _rebuild_sqlite_table(conn, table)
+
+        archived_max = conn.execute(select(func.max(archived_model.id))).scalar()
+        if archived_max is None or archived_max <= (conn.execute(select(func.max(table.c.id))).scalar() or 0):
+            continue
+        if conn.dialect.name == "sqlite":
+            if not conn.exec_driver_sql(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (archived_max, table.name)
+            ).rowcount:
+                conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table.name, archived_max))
+        elif conn.dialect.name == "mysql":
+            conn.exec_driver_sql(
+                f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} AUTO_INCREMENT = {archived_max + 1}"
+            )
+
+
+def _seed_data_versions(conn):
+    """Make sure every versioned table has a counter row to bump"""
+    table = models.DataVersion.__table__
+    existing = set(conn.execute(select(table.c.name)).scalars())
+    missing = [name for name in VERSIONED_TABLES if name not in existing]
+    if missing:
+        conn.execute(insert(table), [{"name": name, "version": 0} for name in missing])
+
+
+def run_migrations(engine):
+    """Create missing tables and apply pending schema changes in a single transaction"""
+    with engine.begin() as conn:
+        models.Base.metadata.create_all(bind=conn)
+        _migrate_gallery_rank(conn)
+        _migrate_schedule_doctor_link(conn)
+        # The change log takes entries from the visit merge below
+        _migrate_change_log_scope(conn)
+        _migrate_visit_uniqueness(conn)
+        _reserve_archived_ids(conn)
+        _seed_data_versions(conn)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    run_migrations(engine)
+    print("Migrations applied")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Boolean, Time
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Boolean, Time, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -12,6 +12,7 @@ class Doctor(Base):
     image_filename = Column(String(512))    # Changed from imageUrl to image_filename
 
     visits = relationship("Visit", back_populates="doctor")
+    schedules = relationship("DoctorSchedule", back_populates="doctor")
 
 # Visit Model
 class Visit(Base):
@@ -24,6 +25,13 @@ class Visit(Base):
     doctor = relationship("Doctor", back_populates="visits")
     patients = relationship("Patient", back_populates="visit")
 
+    __table_args__ = (
+        # One visit per doctor per day (a unique index so it can be added to existing tables)
+        Index("uq_visits_doctor_date", "doctor_id", "date", unique=True),
+        # Archived visits keep their ids, so they must never be handed out again
+        {"sqlite_autoincrement": True},
+    )
+
 # Patient Model
 class Patient(Base):
     __tablename__ = "patients"
@@ -37,11 +45,40 @@ class Patient(Base):
 
     visit = relationship("Visit", back_populates="patients")
 
+    # Archived patients keep their ids, so they must never be handed out again
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# Archive tables (see archive.py): visits and patients past the archival horizon,
+# with their original ids and an archived_at timestamp
+class ArchivedVisit(Base):
+    __tablename__ = "visits_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    date = Column(Date)
+    doctor_id = Column(Integer, index=True)
+    archived_at = Column(DateTime)
+
+    patients = relationship("ArchivedPatient", back_populates="visit")
+
+class ArchivedPatient(Base):
+    __tablename__ = "patients_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(255))
+    contact = Column(String(20))
+    fee_status = Column(String(50))
+    visit_id = Column(Integer, ForeignKey("visits_archive.id"), index=True)
+    serial_no = Column(Integer)
+    archived_at = Column(DateTime)
+
+    visit = relationship("ArchivedVisit", back_populates="patients")
+
 # DoctorSchedule Model
 class DoctorSchedule(Base):
     __tablename__ = "doctor_schedules"
     
     id = Column(Integer, primary_key=True, index=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), nullable=True, index=True)
     name = Column(String(255), nullable=False)
     specialization = Column(String(255), nullable=False)
     image_filename = Column(String(512), nullable=True)
@@ -52,6 +89,33 @@ class DoctorSchedule(Base):
     is_available = Column(Boolean, default=True)
     specific_date = Column(Date, nullable=True)
 
+    doctor = relationship("Doctor", back_populates="schedules")
+
+# DataVersion Model (per-table change counters, see cache.py)
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# ChangeLogEntry Model (append-only log of changed rows, see changelog.py)
+class ChangeLogEntry(Base):
+    __tablename__ = "change_log"
+
+    id = Column(Integer, primary_key=True)    # Sync cursor
+    table_name = Column(String(64), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String(8), nullable=False)    # "upsert" or "delete"
+    changed_at = Column(DateTime, nullable=False, index=True)
+    visit_id = Column(Integer)    # Visit whose queue changed (patients and visits), for live event streams
+    origin = Column(String(32))    # Process that wrote the entry (see changelog.ORIGIN)
+
+    __table_args__ = (
+        Index("ix_change_log_visit", "visit_id", "id"),
+        # Never reuse ids of deleted entries, or cursors could skip changes
+        {"sqlite_autoincrement": True},
+    )
+
 # GalleryImage Model
 class GalleryImage(Base):
     __tablename__ = "gallery_images"
@@ -60,5 +124,9 @@ class GalleryImage(Base):
     title = Column(String(100))
     description = Column(String(255))
     image_url = Column(String(255), nullable=False)
-    order_index = Column(Integer, default=0)
+    legacy_order_index = Column("order_index", Integer, default=0)    # Legacy ordering, no longer read; responses report positions (see crud.gallery_position)
+    rank_key = Column(String(64))    # Lexicographic rank key (see ranking.py)
     is_active = Column(Boolean, default=True)
+
+    # Lets the public feed be served in index order
+    __table_args__ = (Index("ix_gallery_images_active_rank", "is_active", "rank_key"),)
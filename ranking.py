@@ -0,0 +1,70 @@
+"""
+Lexicographic rank keys used to order gallery images.
+
+Keys are strings over digits and lowercase letters, so they sort the same way
+under binary and case-insensitive database collations. A key never ends in
+"0", which guarantees there is always room for another key before it.
+"""
+from typing import List, Optional
+
+ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(ALPHABET)
+RANK_MAX_LENGTH = 64
+# Moves that would produce a longer key rebalance the whole ordering instead;
+# repeated moves to the same end grow keys by about one character per move
+RANK_REBALANCE_LENGTH = 12
+
+
+def rank_between(before: Optional[str] = None, after: Optional[str] = None) -> str:
+    """Return a key that sorts strictly between `before` and `after` (None means open-ended)"""
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"Invalid rank range: {before!r} >= {after!r}")
+    if before is None and after is None:
+        return ALPHABET[BASE // 2]
+
+    before = before or ""
+    result = []
+    i = 0
+    while True:
+        lo = ALPHABET.index(before[i]) if i < len(before) else 0
+
+        if after is None:
+            # Appending: step by one digit so keys grow slowly
+            if lo + 1 < BASE:
+                result.append(ALPHABET[lo + 1])
+                return "".join(result)
+            result.append(ALPHABET[lo])
+            i += 1
+            continue
+
+        hi = ALPHABET.index(after[i]) if i < len(after) else BASE
+        if hi - lo > 1:
+            result.append(ALPHABET[(lo + hi) // 2])
+            return "".join(result)
+
+        result.append(ALPHABET[lo])
+        i += 1
+        if hi - lo == 1:
+            # Our prefix is now below `after`, so the upper bound no longer matters
+            after = None
+
+
+def rank_sequence(count: int) -> List[str]:
+    """Return `count` evenly spaced, increasing keys (used to rebalance a full ordering)"""
+    if count <= 0:
+        return []
+
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    step = BASE ** width // (count + 1)
+
+    keys = []
+    for position in range(1, count + 1):
+        value = step * position
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(ALPHABET[digit])
+        keys.append("".join(reversed(digits)).rstrip("0"))
+    return keys
@@ -0,0 +1,138 @@
+"""
+Reconcile uploaded files with the rows that reference them.
+
+Finds orphaned files (on disk, referenced by no row) and dangling references
+(rows pointing at a missing file). Directory listings are streamed with
+os.scandir and checked against the database in batches, so neither side is
+loaded into memory as a whole.
+
+Run with: python reconcile.py [--delete]
+"""
+import argparse
+import os
+import time
+from itertools import islice
+from sqlalchemy.orm import Session
+import models
+from cache import bump_version
+from changelog import UPSERT, record_change
+from routers import doctors, gallery, schedules
+
+# (upload directory, model, column name, filename -> stored value)
+SOURCES = [
+    (doctors.UPLOAD_DIR, models.Doctor, "image_filename", lambda name: name),
+    (schedules.UPLOAD_DIR, models.DoctorSchedule, "image_filename", lambda name: name),
+    (gallery.UPLOAD_DIR, models.GalleryImage, "image_url", lambda name: f"/uploads/gallery/{name}"),
+]
+
+# Columns that can be cleared when their file is missing
+NULLABLE_REFERENCES = {models.Doctor, models.DoctorSchedule}
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def find_orphaned_files(db: Session, batch_size: int = 500, grace_seconds: int = 3600):
+    """
+    Yield paths of upload files no row references.
+    Files newer than `grace_seconds` are skipped, since their row may not be committed yet.
+    """
+    cutoff = time.time() - grace_seconds
+    for directory, model, column_name, to_reference in SOURCES:
+        if not os.path.isdir(directory):
+            continue
+        column = getattr(model, column_name)
+
+        with os.scandir(directory) as entries:
+            files = (entry for entry in entries if entry.is_file() and entry.stat().st_mtime < cutoff)
+            for batch in _batched(files, batch_size):
+                paths_by_reference = {to_reference(entry.name): entry.path for entry in batch}
+                referenced = {
+                    row[0] for row in db.query(column).filter(column.in_(paths_by_reference.keys()))
+                }
+                for reference, path in paths_by_reference.items():
+                    if reference not in referenced:
+                        yield path
+
+
+def find_dangling_references(db: Session, batch_size: int = 500):
+    """Yield (model, id, stored value) for rows whose file does not exist"""
+    for directory, model, column_name, _ in SOURCES:
+        column = getattr(model, column_name)
+        last_id = 0
+        while True:
+            # Keyset pagination keeps each query small and stable under concurrent writes
+            rows = (
+                db.query(model.id, column)
+                .filter(model.id > last_id, column.isnot(None), column != "")
+                .order_by(model.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            for row_id, reference in rows:
+                if not os.path.exists(os.path.join(directory, os.path.basename(reference))):
+                    yield model, row_id, reference
+
+
+def reconcile_uploads(db: Session, delete: bool = False, batch_size: int = 500, grace_seconds: int = 3600):
+    """
+    Report orphaned files and dangling references.
+    With `delete`, orphaned files are removed and dangling doctor/schedule
+    image references are cleared. Gallery rows are only reported.
+    """
+    orphaned_files = []
+    for path in find_orphaned_files(db, batch_size, grace_seconds):
+        orphaned_files.append(path)
+        if delete:
+            os.remove(path)
+
+    dangling_references = []
+    for model, row_id, reference in find_dangling_references(db, batch_size):
+        dangling_references.append({"table": model.__tablename__, "id": row_id, "reference": reference})
+
+    if delete:
+        for model in NULLABLE_REFERENCES:
+            ids = [ref["id"] for ref in dangling_references if ref["table"] == model.__tablename__]
+            for batch in _batched(ids, batch_size):
+                db.query(model).filter(model.id.in_(batch)).update(
+                    {"image_filename": None}, synchronize_session=False
+                )
+                record_change(db, model.__tablename__, UPSERT, *batch)
+        bump_version(db, *(model.__tablename__ for model in NULLABLE_REFERENCES))
+        db.commit()
+
+    return {"orphaned_files": orphaned_files, "dangling_references": dangling_references}
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Reconcile uploaded files with database references")
+    parser.add_argument("--delete", action="store_true", help="delete orphans and clear dangling references")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--grace-seconds", type=int, default=3600,
+                        help="ignore files modified more recently than this")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        report = reconcile_uploads(db, args.delete, args.batch_size, args.grace_seconds)
+    finally:
+        db.close()
+
+    action = "Deleted" if args.delete else "Orphaned"
+    for path in report["orphaned_files"]:
+        print(f"{action} file: {path}")
+    for ref in report["dangling_references"]:
+        print(f"Dangling reference: {ref['table']}#{ref['id']} -> {ref['reference']}")
+    print(f"{len(report['orphaned_files'])} orphaned files, {len(report['dangling_references'])} dangling references")
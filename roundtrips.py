@@ -0,0 +1,88 @@
+"""
+Database round-trip accounting.
+
+Counts the statements, commits and rollbacks each request sends to the
+database (primary and replica). /metrics reports the totals per HTTP method,
+and with DB_ROUND_TRIP_HEADER=1 every response carries an X-DB-Round-Trips
+header, which makes it easy to check what a single endpoint costs.
+
+A patient update, fee toggle or delete costs 4 round trips: the write (with
+RETURNING), the data_versions bump, the change log INSERT and COMMIT. A bulk
+update costs the same 4 for any number of patients sharing one payload. Without
+RETURNING (MySQL) each of them adds one SELECT, so 5. tests/test_roundtrips.py
+checks both paths.
+"""
+import os
+import threading
+from contextvars import ContextVar
+from sqlalchemy import event
+from database import engine, read_engine
+
+DB_ROUND_TRIP_HEADER = os.getenv("DB_ROUND_TRIP_HEADER", "0") == "1"
+
+# A one-item list per request, so threadpool handlers (which run in a copy of the context) update the same counter
+_current = ContextVar("db_round_trips", default=None)
+
+
+def _count(*args):
+    counter = _current.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+for _engine in {engine, read_engine}:
+    event.listen(_engine, "before_cursor_execute", _count)
+    event.listen(_engine, "commit", _count)
+    event.listen(_engine, "rollback", _count)
+
+
+class RoundTripStats:
+    def __init__(self):
+        self._totals = {}   # method -> [requests, round trips]
+        self._lock = threading.Lock()
+
+    def record(self, method: str, round_trips: int):
+        with self._lock:
+            totals = self._totals.setdefault(method, [0, 0])
+            totals[0] += 1
+            totals[1] += round_trips
+
+    def metrics(self):
+        with self._lock:
+            return {
+                method: {
+                    "requests": requests,
+                    "round_trips": round_trips,
+                    "per_request": round(round_trips / requests, 2),
+                }
+                for method, (requests, round_trips) in self._totals.items()
+            }
+
+
+round_trip_stats = RoundTripStats()
+
+
+class RoundTripMiddleware:
+    def __init__(self, app, header: bool = DB_ROUND_TRIP_HEADER):
+        self.app = app
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        counter = [0]
+        token = _current.set(counter)
+
+        async def send_with_count(message):
+            if self.header and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-db-round-trips", str(counter[0]).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _current.reset(token)
+            round_trip_stats.record(scope["method"], counter[0])
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+import schemas
+from changelog import read_changes
+from database import get_read_db
+
+router = APIRouter(prefix="/changes", tags=["Changes"])
+
+@router.get("/", response_model=schemas.ChangesResponse)
+def get_changes(
+    since: Optional[int] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Rows changed after cursor `since`, grouped by table. Without `since`, or when
+    `since` has been compacted away, only the current cursor is returned with `reset`.
+    """
+    return read_changes(db, since, limit)
@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form, Request
 from sqlalchemy.orm import Session
-import crud, schemas
-from database import get_db
+import crud, schemas, tasks
+from cache import cached_json
+from fieldsets import fields_param, partial_model
+from database import get_db, get_read_db
 from typing import List, Optional
 import shutil
 import os
@@ -15,8 +17,24 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 router = APIRouter(prefix="/doctors", tags=["Doctors"])
 
 @router.get("/", response_model=List[schemas.DoctorResponse])
-def get_doctors(db: Session = Depends(get_db)):
-    return crud.get_doctors(db)
+def get_doctors(
+    request: Request,
+    fields: Optional[tuple] = Depends(fields_param(schemas.DoctorResponse)),
+    db: Session = Depends(get_read_db)
+):
+    """Get all doctors (use ?fields=id,name for just the columns you need)"""
+    return cached_json(
+        request, ("doctors", fields), ["doctors"], lambda: crud.get_doctors(db, fields),
+        List[partial_model(schemas.DoctorResponse, fields)]
+    )
+
+@router.get("/with-schedules", response_model=List[schemas.DoctorWithScheduleResponse])
+def get_doctors_with_schedules(request: Request, db: Session = Depends(get_read_db)):
+    """Get all doctors with their schedules nested"""
+    return cached_json(
+        request, "doctors-with-schedules", ["doctors", "doctor_schedules"],
+        lambda: crud.get_doctors_with_schedules(db), List[schemas.DoctorWithScheduleResponse]
+    )
 
 @router.post("/", response_model=schemas.DoctorResponse)
 async def create_doctor(
@@ -74,12 +92,9 @@ async def update_doctor(
     
     # Handle image upload if provided
     image_filename = existing_doctor.image_filename  # Keep existing image by default
+    old_image_filename = None
     if image:
-        # Delete the old image if it exists
-        if existing_doctor.image_filename:
-            old_image_path = os.path.join(UPLOAD_DIR, existing_doctor.image_filename)
-            if os.path.exists(old_image_path):
-                os.remove(old_image_path)
+        old_image_filename = existing_doctor.image_filename
         
         # Save the new image
         file_extension = os.path.splitext(image.filename)[1]
@@ -91,6 +106,10 @@ async def update_doctor(
         
         image_filename = unique_filename
     
+    # Delete the replaced image in the background once the update is committed
+    if old_image_filename:
+        tasks.enqueue_after_commit(db, "delete_file", path=os.path.join(UPLOAD_DIR, old_image_filename))
+    
     # Update the doctor in the database
     updated_doctor = crud.update_doctor(db, doctor_id, doctor_data, image_filename)
     if not updated_doctor:
@@ -105,11 +124,11 @@ def delete_doctor(doctor_id: int, db: Session = Depends(get_db)):
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     
-    # Delete the image file if it exists
-    if doctor.image_filename:
-        image_path = os.path.join(UPLOAD_DIR, doctor.image_filename)
-        if os.path.exists(image_path):
-            os.remove(image_path)
+    image_filename = doctor.image_filename
+    
+    # Delete the image file in the background once the doctor is gone
+    if image_filename:
+        tasks.enqueue_after_commit(db, "delete_file", path=os.path.join(UPLOAD_DIR, image_filename))
     
     # Delete the doctor from the database
     result = crud.delete_doctor(db, doctor_id)
@@ -128,10 +147,10 @@ async def get_doctor_image(filename: str):
     return FileResponse(image_path)
 
 @router.get("/{doctor_id}/patient-count", response_model=dict)
-def get_doctor_patient_count(doctor_id: int, db: Session = Depends(get_db)):
+def get_doctor_patient_count(doctor_id: int, db: Session = Depends(get_read_db)):
     """Get the count of unique patients who visited a specific doctor"""
-    # Get all unique patients
-    unique_patients = crud.get_unique_patients(db)
+    # Get all unique patients (concurrent requests share a single scan)
+    unique_patients = crud.get_unique_patients_shared(db)
     
     # Count how many unique patients visited this doctor
     count = sum(1 for patient in unique_patients if doctor_id in patient["doctor_visits"])
@@ -139,5 +158,5 @@ def get_doctor_patient_count(doctor_id: int, db: Session = Depends(get_db)):
     return {
         "doctor_id": doctor_id,
         "unique_patient_count": count,
-        "total_visits": len(crud.get_visits(db, doctor_id))
+        "total_visits": crud.count_visits(db, doctor_id)
     }
\ No newline at end of file
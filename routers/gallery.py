@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, Request, status, File, UploadFile, Form
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import crud
 import models
 import schemas
-from database import get_db
+import tasks
+from cache import bump_version, cached_json
+from changelog import DELETE, record_change
+from fieldsets import fields_param, partial_model
+from database import get_db, get_read_db
 import shutil
 import os
 from datetime import datetime
@@ -20,39 +25,37 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 @router.get("/", response_model=List[schemas.GalleryImageResponse])
 def get_gallery_images(
+    request: Request,
     skip: int = 0, 
     limit: int = 100, 
     active_only: bool = True,
-    db: Session = Depends(get_db)
+    fields: Optional[tuple] = Depends(fields_param(schemas.GalleryImageResponse)),
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all gallery images
     """
-    query = db.query(models.GalleryImage)
-    if active_only:
-        query = query.filter(models.GalleryImage.is_active == True)
-    
-    # Order by order_index
-    query = query.order_by(models.GalleryImage.order_index)
-    
-    images = query.offset(skip).limit(limit).all()
-    return images
+    return cached_json(
+        request, ("gallery", skip, limit, active_only, fields), ["gallery_images"],
+        lambda: crud.get_gallery_images(db, skip, limit, active_only, fields),
+        List[partial_model(schemas.GalleryImageResponse, fields)]
+    )
 
 @router.get("/{image_id}", response_model=schemas.GalleryImageResponse)
-def get_gallery_image(image_id: int, db: Session = Depends(get_db)):
+def get_gallery_image(image_id: int, db: Session = Depends(get_read_db)):
     """
     Get a specific gallery image by ID
     """
-    image = db.query(models.GalleryImage).filter(models.GalleryImage.id == image_id).first()
+    image = crud.get_gallery_image(db, image_id)
     if image is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    return image
+    return crud.gallery_position(db, image)
 
 @router.post("/", response_model=schemas.GalleryImageResponse, status_code=status.HTTP_201_CREATED)
 async def create_gallery_image(
     title: str = Form(...),
     description: Optional[str] = Form(None),
-    order_index: int = Form(0),
+    order_index: Optional[int] = Form(None, ge=0, description="Deprecated: position in the gallery order"),
     is_active: bool = Form(True),
     image: UploadFile = File(...),
     db: Session = Depends(get_db)
@@ -75,18 +78,35 @@ async def create_gallery_image(
         shutil.copyfileobj(image.file, buffer)
     
     # Create database entry
-    db_image = models.GalleryImage(
-        title=title,
-        description=description,
-        image_url=f"/uploads/gallery/{new_filename}",  # URL path to file
-        order_index=order_index,
-        is_active=is_active
-    )
-    
-    db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
-    
+    return crud.create_gallery_image(db, {
+        "title": title,
+        "description": description,
+        "image_url": f"/uploads/gallery/{new_filename}",  # URL path to file
+        "is_active": is_active,
+        "order_index": order_index,
+    })
+
+@router.put("/order", response_model=List[schemas.GalleryImageResponse])
+def set_gallery_order(order: schemas.GalleryOrder, db: Session = Depends(get_db)):
+    """
+    Set the full gallery order in one transaction (admin only)
+    """
+    try:
+        return crud.set_gallery_order(db, order.image_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{image_id}/move", response_model=schemas.GalleryImageResponse)
+def move_gallery_image(image_id: int, move: schemas.GalleryImageMove, db: Session = Depends(get_db)):
+    """
+    Move an image after and/or before another image (admin only)
+    """
+    try:
+        db_image = crud.move_gallery_image(db, image_id, move.after_id, move.before_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if db_image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
     return db_image
 
 @router.put("/{image_id}", response_model=schemas.GalleryImageResponse)
@@ -98,16 +118,9 @@ def update_gallery_image(
     """
     Update gallery image details (admin only)
     """
-    db_image = db.query(models.GalleryImage).filter(models.GalleryImage.id == image_id).first()
+    db_image = crud.update_gallery_image(db, image_id, image.dict(exclude_unset=True))
     if db_image is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    
-    # Update fields
-    for key, value in image.dict(exclude_unset=True).items():
-        setattr(db_image, key, value)
-    
-    db.commit()
-    db.refresh(db_image)
     return db_image
 
 @router.delete("/{image_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -123,12 +136,13 @@ def delete_gallery_image(image_id: int, db: Session = Depends(get_db)):
     file_name = os.path.basename(db_image.image_url)
     file_path = os.path.join(UPLOAD_DIR, file_name)
     
-    # Remove file if it exists
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    # Remove file in the background once the row is gone
+    tasks.enqueue_after_commit(db, "delete_file", path=file_path)
     
     # Remove database entry
     db.delete(db_image)
+    bump_version(db, "gallery_images")
+    record_change(db, "gallery_images", DELETE, image_id)
     db.commit()
     
     return None
\ No newline at end of file
@@ -1,32 +1,72 @@
 # patients.py - Fixed with consistent routing
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 import crud, schemas
-from database import get_db
+from cache import cached_json
+from fieldsets import fields_param, partial_model
+from database import get_db, get_read_db
+from events import broker, stream_visit_events
+from typing import Optional
 from typing import List
 router = APIRouter(prefix="/patients", tags=["Patients"])
 
 # Get all patients endpoint
 @router.get("/", response_model=List[schemas.PatientResponse])
-def get_all_patients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_all_patients(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[tuple] = Depends(fields_param(schemas.PatientResponse)),
+    db: Session = Depends(get_read_db)
+):
     """Get all patients in the system (not filtered by visit)"""
-    return crud.get_all_patients(db, skip, limit)
+    return cached_json(
+        request, ("patients", skip, limit, fields), ["patients"],
+        lambda: crud.get_all_patients(db, skip, limit, fields), List[partial_model(schemas.PatientResponse, fields)]
+    )
 
 # Get patients by visit ID
 @router.get("/{visit_id}", response_model=List[schemas.PatientResponse])
-def get_patients_by_visit(visit_id: int, db: Session = Depends(get_db)):
+def get_patients_by_visit(
+    request: Request,
+    visit_id: int,
+    fields: Optional[tuple] = Depends(fields_param(schemas.PatientResponse)),
+    db: Session = Depends(get_read_db)
+):
     """Get patients for a specific visit"""
-    patients = crud.get_patients(db, visit_id)
-    print(f"Fetching patients for visit ID {visit_id}: Found {len(patients)}")
-    return patients
+    return cached_json(
+        request, ("patients-by-visit", visit_id, fields), ["patients"],
+        lambda: crud.get_patients(db, visit_id, fields), List[partial_model(schemas.PatientResponse, fields)]
+    )
+
+# Live updates for a visit (Server-Sent Events)
+@router.get("/{visit_id}/events")
+async def stream_patient_events(visit_id: int, last_event_id: Optional[str] = Header(None)):
+    """
+    Stream patient.created / patient.updated / patient.fee_toggled / patient.deleted
+    events for a visit. Reconnects resume after Last-Event-ID; a `resync` event
+    means the client should re-fetch GET /patients/{visit_id}.
+    """
+    subscription, backlog = broker.subscribe(visit_id, last_event_id)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many live connections", headers={"Retry-After": "10"})
+    return StreamingResponse(
+        stream_visit_events(subscription, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # Create patient for a visit
 @router.post("/{visit_id}", response_model=schemas.PatientResponse, status_code=status.HTTP_201_CREATED)
 def create_patient(visit_id: int, patient: schemas.PatientCreate, db: Session = Depends(get_db)):
     """Create a new patient for a specific visit"""
-    serial_no = len(crud.get_patients(db, visit_id)) + 1
-    return crud.create_patient(db, patient, visit_id, serial_no)
+    serial_no = crud.next_serial_no(db, visit_id)
+    db_patient = crud.create_patient(db, patient, visit_id, serial_no)
+    if db_patient is None:
+        raise HTTPException(status_code=409, detail="Visit is archived and read-only")
+    return db_patient
 
 # Toggle fee status
 @router.patch("/patient/{patient_id}", response_model=schemas.PatientResponse)
@@ -37,6 +77,21 @@ def toggle_fee_status(patient_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Patient not found")
     return updated_patient
 
+# Bulk updates (explicit targets, safe to retry)
+@router.patch("/bulk", response_model=List[schemas.PatientBulkResult])
+def bulk_update_patients(payload: schemas.PatientBulkUpdate, db: Session = Depends(get_db)):
+    """Update many patients in one transaction and return per-id results"""
+    return crud.bulk_update_patients(db, payload.updates)
+
+@router.patch("/bulk/fee-status", response_model=List[schemas.PatientBulkResult])
+def bulk_set_fee_status(payload: schemas.PatientBulkFeeStatus, db: Session = Depends(get_db)):
+    """Set the same fee status on many patients in one transaction"""
+    updates = [
+        schemas.PatientBulkUpdateItem(id=patient_id, fee_status=payload.fee_status)
+        for patient_id in payload.patient_ids
+    ]
+    return crud.bulk_update_patients(db, updates)
+
 @router.put("/patient/{patient_id}", response_model=schemas.PatientResponse)
 def update_patient(
     patient_id: int, 
@@ -61,47 +116,26 @@ def delete_patient(patient_id: int, db: Session = Depends(get_db)):
 # Add this to patients.py
 
 @router.get("/unique/", response_model=List[dict])
-def get_unique_patients(db: Session = Depends(get_db)):
+def get_unique_patients(db: Session = Depends(get_read_db)):
     """Get all unique patients with their doctor visits"""
-    # Get all patients
-    all_patients = crud.get_all_patients(db)
-    
-    # Create a map to track unique patients
-    unique_patients_map = {}
-    
-    for patient in all_patients:
-        # Create a unique key based on name and contact
-        key = f"{patient.name}-{patient.contact}"
-        
-        # Get visit information
-        visit = crud.get_visit(db, patient.visit_id)
-        doctor_id = visit.doctor_id if visit else None
-        
-        if key not in unique_patients_map:
-            # First time seeing this patient
-            unique_patients_map[key] = {
-                "id": patient.id,
-                "name": patient.name,
-                "contact": patient.contact,
-                "feeStatus": patient.fee_status,
-                "visitId": patient.visit_id,
-                "serialNo": patient.serial_no,
-                "doctorVisits": [doctor_id] if doctor_id else []
-            }
-        else:
-            # We've seen this patient before
-            if doctor_id and doctor_id not in unique_patients_map[key]["doctorVisits"]:
-                unique_patients_map[key]["doctorVisits"].append(doctor_id)
-    
-    # Convert the map to a list
-    unique_patients = list(unique_patients_map.values())
-    
-    return unique_patients
+    # Concurrent requests share a single scan
+    return [
+        {
+            "id": patient["id"],
+            "name": patient["name"],
+            "contact": patient["contact"],
+            "feeStatus": patient["fee_status"],
+            "visitId": patient["visit_id"],
+            "serialNo": patient["serial_no"],
+            "doctorVisits": list(patient["doctor_visits"])
+        }
+        for patient in crud.get_unique_patients_shared(db)
+    ]
 
 # Update the endpoint in patients.py
 
 @router.get("/unique/", response_model=List[schemas.UniquePatientResponse])
-def get_unique_patients(db: Session = Depends(get_db)):
+def get_unique_patients(db: Session = Depends(get_read_db)):
     """Get all unique patients with their doctor visits"""
     return crud.get_unique_patients(db)
 
@@ -109,7 +143,7 @@ from typing import List
 
 
 @router.get("/unique/", response_model=List[dict])
-def get_unique_patients(db: Session = Depends(get_db)):
+def get_unique_patients(db: Session = Depends(get_read_db)):
     """
     Get all unique patients with their doctor visits.
     A patient is considered unique based on their name and contact information.
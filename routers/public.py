@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Request
+import schemas
+from bundle import public_bundle_response
+
+router = APIRouter(prefix="/public", tags=["Public"])
+
+@router.get("/bundle", response_model=schemas.PublicBundleResponse)
+def get_public_bundle(request: Request):
+    """
+    Doctors, available schedules and active gallery images in one prebuilt document
+    (rebuilt only when one of them changes)
+    """
+    return public_bundle_response(request)
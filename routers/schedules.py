@@ -1,10 +1,12 @@
 # schedules.py
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, Request, status, File, UploadFile, Form
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date, time
-import crud, schemas
-from database import get_db
+import crud, schemas, tasks, timetable
+from cache import cached_json
+from fieldsets import fields_param, partial_model
+from database import get_db, get_read_db
 import shutil
 import os
 from pydantic import parse_obj_as
@@ -19,12 +21,25 @@ UPLOAD_DIR = "uploads/doctors"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 @router.get("/", response_model=List[schemas.DoctorScheduleResponse])
-def get_schedules(db: Session = Depends(get_db)):
+def get_schedules(
+    request: Request,
+    fields: Optional[tuple] = Depends(fields_param(schemas.DoctorScheduleResponse)),
+    db: Session = Depends(get_read_db)
+):
     """
     Get all doctor schedules
     """
-    schedules = crud.get_schedules(db)
-    return schedules
+    return cached_json(
+        request, ("schedules", fields), ["doctor_schedules"], lambda: crud.get_schedules(db, fields=fields),
+        List[partial_model(schemas.DoctorScheduleResponse, fields)]
+    )
+
+@router.get("/conflicts", response_model=schemas.TimetableValidationResponse)
+def validate_timetable(db: Session = Depends(get_read_db)):
+    """
+    Report every overlapping pair of schedules and every invalid time range
+    """
+    return timetable.find_all_conflicts(db)
 
 @router.post("/", response_model=schemas.DoctorScheduleResponse, status_code=status.HTTP_201_CREATED)
 async def create_schedule(
@@ -36,12 +51,16 @@ async def create_schedule(
     is_available: bool = Form(True),
     specific_date: Optional[str] = Form(None),
     contact_number: Optional[str] = Form(None),
+    doctor_id: Optional[int] = Form(None),
     image: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db)
 ):
     """
     Create a doctor schedule with image upload
     """
+    if doctor_id is not None and not crud.get_doctor(db, doctor_id):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    
     # Handle image upload if provided
     image_filename = None
     if image and image.filename:
@@ -71,14 +90,21 @@ async def create_schedule(
         "end_time": end_time_obj,
         "is_available": is_available,
         "specific_date": specific_date_obj,
-        "contact_number": contact_number
+        "contact_number": contact_number,
+        "doctor_id": doctor_id
     }
     
     # Convert to pydantic model
     schedule = parse_obj_as(schemas.DoctorScheduleCreate, schedule_data)
     
     # Create schedule
-    return crud.create_schedule(db, schedule, image_filename)
+    try:
+        return crud.create_schedule(db, schedule, image_filename)
+    except ValueError as e:
+        if image_filename:
+            tasks.enqueue("delete_file", path=os.path.join(UPLOAD_DIR, image_filename))
+        status_code = 409 if isinstance(e, timetable.ScheduleConflict) else 400
+        raise HTTPException(status_code=status_code, detail=str(e))
 
 @router.put("/{schedule_id}", response_model=schemas.DoctorScheduleResponse)
 async def update_schedule(
@@ -91,15 +117,26 @@ async def update_schedule(
     is_available: Optional[bool] = Form(None),
     specific_date: Optional[str] = Form(None),
     contact_number: Optional[str] = Form(None),
+    doctor_id: Optional[int] = Form(None),
     image: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db)
 ):
     """
     Update doctor schedule with optional image
     """
+    if doctor_id is not None and not crud.get_doctor(db, doctor_id):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    
+    existing_schedule = crud.get_schedule(db, schedule_id)
+    if not existing_schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    old_image_filename = None
+    
     # Handle image upload if provided
     image_filename = None
     if image and image.filename:
+        old_image_filename = existing_schedule.image_filename
+        
         # Save the uploaded file
         file_extension = os.path.splitext(image.filename)[1]
         image_filename = f"{name or 'doctor'}_{os.urandom(4).hex()}{file_extension}"
@@ -126,14 +163,26 @@ async def update_schedule(
         update_data["specific_date"] = date.fromisoformat(specific_date) if specific_date else None
     if contact_number is not None:
         update_data["contact_number"] = contact_number
+    if doctor_id is not None:
+        update_data["doctor_id"] = doctor_id
     
     # Convert to pydantic model
     schedule_update = parse_obj_as(schemas.DoctorScheduleUpdate, update_data)
     
     # Update schedule
-    updated_schedule = crud.update_schedule(db, schedule_id, schedule_update, image_filename)
+    try:
+        updated_schedule = crud.update_schedule(db, schedule_id, schedule_update, image_filename)
+    except ValueError as e:
+        if image_filename:
+            tasks.enqueue("delete_file", path=os.path.join(UPLOAD_DIR, image_filename))
+        status_code = 409 if isinstance(e, timetable.ScheduleConflict) else 400
+        raise HTTPException(status_code=status_code, detail=str(e))
     if not updated_schedule:
         raise HTTPException(status_code=404, detail="Schedule not found")
+    
+    # Delete the replaced image in the background once the update is committed
+    if old_image_filename:
+        tasks.enqueue("delete_file", path=os.path.join(UPLOAD_DIR, old_image_filename))
     return updated_schedule
 
 @router.delete("/{schedule_id}", status_code=status.HTTP_204_NO_CONTENT)
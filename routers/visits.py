@@ -1,26 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 import crud, schemas
-from database import get_db
-from typing import List
+from cache import cached_json
+from fieldsets import fields_param, partial_model
+from database import get_db, get_read_db
+from datetime import date
+from typing import List, Optional
 
 router = APIRouter(prefix="/visits", tags=["Visits"])
 
 @router.get("/{doctor_id}", response_model=List[schemas.VisitResponse])
-def get_visits(doctor_id: int, db: Session = Depends(get_db)):
+def get_visits(
+    doctor_id: int,
+    request: Request,
+    fields: Optional[tuple] = Depends(fields_param(schemas.VisitResponse)),
+    db: Session = Depends(get_read_db)
+):
     """Get all visits for a specific doctor"""
     try:
         print(f"Fetching visits for doctor_id: {doctor_id}")
-        visits = crud.get_visits(db, doctor_id)
-        if not visits:
-            return []
-        return visits
+        return cached_json(
+            request, ("visits", doctor_id, fields), ["visits", "patients"],
+            lambda: crud.get_visits(db, doctor_id, fields), List[partial_model(schemas.VisitResponse, fields)]
+        )
     except Exception as e:
         print(f"Error in get_visits: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/detail/{visit_id}", response_model=schemas.VisitResponse)
-def get_visit_detail(visit_id: int, db: Session = Depends(get_db)):
+def get_visit_detail(visit_id: int, db: Session = Depends(get_read_db)):
     """Get detailed information about a specific visit"""
     visit = crud.get_visit(db, visit_id)
     if not visit:
@@ -30,7 +39,25 @@ def get_visit_detail(visit_id: int, db: Session = Depends(get_db)):
 @router.post("/{doctor_id}", response_model=schemas.VisitResponse, status_code=status.HTTP_201_CREATED)
 def create_visit(doctor_id: int, visit: schemas.VisitCreate, db: Session = Depends(get_db)):
     """Create a new visit for a doctor"""
-    return crud.create_visit(db, visit, doctor_id)
+    try:
+        db_visit = crud.create_visit(db, visit, doctor_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except IntegrityError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid visit: {e.orig}")
+    if db_visit is None:
+        raise HTTPException(status_code=409, detail="A visit for this doctor and date already exists")
+    return db_visit
+
+@router.put("/{doctor_id}/{visit_date}", response_model=schemas.VisitResponse)
+def get_or_create_visit(doctor_id: int, visit_date: date, response: Response, db: Session = Depends(get_db)):
+    """Get the doctor's visit for a date, creating it if needed (201 when created)"""
+    visit, created = crud.get_or_create_visit(db, doctor_id, visit_date)
+    if visit is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    if created:
+        response.status_code = status.HTTP_201_CREATED
+    return visit
 
 @router.delete("/{visit_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_visit(visit_id: int, db: Session = Depends(get_db)):
@@ -38,4 +65,5 @@ def delete_visit(visit_id: int, db: Session = Depends(get_db)):
     result = crud.delete_visit(db, visit_id)
     if not result:
         raise HTTPException(status_code=404, detail="Visit not found")
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    # Returning None keeps the headers get_db set on the injected response (the primary pin cookie)
+    return None
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import date, time,datetime
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
  
 
 
@@ -37,13 +37,15 @@ class VisitResponse(VisitBase):
         from_attributes = True
 
 # Patient Schema
+FeeStatus = Literal["paid", "due"]
+
 class PatientBase(BaseModel):
     name: str
     contact: str
     fee_status: str = Field(default="due")
 
 class PatientCreate(PatientBase):
-    pass
+    fee_status: FeeStatus = "due"
 
 class PatientResponse(PatientBase):
     id: int
@@ -58,7 +60,22 @@ class PatientResponse(PatientBase):
 class PatientUpdate(BaseModel):
     name: Optional[str] = None
     contact: Optional[str] = None
-    fee_status: Optional[str] = None
+    fee_status: Optional[FeeStatus] = None
+
+# Bulk Patient Update Schemas
+class PatientBulkUpdateItem(PatientUpdate):
+    id: int
+
+class PatientBulkUpdate(BaseModel):
+    updates: List[PatientBulkUpdateItem]
+
+class PatientBulkFeeStatus(BaseModel):
+    patient_ids: List[int]
+    fee_status: FeeStatus
+
+class PatientBulkResult(BaseModel):
+    id: int
+    updated: bool
 
 # Unique Patient Schema
 class UniquePatientResponse(BaseModel):
@@ -74,6 +91,7 @@ class UniquePatientResponse(BaseModel):
 # Doctor Schedule Schema
 # schemas.py
 class DoctorScheduleBase(BaseModel):
+    doctor_id: Optional[int] = None
     name: str
     specialization: str
     day_of_week: str
@@ -87,6 +105,7 @@ class DoctorScheduleCreate(DoctorScheduleBase):
     pass
 
 class DoctorScheduleUpdate(BaseModel):
+    doctor_id: Optional[int] = None
     name: Optional[str] = None
     specialization: Optional[str] = None
     day_of_week: Optional[str] = None
@@ -104,6 +123,14 @@ class DoctorScheduleResponse(DoctorScheduleBase):
         from_attributes = True
     
 
+class ScheduleConflictResponse(BaseModel):
+    schedule_id: int
+    conflicting_schedule_id: int
+
+class TimetableValidationResponse(BaseModel):
+    conflicts: List[ScheduleConflictResponse]
+    invalid_ranges: List[int]
+
 class DoctorWithScheduleResponse(DoctorResponse):
     schedules: List[DoctorScheduleResponse] = []
 
@@ -112,7 +139,7 @@ class GalleryImageBase(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
     image_url: str
-    order_index: int = 0
+    order_index: int = Field(0, description="Deprecated: position in the gallery order (see /gallery/{id}/move)")
     is_active: bool = True
 
 class GalleryImageCreate(GalleryImageBase):
@@ -121,14 +148,42 @@ class GalleryImageCreate(GalleryImageBase):
 class GalleryImageUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    order_index: Optional[int] = None
+    order_index: Optional[int] = Field(
+        None, ge=0, deprecated="Use /gallery/{id}/move; order_index moves the image to that position"
+    )
     is_active: Optional[bool] = None
 
+class GalleryImageMove(BaseModel):
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
+
+class GalleryOrder(BaseModel):
+    image_ids: List[int]
+
 class GalleryImageResponse(GalleryImageBase):
     id: int
     
     class Config:
         from_attributes = True
 
+# Public site bundle (doctors, available schedules and active gallery images in one document)
+class PublicBundleResponse(BaseModel):
+    version: str
+    generated_at: datetime
+    doctors: List[DoctorResponse]
+    schedules: List[DoctorScheduleResponse]
+    gallery: List[GalleryImageResponse]
+
+# Change feed (see changelog.py)
+class TableChanges(BaseModel):
+    upserted: List[dict]    # Current rows, serialized like the table's list endpoint
+    deleted: List[int]
+
+class ChangesResponse(BaseModel):
+    cursor: int
+    reset: bool    # The client must download everything again and continue from `cursor`
+    has_more: bool
+    changes: Dict[str, TableChanges]
+
        
 
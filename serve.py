@@ -0,0 +1,38 @@
+"""
+Production entry point: runs the API in several worker processes.
+
+    python serve.py
+
+Workers default to one per available CPU (override with WEB_CONCURRENCY).
+Each worker keeps its own caches and they stay coherent through the
+`data_versions` table (see cache.py), so no shared memory is needed.
+
+Send SIGHUP to this process to gracefully restart all workers, e.g. after a
+deploy; in-flight requests get GRACEFUL_TIMEOUT seconds to finish.
+"""
+import os
+import uvicorn
+from database import engine
+from migrations import run_migrations
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+if __name__ == "__main__":
+    # Apply schema changes once, before the workers start importing the app
+    run_migrations(engine)
+    engine.dispose()
+
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", available_cpus())),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        proxy_headers=True,
+    )
@@ -0,0 +1,98 @@
+"""
+Single-flight execution: concurrent calls for the same key share one run.
+
+The first caller for a key executes the function; callers arriving while it
+runs wait for (and share) its result instead of repeating the work. With
+`stale_for`, callers that arrive during a run get the previous result
+immediately if it completed less than `stale_for` seconds ago
+(stale-while-revalidate, where the in-flight run is the revalidation).
+
+Works from sync handlers (`do`) and async handlers (`do_async`); both share
+the same in-flight runs.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}     # key -> Future of the running call
+        self._results = {}     # key -> (completed_at, value), only kept for stale reads
+        self._lock = threading.Lock()
+        self._executions = 0
+        self._coalesced = 0
+        self._stale_served = 0
+
+    def _join(self, key, stale_for):
+        """Return ("stale", value), ("wait", future) or ("lead", future)"""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is None:
+                future = self._flights[key] = Future()
+                self._executions += 1
+                return "lead", future
+
+            if stale_for:
+                previous = self._results.get(key)
+                if previous is not None and time.monotonic() - previous[0] <= stale_for:
+                    self._stale_served += 1
+                    return "stale", previous[1]
+
+            self._coalesced += 1
+            return "wait", future
+
+    def _finish(self, key, future, stale_for, value=None, error=None):
+        with self._lock:
+            del self._flights[key]
+            if error is None and stale_for:
+                self._results[key] = (time.monotonic(), value)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, fn, stale_for: float = 0.0):
+        """Run `fn()` once for all concurrent callers with the same `key`"""
+        role, value = self._join(key, stale_for)
+        if role == "stale":
+            return value
+        if role == "wait":
+            return value.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, value, stale_for, error=e)
+            raise
+        self._finish(key, value, stale_for, result)
+        return result
+
+    async def do_async(self, key, fn, stale_for: float = 0.0):
+        """Async variant of `do`; `fn` is a coroutine function"""
+        role, value = self._join(key, stale_for)
+        if role == "stale":
+            return value
+        if role == "wait":
+            return await asyncio.wrap_future(value)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, value, stale_for, error=e)
+            raise
+        self._finish(key, value, stale_for, result)
+        return result
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "stale_served": self._stale_served,
+                "in_flight": len(self._flights),
+            }
+
+
+flights = SingleFlight()
@@ -0,0 +1,181 @@
+"""
+In-process background task queue for side effects that must not slow down
+requests (file deletions, cache invalidation, ...).
+
+Tasks are registered by name with `@task(...)` and take JSON-serializable
+keyword arguments. Every enqueued task is written to a SQLite journal before
+it runs and removed once it succeeds, so work interrupted by a crash is
+replayed on the next start.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def task(name: str):
+    """Register a function as a background task under `name`"""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+class TaskQueue:
+    def __init__(self, journal_path: str, max_workers: int = 2, max_retries: int = 3, retry_delay: float = 1.0,
+                 failed_retention: float = 7 * 86400):
+        self.journal_path = journal_path
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.failed_retention = failed_retention    # Seconds a failed task is kept for inspection
+        self._lock = threading.Lock()
+        self._journal = None
+        self._executor = None
+
+    def start(self):
+        """Open the journal, start the workers and replay unfinished tasks"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._journal = sqlite3.connect(self.journal_path, check_same_thread=False)
+            self._journal.execute("PRAGMA journal_mode=WAL")
+            self._journal.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL DEFAULT 'pending', "
+                "last_error TEXT, created_at REAL NOT NULL)"
+            )
+            self._prune_failed()
+            self._journal.commit()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="task-worker")
+            pending = self._journal.execute(
+                "SELECT id, name, payload, attempts FROM tasks WHERE status = 'pending' ORDER BY id"
+            ).fetchall()
+
+        for task_id, name, payload, attempts in pending:
+            self._submit(task_id, name, json.loads(payload), attempts)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers; tasks that have not finished stay in the journal"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def enqueue(self, name: str, **kwargs):
+        """Journal a task and hand it to the worker pool"""
+        if name not in _handlers:
+            raise ValueError(f"Unknown task: {name}")
+        self.start()
+        with self._lock:
+            cursor = self._journal.execute(
+                "INSERT INTO tasks (name, payload, created_at) VALUES (?, ?, ?)",
+                (name, json.dumps(kwargs), time.time())
+            )
+            self._journal.commit()
+            task_id = cursor.lastrowid
+        self._submit(task_id, name, kwargs, 0)
+        return task_id
+
+    def _submit(self, task_id, name, kwargs, attempts):
+        executor = self._executor
+        if executor is None:
+            return  # Shutting down, the journal keeps the task for the next start
+        try:
+            executor.submit(self._run, task_id, name, kwargs, attempts)
+        except RuntimeError:
+            pass
+
+    def _run(self, task_id, name, kwargs, attempts):
+        try:
+            _handlers[name](**kwargs)
+        except Exception as e:
+            attempts += 1
+            failed = attempts >= self.max_retries
+            logger.warning("Task %s (%s) failed on attempt %d: %s", task_id, name, attempts, e)
+            self._journal_update(
+                "UPDATE tasks SET attempts = ?, status = ?, last_error = ? WHERE id = ?",
+                (attempts, "failed" if failed else "pending", str(e), task_id)
+            )
+            if failed:
+                with self._lock:
+                    if self._journal is not None:
+                        self._prune_failed()
+                        self._journal.commit()
+            else:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                timer = threading.Timer(delay, self._submit, (task_id, name, kwargs, attempts))
+                timer.daemon = True
+                timer.start()
+        else:
+            self._journal_update("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+    def _prune_failed(self):
+        """Drop failed tasks older than the retention (caller holds the lock)"""
+        self._journal.execute(
+            "DELETE FROM tasks WHERE status = 'failed' AND created_at < ?", (time.time() - self.failed_retention,)
+        )
+
+    def _journal_update(self, sql, params):
+        with self._lock:
+            if self._journal is None:
+                return
+            self._journal.execute(sql, params)
+            self._journal.commit()
+
+
+task_queue = TaskQueue(
+    os.getenv("TASK_JOURNAL_PATH", "task_journal.db"),
+    max_workers=int(os.getenv("TASK_WORKERS", "2")),
+    max_retries=int(os.getenv("TASK_MAX_RETRIES", "3")),
+    failed_retention=float(os.getenv("TASK_FAILED_RETENTION_SECONDS", str(7 * 86400))),
+)
+
+
+def enqueue(name: str, **kwargs):
+    return task_queue.enqueue(name, **kwargs)
+
+
+def enqueue_after_commit(db: Session, name: str, **kwargs):
+    """Enqueue a task once the session's current transaction commits (dropped on rollback)"""
+    if name not in _handlers:
+        raise ValueError(f"Unknown task: {name}")
+    db.info.setdefault("after_commit_tasks", []).append((name, kwargs))
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_committed_tasks(session):
+    for name, kwargs in session.info.pop("after_commit_tasks", []):
+        task_queue.enqueue(name, **kwargs)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_tasks(session, previous_transaction):
+    session.info.pop("after_commit_tasks", None)
+
+
+# Built-in tasks
+@task("delete_file")
+def delete_file(path: str):
+    """Remove an uploaded file if it still exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
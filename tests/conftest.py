@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point the app at a throwaway SQLite database before anything imports database.py
+_work = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_work}/test.db"
+os.environ["IDEMPOTENCY_STORE_PATH"] = f"{_work}/idempotency_keys.db"
+os.environ["TASK_JOURNAL_PATH"] = f"{_work}/task_journal.db"
+os.environ.pop("READ_DATABASE_URL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Uploads are written relative to the working directory
+os.chdir(_work)
+
+import models  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+run_migrations(engine)
+
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(params=[True, False], ids=["returning", "no-returning"])
+def returning(request, monkeypatch):
+    """Run with and without UPDATE/DELETE ... RETURNING (the MySQL path)"""
+    monkeypatch.setattr(engine.dialect, "update_returning", request.param)
+    monkeypatch.setattr(engine.dialect, "delete_returning", request.param)
+    return request.param
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        for model in (
+            models.ArchivedPatient, models.ArchivedVisit, models.Patient, models.Visit,
+            models.DoctorSchedule, models.Doctor,
+        ):
+            session.query(model).delete()
+        session.commit()
+        session.close()
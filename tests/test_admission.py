@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionMiddleware, AdmissionRule, PriorityClass
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("GET", "/patients/unique", "aggregates"),
+    ("GET", "/doctors/3/patient-count", "aggregates"),
+    ("POST", "/doctors/", "uploads"),
+    ("GET", "/doctors/", "reads"),
+    ("DELETE", "/visits/1", "writes"),
+    ("GET", "/metrics", None),
+    ("GET", "/patients/1/events", None),
+])
+def test_main_rules(method, path, expected):
+    import main
+
+    middleware = AdmissionMiddleware(None, main.admission_classes, main.admission_rules)
+    priority_class = middleware.classify(method, path)
+    assert (priority_class.name if priority_class else None) == expected
+
+
+def shedding_app(priority_class):
+    """Middleware around an app whose requests run until `release` is set"""
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/fail":
+            raise RuntimeError("boom")
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(app, {"test": priority_class}, [AdmissionRule("*", "test")])
+    return middleware, release
+
+
+async def call(app, path="/"):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app({"type": "http", "method": "GET", "path": path}, None, send)
+    return messages[0]["status"], dict(messages[0]["headers"])
+
+
+def test_full_queue_is_shed():
+    async def scenario():
+        priority_class = PriorityClass("test", max_concurrent=1, max_queue=1, queue_timeout=5, retry_after=7)
+        app, release = shedding_app(priority_class)
+        running = asyncio.ensure_future(call(app))
+        queued = asyncio.ensure_future(call(app))
+        await asyncio.sleep(0.01)
+        assert priority_class.metrics()["active"] == 1
+        assert priority_class.metrics()["queued"] == 1
+
+        status, headers = await call(app)
+        assert (status, headers[b"retry-after"]) == (503, b"7")
+
+        release.set()
+        assert [(await running)[0], (await queued)[0]] == [200, 200]
+        return priority_class.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert (metrics["admitted"], metrics["rejected"], metrics["active"], metrics["queued"]) == (2, 1, 0, 0)
+
+
+def test_queue_timeout_is_shed():
+    async def scenario():
+        priority_class = PriorityClass("test", max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        app, release = shedding_app(priority_class)
+        running = asyncio.ensure_future(call(app))
+        await asyncio.sleep(0.01)
+        assert (await call(app))[0] == 503
+        release.set()
+        await running
+        return priority_class.metrics()
+
+    assert asyncio.run(scenario())["timed_out"] == 1
+
+
+def test_slot_is_released_when_the_app_fails():
+    async def scenario():
+        priority_class = PriorityClass("test", max_concurrent=1, max_queue=0, queue_timeout=1)
+        app, release = shedding_app(priority_class)
+        with pytest.raises(RuntimeError):
+            await call(app, "/fail")
+        release.set()
+        return await call(app)
+
+    assert asyncio.run(scenario())[0] == 200
@@ -0,0 +1,50 @@
+from datetime import date, timedelta
+
+import archive
+import crud
+import models
+import schemas
+
+
+def add_visit(db, doctor_id, visit_date, *patients):
+    visit = crud.create_visit(db, schemas.VisitCreate(date=visit_date), doctor_id)
+    for serial_no, name in enumerate(patients, 1):
+        crud.create_patient(db, schemas.PatientCreate(name=name, contact="1"), visit.id, serial_no)
+    return visit
+
+
+def test_archive_moves_old_visits_and_keeps_them_readable(db):
+    doctor = crud.create_doctor(db, schemas.DoctorCreate(name="Dr. A", specialization="GP", phone="1"))
+    old = add_visit(db, doctor.id, date.today() - timedelta(days=400), "Old")
+    recent = add_visit(db, doctor.id, date.today(), "New")
+
+    assert archive.archive_visits(db, archive.archive_cutoff()) == {"visits": 1, "patients": 1, "batches": 1}
+    assert db.get(models.Visit, old.id) is None
+    assert db.get(models.ArchivedVisit, old.id) is not None
+    assert {visit.id for visit in crud.get_visits(db, doctor.id)} == {old.id, recent.id}
+    assert [patient.name for patient in crud.get_patients(db, old.id)] == ["Old"]
+
+
+def test_archived_visits_are_read_only(db):
+    doctor = crud.create_doctor(db, schemas.DoctorCreate(name="Dr. A", specialization="GP", phone="1"))
+    old_date = date.today() - timedelta(days=400)
+    old = add_visit(db, doctor.id, old_date, "Old")
+    archive.archive_visits(db, archive.archive_cutoff())
+
+    assert crud.create_patient(db, schemas.PatientCreate(name="Late", contact="1"), old.id, 2) is None
+    assert crud.create_visit(db, schemas.VisitCreate(date=old_date), doctor.id) is None
+    visit, created = crud.get_or_create_visit(db, doctor.id, old_date)
+    assert (visit.id, created) == (old.id, False)
+    # New ids never reuse archived ones
+    assert add_visit(db, doctor.id, date.today()).id > old.id
+
+
+def test_deleting_a_doctor_removes_archived_history(db):
+    doctor = crud.create_doctor(db, schemas.DoctorCreate(name="Dr. A", specialization="GP", phone="1"))
+    old = add_visit(db, doctor.id, date.today() - timedelta(days=400), "Old")
+    archive.archive_visits(db, archive.archive_cutoff())
+
+    assert crud.delete_doctor(db, doctor.id)
+    assert db.query(models.ArchivedVisit).filter(models.ArchivedVisit.doctor_id == doctor.id).count() == 0
+    assert db.query(models.ArchivedPatient).filter(models.ArchivedPatient.visit_id == old.id).count() == 0
+    assert crud.get_visits(db, doctor.id) == []
@@ -0,0 +1,56 @@
+import models
+
+
+def create_patients(client, *names):
+    doctor_id = client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"}).json()["id"]
+    visit_id = client.post(f"/visits/{doctor_id}", json={"date": "2026-10-19"}).json()["id"]
+    return [
+        client.post(f"/patients/{visit_id}", json={"name": name, "contact": "9"}).json()["id"]
+        for name in names
+    ]
+
+
+def test_bulk_update_reports_each_id(client, db, returning):
+    first, second, third = create_patients(client, "P", "Q", "R")
+    response = client.patch("/patients/bulk", json={"updates": [
+        {"id": first, "fee_status": "paid"},
+        {"id": second, "fee_status": "paid"},
+        {"id": third, "name": "S", "contact": "8"},
+        {"id": 999999, "fee_status": "paid"},
+    ]})
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": first, "updated": True},
+        {"id": second, "updated": True},
+        {"id": third, "updated": True},
+        {"id": 999999, "updated": False},
+    ]
+
+    db.expire_all()
+    patients = {patient.id: patient for patient in db.query(models.Patient)}
+    assert [patients[first].fee_status, patients[second].fee_status] == ["paid", "paid"]
+    assert (patients[third].name, patients[third].contact, patients[third].fee_status) == ("S", "8", "due")
+
+
+def test_bulk_fee_status(client, db, returning):
+    patient_ids = create_patients(client, "P", "Q")
+    response = client.patch(
+        "/patients/bulk/fee-status", json={"patient_ids": patient_ids + [999999], "fee_status": "paid"}
+    )
+    assert [result["updated"] for result in response.json()] == [True, True, False]
+    db.expire_all()
+    assert {patient.fee_status for patient in db.query(models.Patient)} == {"paid"}
+
+    # Retrying the same request is harmless
+    again = client.patch("/patients/bulk/fee-status", json={"patient_ids": patient_ids, "fee_status": "paid"})
+    assert [result["updated"] for result in again.json()] == [True, True]
+
+
+def test_invalid_item_rejects_the_whole_request(client, db):
+    [patient_id] = create_patients(client, "P")
+    invalid = client.patch("/patients/bulk", json={"updates": [
+        {"id": patient_id, "fee_status": "paid"},
+        {"id": patient_id, "fee_status": "unknown"},
+    ]})
+    assert invalid.status_code == 422
+    assert db.get(models.Patient, patient_id).fee_status == "due"
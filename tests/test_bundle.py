@@ -0,0 +1,90 @@
+import json
+import time
+
+import pytest
+
+import bundle
+import crud
+from bundle import BUNDLE_TABLES, PublicBundle, _not_older
+from cache import current_versions
+from compression import decompress
+
+
+def doctor_names(cached):
+    return [doctor["name"] for doctor in json.loads(cached.body)["doctors"]]
+
+
+def add_doctor(client, name):
+    client.post("/doctors/", data={"name": name, "specialization": "GP", "phone": "1"})
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_not_older():
+    assert _not_older((2, 1, 1), (1, 1, 1))
+    assert _not_older((1, 1, 1), (1, 1, 1))
+    assert not _not_older((2, 0, 1), (1, 1, 1))
+
+
+def test_swap_after_a_change(client, db):
+    add_doctor(client, "Dr. A")
+    public = PublicBundle()
+    versions, cached = public.get()
+    assert versions == current_versions(BUNDLE_TABLES)
+    assert doctor_names(cached) == ["Dr. A"]
+
+    add_doctor(client, "Dr. B")
+    # The previous bundle is served while the new one builds in the background
+    stale_versions, stale = public.get()
+    assert (stale_versions, stale) == (versions, cached)
+    wait_for(lambda: public.get()[0] == current_versions(BUNDLE_TABLES))
+    assert doctor_names(public.get()[1]) == ["Dr. A", "Dr. B"]
+
+
+def test_older_build_does_not_replace_a_newer_bundle(client, db):
+    public = PublicBundle()
+    old_versions = current_versions(BUNDLE_TABLES)
+    add_doctor(client, "Dr. A")
+    newer = public.get()
+
+    public._build(old_versions)
+    assert public.get() == newer
+
+
+def test_restart_serves_the_bundle_from_disk(client, db, tmp_path, monkeypatch):
+    path = str(tmp_path / "public_bundle.json")
+    add_doctor(client, "Dr. A")
+    versions, cached = PublicBundle(path).get()
+
+    # A new worker does not query the database for it
+    monkeypatch.setattr(crud, "get_doctors", lambda db: pytest.fail("queried the database"))
+    restarted = PublicBundle(path)
+    loaded_versions, loaded = restarted.get()
+    assert (loaded_versions, loaded.body) == (versions, cached.body)
+    assert decompress(loaded.encoded("gzip"), "gzip") == cached.body
+
+
+def test_mismatched_variant_on_disk_is_ignored(client, db, tmp_path, monkeypatch):
+    path = str(tmp_path / "public_bundle.json")
+    add_doctor(client, "Dr. A")
+    _, cached = PublicBundle(path).get()
+    # Another worker replaced the variant with a different bundle between reads
+    with open(path + ".gz", "wb") as f:
+        f.write(bundle.compress(b"{}", "gzip"))
+
+    _, loaded = PublicBundle(path).get()
+    assert decompress(loaded.encoded("gzip"), "gzip") == cached.body
+
+
+def test_endpoint(client, db):
+    add_doctor(client, "Dr. A")
+    client.cookies.clear()
+    # The process-wide bundle may still hold an earlier build until its rebuild lands
+    wait_for(lambda: [doctor["name"] for doctor in client.get("/public/bundle").json()["doctors"]] == ["Dr. A"])
+    response = client.get("/public/bundle")
+    assert client.get("/public/bundle", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
@@ -0,0 +1,69 @@
+from sqlalchemy import insert, update
+
+import models
+from cache import VersionTracker, VersionedCache, bump_version, tracker
+from database import engine
+
+
+def write_from_another_worker(name, bump=True):
+    """Add a doctor without going through this process's session listeners"""
+    with engine.begin() as conn:
+        conn.execute(insert(models.Doctor).values(name=name, specialization="GP", phone="1"))
+        if bump:
+            conn.execute(
+                update(models.DataVersion).where(models.DataVersion.name == "doctors")
+                .values(version=models.DataVersion.version + 1)
+            )
+
+
+def test_tracker_polls_at_most_once_per_interval(db):
+    worker = VersionTracker(poll_interval=3600)
+    version = worker.get("doctors")
+    write_from_another_worker("Dr. B")
+    assert worker.get("doctors") == version
+
+    worker.refresh()    # the poll interval passed
+    assert worker.get("doctors") == version + 1
+
+
+def test_local_commits_are_seen_immediately(db):
+    tracker.refresh()
+    version = tracker.get("doctors")
+    commits = tracker.local_commits("doctors")
+
+    bump_version(db, "doctors")
+    db.rollback()
+    assert tracker.local_commits("doctors") == commits
+
+    bump_version(db, "doctors")
+    db.commit()
+    assert tracker.local_commits("doctors") == commits + 1
+    assert tracker.get("doctors") == version + 1
+
+
+def test_versioned_cache():
+    cache = VersionedCache(max_entries=2)
+    assert cache.get_or_load("a", (1,), lambda: "a1") == "a1"
+    assert cache.get_or_load("a", (1,), lambda: "unused") == "a1"
+    assert cache.get_or_load("a", (2,), lambda: "a2") == "a2"
+
+    cache.get_or_load("b", (1,), lambda: "b1")
+    cache.get_or_load("c", (1,), lambda: "c1")
+    assert cache.get_or_load("a", (2,), lambda: "reloaded") == "reloaded"
+
+
+def test_cached_list_follows_other_workers(client, db):
+    client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"})
+    client.cookies.clear()
+
+    def names():
+        return [doctor["name"] for doctor in client.get("/doctors/").json()]
+
+    assert names() == ["Dr. A"]
+    # Without a version bump the cached body is still served
+    write_from_another_worker("Dr. B", bump=False)
+    assert names() == ["Dr. A"]
+
+    write_from_another_worker("Dr. C")
+    tracker.expire()    # the poll interval passed
+    assert names() == ["Dr. A", "Dr. B", "Dr. C"]
@@ -0,0 +1,77 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import Session
+
+import archive
+import changelog
+import crud
+import migrations
+import models
+import schemas
+from database import SessionLocal
+
+
+def test_changes_after_cursor(db):
+    cursor = changelog.latest_cursor(db)
+    doctor = crud.create_doctor(db, schemas.DoctorCreate(name="Dr. A", specialization="GP", phone="1"))
+    visit = crud.create_visit(db, schemas.VisitCreate(date=date.today()), doctor.id)
+    crud.delete_visit(db, visit.id)
+
+    feed = changelog.read_changes(db, cursor)
+    assert not feed["reset"]
+    assert [row["id"] for row in feed["changes"]["doctors"]["upserted"]] == [doctor.id]
+    assert feed["changes"]["visits"] == {"upserted": [], "deleted": [visit.id]}
+    assert changelog.read_changes(db, feed["cursor"])["changes"] == {}
+
+
+def test_archived_rows_are_logged_and_served_from_the_archive(db):
+    doctor = crud.create_doctor(db, schemas.DoctorCreate(name="Dr. A", specialization="GP", phone="1"))
+    visit = crud.create_visit(db, schemas.VisitCreate(date=date.today() - timedelta(days=400)), doctor.id)
+    patient = crud.create_patient(db, schemas.PatientCreate(name="Old", contact="1"), visit.id, 1)
+    cursor = changelog.latest_cursor(db)
+
+    archive.archive_visits(db, archive.archive_cutoff())
+    changes = changelog.read_changes(db, cursor)["changes"]
+    assert [row["id"] for row in changes["visits"]["upserted"]] == [visit.id]
+    assert [row["id"] for row in changes["patients"]["upserted"]] == [patient.id]
+    assert changes["patients"]["deleted"] == []
+
+
+def test_compaction_raises_the_floor_with_the_first_batch(db):
+    crud.create_doctor(db, schemas.DoctorCreate(name="Dr. A", specialization="GP", phone="1"))
+    crud.create_doctor(db, schemas.DoctorCreate(name="Dr. B", specialization="GP", phone="1"))
+    cursor = changelog.latest_cursor(db)
+    floors = []
+
+    @event.listens_for(db, "after_commit")
+    def observe(session):
+        with SessionLocal() as other:
+            floors.append(changelog.change_log_floor(other))
+
+    removed = changelog.compact_change_log(db, datetime.utcnow() + timedelta(seconds=1), batch_size=1)
+    event.remove(db, "after_commit", observe)
+    assert removed >= 2
+    assert floors[0] == cursor
+    assert changelog.read_changes(db, cursor - 1)["reset"]
+    assert not changelog.read_changes(db, cursor)["reset"]
+
+
+def test_visit_merge_is_logged():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX uq_visits_doctor_date")
+        conn.execute(insert(models.Doctor.__table__).values(id=1, name="Dr. A"))
+        conn.execute(insert(models.Visit.__table__), [
+            {"id": 1, "doctor_id": 1, "date": date(2026, 1, 1)},
+            {"id": 2, "doctor_id": 1, "date": date(2026, 1, 1)},
+        ])
+        conn.execute(insert(models.Patient.__table__).values(id=5, visit_id=2, serial_no=1))
+    migrations.run_migrations(engine)
+
+    with Session(engine) as session:
+        log = models.ChangeLogEntry
+        entries = session.execute(select(log.table_name, log.row_id, log.op, log.visit_id).order_by(log.id)).all()
+        assert entries == [("patients", 5, "upsert", 1), ("visits", 2, "delete", 2)]
+        assert session.get(models.Patient, 5).visit_id == 1
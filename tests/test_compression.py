@@ -0,0 +1,90 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response
+from fastapi.testclient import TestClient
+
+import cache
+import compression
+from compression import CompressionMiddleware, choose_encoding, compress, decompress
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("*", "br"),
+    ("*;q=0, gzip", "gzip"),
+    ("deflate", None),
+])
+def test_choose_encoding(header, expected):
+    assert choose_encoding(header) == expected
+
+
+def test_choose_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert choose_encoding("br, gzip") == "gzip"
+    assert choose_encoding("br") is None
+
+
+@pytest.fixture
+def app_client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/large")
+    def large():
+        return {"items": ["patient"] * 100}
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    @app.get("/image")
+    def image():
+        return Response(b"\x89PNG" * 100, media_type="image/png")
+
+    @app.get("/encoded")
+    def encoded():
+        return PlainTextResponse("x" * 200, headers={"Content-Encoding": "identity"})
+
+    return TestClient(app)
+
+
+def test_middleware(app_client):
+    raw = app_client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert raw.headers["content-encoding"] == "gzip"
+    assert raw.headers["vary"] == "Accept-Encoding"
+    assert raw.json() == {"items": ["patient"] * 100}
+    assert int(raw.headers["content-length"]) < len(raw.content)
+
+    assert "content-encoding" not in app_client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in app_client.get("/image", headers={"Accept-Encoding": "gzip"}).headers
+    assert app_client.get("/encoded", headers={"Accept-Encoding": "gzip"}).headers["content-encoding"] == "identity"
+    assert "content-encoding" not in app_client.get("/large", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_cached_listing_variants(client, db, monkeypatch):
+    compressed = []
+    monkeypatch.setattr(cache, "compress", lambda body, encoding: compressed.append(encoding) or compress(body, encoding))
+    for number in range(40):
+        client.post("/doctors/", data={"name": f"Dr. {number}", "specialization": "General practice", "phone": "1"})
+    client.cookies.clear()
+
+    def fetch(encoding):
+        with client.stream("GET", "/doctors/", headers={"Accept-Encoding": encoding}) as response:
+            return response.headers, b"".join(response.iter_raw())
+
+    plain_headers, plain = fetch("identity")
+    assert "content-encoding" not in plain_headers
+    for encoding in ("br", "gzip"):
+        headers, body = fetch(encoding)
+        assert headers["content-encoding"] == encoding
+        assert headers["etag"] == plain_headers["etag"]
+        assert "Accept-Encoding" in headers["vary"]
+        assert decompress(body, encoding) == plain
+        assert fetch(encoding)[1] == body
+    # Each variant is compressed once and then served from the cache
+    assert compressed == ["br", "gzip"]
@@ -0,0 +1,50 @@
+import models
+
+
+def create_doctor(client, **fields):
+    data = {"name": "Dr. A", "specialization": "GP", "phone": "1", **fields}
+    return client.post("/doctors/", data=data).json()["id"]
+
+
+def create_schedule(client, **fields):
+    data = {
+        "name": "Dr. A", "specialization": "GP", "day_of_week": "Monday",
+        "start_time": "09:00", "end_time": "10:00", **fields,
+    }
+    response = client.post("/schedules/", data=data)
+    assert response.status_code == 201
+    return response.json()
+
+
+def test_update_copies_details_to_linked_schedules(client, db):
+    doctor_id = create_doctor(client)
+    linked = create_schedule(client, doctor_id=doctor_id)
+    other = create_schedule(client, name="Dr. B", start_time="11:00", end_time="12:00")
+    cursor = client.get("/changes/").json()["cursor"]
+
+    response = client.put(
+        f"/doctors/{doctor_id}", data={"name": "Dr. A Smith", "specialization": "Cardiology", "phone": "2"}
+    )
+    assert response.status_code == 200
+
+    schedules = {schedule["id"]: schedule for schedule in client.get("/schedules/").json()}
+    assert schedules[linked["id"]]["name"] == "Dr. A Smith"
+    assert schedules[linked["id"]]["specialization"] == "Cardiology"
+    assert schedules[linked["id"]]["contact_number"] == "2"
+    assert schedules[other["id"]]["name"] == "Dr. B"
+
+    with_schedules = client.get("/doctors/with-schedules").json()
+    [doctor] = [doctor for doctor in with_schedules if doctor["id"] == doctor_id]
+    assert [schedule["name"] for schedule in doctor["schedules"]] == ["Dr. A Smith"]
+
+    changes = client.get("/changes/", params={"since": cursor}).json()["changes"]
+    assert [row["id"] for row in changes["doctors"]["upserted"]] == [doctor_id]
+    assert [row["id"] for row in changes["doctor_schedules"]["upserted"]] == [linked["id"]]
+    assert changes["doctor_schedules"]["upserted"][0]["name"] == "Dr. A Smith"
+
+
+def test_update_without_schedules(client, db):
+    doctor_id = create_doctor(client)
+    response = client.put(f"/doctors/{doctor_id}", data={"name": "Dr. C", "specialization": "GP", "phone": "3"})
+    assert response.status_code == 200
+    assert db.get(models.Doctor, doctor_id).name == "Dr. C"
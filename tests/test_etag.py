@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import event
+from starlette.requests import Request
+
+from cache import etag_matches, tracker
+from database import engine
+
+
+def request_with(if_none_match):
+    return Request({"type": "http", "headers": [(b"if-none-match", if_none_match.encode())]})
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('W/"1.2"', True),
+    ('"1.2"', True),
+    ('W/"1.1", W/"1.2"', True),
+    ("*", True),
+    ('W/"1.3"', False),
+    ('W/"1"', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(request_with(header), 'W/"1.2"') is matches
+
+
+def test_revalidation(client, db):
+    client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"})
+    client.cookies.clear()
+
+    first = client.get("/doctors/")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    tracker.refresh()
+    checkouts = []
+
+    def checkout(*args):
+        checkouts.append(args)
+
+    event.listen(engine.pool, "checkout", checkout)
+    try:
+        revalidated = client.get("/doctors/", headers={"If-None-Match": etag})
+    finally:
+        event.remove(engine.pool, "checkout", checkout)
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+    # Answered from the version counters without a database connection
+    assert checkouts == []
+
+    client.post("/doctors/", data={"name": "Dr. B", "specialization": "GP", "phone": "1"})
+    client.cookies.clear()
+    changed = client.get("/doctors/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert [doctor["name"] for doctor in changed.json()] == ["Dr. A", "Dr. B"]
+
@@ -0,0 +1,59 @@
+import asyncio
+
+import events
+from events import VisitEventBroker
+
+
+def record_published(monkeypatch):
+    published = []
+    monkeypatch.setattr(events.broker, "publish", lambda *event: published.append(event))
+    return published
+
+
+def create_visit(client):
+    doctor_id = client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"}).json()["id"]
+    return client.post(f"/visits/{doctor_id}", json={"date": "2026-10-19"}).json()["id"]
+
+
+def test_deleting_a_visit_publishes_its_patients(client, monkeypatch):
+    visit_id = create_visit(client)
+    patient_ids = [
+        client.post(f"/patients/{visit_id}", json={"name": name, "contact": "9"}).json()["id"]
+        for name in ("P", "Q")
+    ]
+    published = record_published(monkeypatch)
+
+    assert client.delete(f"/visits/{visit_id}").status_code == 204
+    assert published == [
+        (visit_id, "patient.deleted", {"id": patient_ids[0]}),
+        (visit_id, "patient.deleted", {"id": patient_ids[1]}),
+        (visit_id, "visit.deleted", {"id": visit_id}),
+    ]
+
+
+def test_deleting_a_doctor_publishes_for_each_visit(client, monkeypatch):
+    visit_id = create_visit(client)
+    doctor_id = client.get(f"/visits/detail/{visit_id}").json()["doctor_id"]
+    published = record_published(monkeypatch)
+
+    assert client.delete(f"/doctors/{doctor_id}").status_code == 200
+    assert published == [(visit_id, "visit.deleted", {"id": visit_id})]
+
+
+def test_resume_from_last_event_id():
+    broker = VisitEventBroker(history=3)
+    for number in range(1, 6):
+        broker.publish(1, "patient.updated", {"id": number})
+
+    async def backlog(last_event_id):
+        subscription, frames = broker.subscribe(1, last_event_id)
+        broker.unsubscribe(subscription)
+        return frames
+
+    frames = asyncio.run(backlog(f"{broker.epoch}-3"))
+    assert [frame.split(b"\n")[0] for frame in frames] == [
+        f"id: {broker.epoch}-4".encode(), f"id: {broker.epoch}-5".encode(),
+    ]
+    assert asyncio.run(backlog(f"{broker.epoch}-5")) == []
+    assert b"event: resync" in asyncio.run(backlog(f"{broker.epoch}-1"))[0]
+    assert b"unknown_event_id" in asyncio.run(backlog("other-2"))[0]
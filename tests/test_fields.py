@@ -0,0 +1,65 @@
+import re
+
+from sqlalchemy import event
+
+from database import engine
+
+
+def setup_visit(client):
+    doctor_id = client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"}).json()["id"]
+    visit_id = client.post(f"/visits/{doctor_id}", json={"date": "2026-10-19"}).json()["id"]
+    for name in ("P", "Q"):
+        client.post(f"/patients/{visit_id}", json={"name": name, "contact": "9"})
+    client.cookies.clear()
+    return doctor_id, visit_id
+
+
+def selects(call):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = call()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return response.json(), statements
+
+
+def test_selected_fields_only(client, db):
+    doctor_id, visit_id = setup_visit(client)
+    doctors, statements = selects(lambda: client.get("/doctors/", params={"fields": "name, id,name"}))
+    assert doctors == [{"name": "Dr. A", "id": doctor_id}]
+    # Only the requested columns are read
+    [query] = [statement for statement in statements if "FROM doctors" in statement]
+    assert "phone" not in query and "image_filename" not in query
+
+    patients = client.get(f"/patients/{visit_id}", params={"fields": "name,fee_status"}).json()
+    assert patients == [{"name": "P", "fee_status": "due"}, {"name": "Q", "fee_status": "due"}]
+
+
+def test_computed_count(client, db):
+    doctor_id, visit_id = setup_visit(client)
+    visits, statements = selects(lambda: client.get(f"/visits/{doctor_id}", params={"fields": "id,totalPatients"}))
+    assert visits == [{"id": visit_id, "totalPatients": 2}]
+    # Counted in the visits query, not per visit
+    assert len([statement for statement in statements if re.search(r"FROM visits\b", statement)]) == 1
+
+    assert client.get(f"/visits/{doctor_id}", params={"fields": "date"}).json() == [{"date": "2026-10-19"}]
+
+
+def test_full_response_without_fields(client, db):
+    setup_visit(client)
+    [doctor] = client.get("/doctors/").json()
+    assert set(doctor) == {"id", "name", "specialization", "phone", "image_filename"}
+
+
+def test_invalid_fields(client, db):
+    unknown = client.get("/doctors/", params={"fields": "name,password"})
+    assert unknown.status_code == 400
+    assert "password" in unknown.json()["detail"]
+    assert client.get("/doctors/", params={"fields": " , "}).status_code == 400
@@ -0,0 +1,78 @@
+import io
+
+import pytest
+from sqlalchemy import event
+
+import crud
+import models
+from database import engine
+from ranking import RANK_REBALANCE_LENGTH
+
+
+@pytest.fixture(autouse=True)
+def empty_gallery(db):
+    db.query(models.GalleryImage).delete()
+    db.commit()
+
+
+def upload(client, title, **form):
+    response = client.post(
+        "/gallery/", data={"title": title, **form}, files={"image": (f"{title}.png", io.BytesIO(b"x"), "image/png")}
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+def titles(client):
+    return [(image["title"], image["order_index"]) for image in client.get("/gallery/").json()]
+
+
+def test_order_index_places_uploads(client):
+    upload(client, "a")
+    upload(client, "b")
+    placed = upload(client, "c", order_index="0")
+    assert placed["order_index"] == 0
+    assert titles(client) == [("c", 0), ("a", 1), ("b", 2)]
+
+
+def test_moves_and_updates_report_positions(client):
+    a, b, c = (upload(client, title) for title in "abc")
+    moved = client.post(f"/gallery/{a['id']}/move", json={"after_id": c["id"]}).json()
+    assert moved["order_index"] == 2
+    assert client.put(f"/gallery/{b['id']}", json={"order_index": 1}).json()["order_index"] == 1
+    assert titles(client) == [("c", 0), ("b", 1), ("a", 2)]
+    assert client.get(f"/gallery/{c['id']}").json()["order_index"] == 0
+
+
+def test_repeated_moves_rebalance_keys(client, db, monkeypatch):
+    first, *others = (upload(client, title) for title in "abc")
+    rebalances = []
+    set_gallery_order = crud.set_gallery_order
+    monkeypatch.setattr(crud, "set_gallery_order", lambda *args: rebalances.append(args) or set_gallery_order(*args))
+    # Moving the other two right after the first in turn halves the same gap every time
+    for step in range(RANK_REBALANCE_LENGTH * 8):
+        moved = others[step % 2]
+        assert client.post(f"/gallery/{moved['id']}/move", json={"after_id": first["id"]}).status_code == 200
+    keys = [image.rank_key for image in db.query(models.GalleryImage).populate_existing()]
+    assert rebalances
+    assert max(len(key) for key in keys) <= RANK_REBALANCE_LENGTH + 1
+
+
+def test_list_positions_cost_no_extra_queries(client, db):
+    for title in "abcdefgh":
+        upload(client, title)
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        images = crud.get_gallery_images(db, skip=2, limit=4)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+    assert [(image.title, image.order_index) for image in images] == [("c", 2), ("d", 3), ("e", 4), ("f", 5)]
+
+    rows = client.get("/gallery/", params={"fields": "title,order_index", "skip": 1, "limit": 2}).json()
+    assert rows == [{"title": "b", "order_index": 1}, {"title": "c", "order_index": 2}]
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+from starlette.testclient import TestClient
+
+import idempotency
+from idempotency import IdempotencyMiddleware, IdempotencyStore, _BodyHash
+
+
+def make_client(tmp_path, handler=None):
+    calls = []
+
+    async def app(scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        calls.append(body)
+        if handler is not None:
+            await handler()
+        await send({"type": "http.response.start", "status": 201, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"created %d" % len(calls)})
+
+    store = IdempotencyStore(str(tmp_path / "keys.db"), lock_seconds=0.3)
+    return TestClient(IdempotencyMiddleware(app, ["/items/"], store)), calls
+
+
+def test_replay_runs_handler_once(tmp_path):
+    client, calls = make_client(tmp_path)
+    first = client.post("/items/", content=b"abc", headers={"Idempotency-Key": "k"})
+    second = client.post("/items/", content=b"abc", headers={"Idempotency-Key": "k"})
+    assert first.text == second.text == "created 1"
+    assert second.headers["idempotent-replayed"] == "true"
+    assert calls == [b"abc"]
+
+
+def test_different_body_is_rejected(tmp_path):
+    client, calls = make_client(tmp_path)
+    client.post("/items/", content=b"abc", headers={"Idempotency-Key": "k"})
+    assert client.post("/items/", content=b"abd", headers={"Idempotency-Key": "k"}).status_code == 422
+    assert len(calls) == 1
+
+
+def test_resent_upload_with_new_boundary_matches(tmp_path):
+    client, calls = make_client(tmp_path)
+    for _ in range(2):
+        response = client.post(
+            "/items/", data={"title": "t"}, files={"image": ("a.png", b"x" * 1000, "image/png")},
+            headers={"Idempotency-Key": "upload"}
+        )
+        assert response.status_code == 201
+    assert len(calls) == 1
+    assert response.headers["idempotent-replayed"] == "true"
+
+
+def test_multipart_hash_does_not_depend_on_chunking():
+    content_type = b"multipart/form-data; boundary=abcdef"
+    body = b"--abcdef\r\nx\r\n--abcdef\r\nyy\r\n--abcdef--\r\n"
+    whole = _BodyHash(content_type)
+    whole.update(body)
+    expected = whole.hexdigest()
+    for size in range(1, 8):
+        chunked = _BodyHash(content_type)
+        for start in range(0, len(body), size):
+            chunked.update(body[start:start + size])
+        assert chunked.hexdigest() == expected
+
+    other = _BodyHash(b"multipart/form-data; boundary=zzzzzz")
+    other.update(body.replace(b"abcdef", b"zzzzzz"))
+    assert other.hexdigest() == expected
+
+
+def test_large_bodies_are_spooled_and_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr(idempotency, "SPOOL_BODY", 1024)
+    monkeypatch.setattr(idempotency, "MAX_KEYED_BODY", 100 * 1024)
+    client, calls = make_client(tmp_path)
+    body = bytes(range(256)) * 200
+    assert client.post("/items/", content=body, headers={"Idempotency-Key": "big"}).status_code == 201
+    assert calls == [body]
+
+    too_large = client.post("/items/", content=body * 3, headers={"Idempotency-Key": "huge"})
+    assert too_large.status_code == 413
+    assert len(calls) == 1
+    # Without a key the limit does not apply
+    assert client.post("/items/", content=body * 3).status_code == 201
+
+
+def test_slow_request_keeps_its_claim(tmp_path):
+    client, calls = make_client(tmp_path, handler=lambda: asyncio.sleep(1))
+    first = {}
+    thread = threading.Thread(
+        target=lambda: first.update(response=client.post("/items/", content=b"abc", headers={"Idempotency-Key": "k"}))
+    )
+    thread.start()
+    # Well past lock_seconds (0.3), the claim is still held
+    time.sleep(0.7)
+    assert client.post("/items/", content=b"abc", headers={"Idempotency-Key": "k"}).status_code == 409
+    thread.join()
+    assert first["response"].status_code == 201
+    assert calls == [b"abc"]
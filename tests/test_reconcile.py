@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+
+import changelog
+import models
+import reconcile
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(reconcile, "SOURCES", [(str(tmp_path), models.Doctor, "image_filename", lambda name: name)])
+    return tmp_path
+
+
+def upload(directory, name, age=7200):
+    path = directory / name
+    path.write_bytes(b"image")
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+    return str(path)
+
+
+def add_doctors(db, *image_filenames):
+    doctors = [models.Doctor(name="Dr. A", specialization="GP", phone="1", image_filename=name) for name in image_filenames]
+    db.add_all(doctors)
+    db.commit()
+    return [doctor.id for doctor in doctors]
+
+
+def test_report(db, upload_dir):
+    upload(upload_dir, "kept.png")
+    orphan = upload(upload_dir, "orphan.png")
+    upload(upload_dir, "new.png", age=0)
+    _, missing_id, _ = add_doctors(db, "kept.png", "missing.png", None)
+
+    report = reconcile.reconcile_uploads(db, batch_size=1)
+    assert report == {
+        "orphaned_files": [orphan],
+        "dangling_references": [{"table": "doctors", "id": missing_id, "reference": "missing.png"}],
+    }
+    assert os.path.exists(orphan)
+    assert db.get(models.Doctor, missing_id).image_filename == "missing.png"
+
+
+def test_delete(db, upload_dir):
+    upload(upload_dir, "kept.png")
+    orphan = upload(upload_dir, "orphan.png")
+    kept_id, missing_id = add_doctors(db, "kept.png", "missing.png")
+    cursor = changelog.latest_cursor(db)
+
+    reconcile.reconcile_uploads(db, delete=True, batch_size=1)
+    assert not os.path.exists(orphan)
+    db.expire_all()
+    assert db.get(models.Doctor, kept_id).image_filename == "kept.png"
+    assert db.get(models.Doctor, missing_id).image_filename is None
+    # Sync clients see the cleared reference
+    changes = changelog.read_changes(db, cursor)["changes"]
+    assert [row["id"] for row in changes["doctors"]["upserted"]] == [missing_id]
+    assert reconcile.reconcile_uploads(db) == {"orphaned_files": [], "dangling_references": []}
@@ -0,0 +1,79 @@
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+import cache
+import database
+from database import PRIMARY_PIN_COOKIE
+
+
+def use_replica(monkeypatch, replica_engine):
+    monkeypatch.setattr(database, "read_engine", replica_engine)
+    monkeypatch.setattr(cache, "read_engine", replica_engine)
+    monkeypatch.setattr(database, "_replica_down_until", 0.0)
+    cache.tracker.expire()
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    """A second SQLite file standing in for a replica; call sync() to copy the primary into it"""
+    path = tmp_path / "replica.db"
+    replica_engine = create_engine(f"sqlite:///{path}")
+
+    def sync():
+        replica_engine.dispose()
+        primary = sqlite3.connect(database.engine.url.database)
+        target = sqlite3.connect(path)
+        primary.backup(target)
+        primary.close()
+        target.close()
+        cache.tracker.expire()
+
+    sync()
+    use_replica(monkeypatch, replica_engine)
+    yield sync
+    replica_engine.dispose()
+
+
+def create_visit(client):
+    doctor = client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"}).json()
+    visit = client.post(f"/visits/{doctor['id']}", json={"date": "2026-10-19"}).json()
+    return doctor["id"], visit["id"]
+
+
+def test_writes_pin_reads_to_the_primary(client, replica):
+    doctor_id, visit_id = create_visit(client)
+    assert PRIMARY_PIN_COOKIE in client.cookies
+    replica()
+    client.cookies.clear()
+
+    deleted = client.delete(f"/visits/{visit_id}")
+    assert deleted.status_code == 204
+    assert PRIMARY_PIN_COOKIE in deleted.cookies
+
+    # The replica has not seen the delete yet; the pinned client reads the primary
+    assert client.get(f"/visits/{doctor_id}").json() == []
+    client.cookies.clear()
+    assert [visit["id"] for visit in client.get(f"/visits/{doctor_id}").json()] == [visit_id]
+
+
+def test_unpinned_reads_use_the_replica(client, replica):
+    doctor_id, _ = create_visit(client)
+    client.cookies.clear()
+    assert client.get(f"/visits/{doctor_id}").json() == []
+
+
+def test_unreachable_replica_falls_back_to_the_primary(client, tmp_path, monkeypatch):
+    use_replica(monkeypatch, create_engine(f"sqlite:///{tmp_path}/missing/replica.db"))
+    doctor_id, visit_id = create_visit(client)
+    client.cookies.clear()
+
+    session = database.ReadSessionLocal()
+    try:
+        assert session.get_bind() is database.engine
+    finally:
+        session.close()
+    assert database._replica_down_until > time.monotonic()
+    assert [visit["id"] for visit in client.get(f"/visits/{doctor_id}").json()] == [visit_id]
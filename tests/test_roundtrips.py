@@ -0,0 +1,36 @@
+from sqlalchemy import event
+
+from database import engine
+
+
+def round_trips(call):
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(engine, "before_cursor_execute", count)
+    event.listen(engine, "commit", count)
+    try:
+        response = call()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+        event.remove(engine, "commit", count)
+    assert response.status_code < 300
+    return len(statements)
+
+
+def test_patient_writes(client, returning):
+    doctor = client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"}).json()
+    visit = client.post(f"/visits/{doctor['id']}", json={"date": "2026-10-19"}).json()
+    patient = client.post(f"/patients/{visit['id']}", json={"name": "P", "contact": "1"}).json()
+    # The write, the data_versions bump, the change log INSERT and COMMIT; without
+    # RETURNING one SELECT reads the row back
+    extra = 0 if returning else 1
+    assert round_trips(lambda: client.patch(f"/patients/patient/{patient['id']}")) == 4 + extra
+    assert round_trips(lambda: client.put(f"/patients/patient/{patient['id']}", json={"name": "Q"})) == 4 + extra
+    # Without RETURNING the rows are loaded before the UPDATE instead of after it
+    assert round_trips(lambda: client.patch(
+        "/patients/bulk/fee-status", json={"patient_ids": [patient["id"]], "fee_status": "paid"}
+    )) == 4 + extra
+    assert round_trips(lambda: client.delete(f"/patients/patient/{patient['id']}")) == 4 + extra
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def blocked_call(flight, key, stale_for=0.0, result="value"):
+    """Start a leading call for `key` that runs until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def fn():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return result
+
+    pool = ThreadPoolExecutor(4)
+    leader = pool.submit(flight.do, key, fn, stale_for)
+    started.wait(5)
+    return pool, leader, release, runs
+
+
+def wait_until_coalesced(flight, count):
+    for _ in range(500):
+        if flight.metrics()["coalesced"] >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError("callers did not join the flight")
+
+
+def test_concurrent_callers_share_one_run():
+    flight = SingleFlight()
+    pool, leader, release, runs = blocked_call(flight, "key")
+    followers = [pool.submit(flight.do, "key", lambda: "not run") for _ in range(3)]
+    wait_until_coalesced(flight, 3)
+    release.set()
+
+    assert [future.result() for future in [leader, *followers]] == ["value"] * 4
+    pool.shutdown()
+    assert runs == [1]
+    assert flight.metrics() == {"executions": 1, "coalesced": 3, "stale_served": 0, "in_flight": 0}
+    # Once finished, the next call runs again
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flight.do, "key", fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, "key", lambda: "not run")
+        wait_until_coalesced(flight, 1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert flight.do("key", lambda: "recovered") == "recovered"
+
+
+def test_stale_result_while_revalidating():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: "old", stale_for=60) == "old"
+
+    pool, leader, release, _ = blocked_call(flight, "key", stale_for=60, result="new")
+    assert flight.do("key", lambda: "not run", stale_for=60) == "old"
+    release.set()
+    assert leader.result() == "new"
+    pool.shutdown()
+    assert flight.metrics()["stale_served"] == 1
+
+
+def test_async_callers_share_one_run():
+    flight = SingleFlight()
+    runs = []
+
+    async def fn():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("key", fn) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert runs == [1]
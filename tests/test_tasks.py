@@ -0,0 +1,102 @@
+import sqlite3
+import time
+
+import pytest
+
+import models
+import tasks
+from tasks import TaskQueue
+
+calls = []
+attempts = []
+
+
+@tasks.task("test.record")
+def record(value):
+    calls.append(value)
+
+
+@tasks.task("test.fail")
+def fail():
+    attempts.append(time.time())
+    raise RuntimeError("boom")
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def journal(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT name, status, attempts, last_error FROM tasks ORDER BY id").fetchall()
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = TaskQueue(str(tmp_path / "journal.db"), retry_delay=0.01)
+    yield queue
+    queue.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    calls.clear()
+    attempts.clear()
+
+
+def test_finished_tasks_leave_the_journal(queue):
+    queue.enqueue("test.record", value=1)
+    wait_for(lambda: calls == [1] and journal(queue.journal_path) == [])
+
+
+def test_unknown_task():
+    with pytest.raises(ValueError):
+        tasks.enqueue("test.missing")
+
+
+def test_unfinished_tasks_replay_on_start(queue):
+    queue.start()
+    queue.shutdown()
+    # A task journaled by a process that died before running it
+    with sqlite3.connect(queue.journal_path) as connection:
+        connection.execute(
+            "INSERT INTO tasks (name, payload, created_at) VALUES ('test.record', '{\"value\": 2}', ?)",
+            (time.time(),)
+        )
+
+    queue.start()
+    wait_for(lambda: calls == [2] and journal(queue.journal_path) == [])
+
+
+def test_failing_task_is_retried_then_kept(queue):
+    queue.max_retries = 3
+    queue.enqueue("test.fail")
+    wait_for(lambda: journal(queue.journal_path)[0][1] == "failed")
+    assert len(attempts) == 3
+    assert journal(queue.journal_path) == [("test.fail", "failed", 3, "boom")]
+
+
+def test_failed_tasks_are_pruned_after_the_retention(queue):
+    queue.max_retries = 1
+    queue.failed_retention = 0
+    queue.enqueue("test.fail")
+    wait_for(lambda: attempts and journal(queue.journal_path) == [])
+
+
+def test_after_commit_tasks(db, monkeypatch):
+    enqueued = []
+    monkeypatch.setattr(tasks.task_queue, "enqueue", lambda name, **kwargs: enqueued.append((name, kwargs)))
+
+    # Queued inside a transaction, as the routers do
+    db.query(models.Doctor).count()
+    tasks.enqueue_after_commit(db, "test.record", value=3)
+    db.rollback()
+    assert enqueued == []
+
+    tasks.enqueue_after_commit(db, "test.record", value=4)
+    assert enqueued == []
+    db.commit()
+    assert enqueued == [("test.record", {"value": 4})]
@@ -0,0 +1,68 @@
+from datetime import time
+
+import pytest
+
+import crud
+import models
+import schemas
+import timetable
+from timetable import ScheduleIntervals, slot_key
+
+MONDAY = slot_key(1, "Dr. A", "Monday", None)
+
+
+def build(*intervals):
+    """Index holding (start_hour, end_hour, id) intervals for one doctor on Monday"""
+    index = ScheduleIntervals()
+    index.version = 0
+    for version, (start, end, schedule_id) in enumerate(intervals, 1):
+        index.apply(version, schedule_id, MONDAY, time(start), time(end))
+    return index
+
+
+def test_disjoint_group():
+    index = build((9, 10, 1), (11, 12, 2), (14, 16, 3))
+    assert index.find_conflict(MONDAY, time(10), time(11)) is None
+    assert index.find_conflict(MONDAY, time(12), time(14)) is None
+    assert index.find_conflict(MONDAY, time(11, 30), time(13)) == 2
+    assert index.find_conflict(MONDAY, time(8), time(17)) in {1, 2, 3}
+    assert index.find_conflict(MONDAY, time(11), time(12), exclude_id=2) is None
+    assert index.overlapping_groups() == []
+
+
+def test_group_with_legacy_overlap():
+    # 9-17 covers 10-11; a slot after 10-11 still overlaps 9-17
+    index = build((9, 17, 1), (10, 11, 2))
+    assert index.find_conflict(MONDAY, time(12), time(13)) == 1
+    assert index.find_conflict(MONDAY, time(12), time(13), exclude_id=1) is None
+    assert index.find_conflict(MONDAY, time(17), time(18)) is None
+    assert index.overlapping_groups() == [MONDAY]
+
+
+def test_removing_the_long_slot_clears_the_overlap():
+    index = build((9, 17, 1), (10, 11, 2))
+    index.apply(3, 1)
+    assert index.find_conflict(MONDAY, time(12), time(13)) is None
+    assert index.overlapping_groups() == []
+
+
+def test_create_rejects_slot_inside_legacy_overlap(db):
+    doctor = models.Doctor(name="Dr. A", specialization="General", phone="1")
+    db.add(doctor)
+    db.flush()
+    # Rows written before overlaps were rejected
+    for start, end in [(9, 17), (10, 11)]:
+        db.add(models.DoctorSchedule(
+            doctor_id=doctor.id, name="Dr. A", specialization="General",
+            day_of_week="Monday", start_time=time(start), end_time=time(end),
+        ))
+    db.commit()
+    timetable.schedule_intervals.version = None
+
+    schedule = schemas.DoctorScheduleCreate(
+        doctor_id=doctor.id, name="Dr. A", specialization="General",
+        day_of_week="Monday", start_time=time(12), end_time=time(13),
+    )
+    with pytest.raises(timetable.ScheduleConflict):
+        crud.create_schedule(db, schedule)
+    assert db.query(models.DoctorSchedule).count() == 2
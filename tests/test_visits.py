@@ -0,0 +1,28 @@
+import models
+
+
+def create_doctor(client):
+    return client.post("/doctors/", data={"name": "Dr. A", "specialization": "GP", "phone": "1"}).json()["id"]
+
+
+def test_unknown_doctor_is_not_found(client, db):
+    response = client.post("/visits/999999", json={"date": "2026-10-19"})
+    assert response.status_code == 404
+    assert db.query(models.Visit).filter(models.Visit.doctor_id == 999999).count() == 0
+    assert client.put("/visits/999999/2026-10-19").status_code == 404
+
+
+def test_duplicate_visit_conflicts(client):
+    doctor_id = create_doctor(client)
+    assert client.post(f"/visits/{doctor_id}", json={"date": "2026-10-19"}).status_code == 201
+    duplicate = client.post(f"/visits/{doctor_id}", json={"date": "2026-10-19"})
+    assert duplicate.status_code == 409
+
+
+def test_get_or_create_returns_the_same_visit(client):
+    doctor_id = create_doctor(client)
+    created = client.put(f"/visits/{doctor_id}/2026-10-19")
+    again = client.put(f"/visits/{doctor_id}/2026-10-19")
+    assert (created.status_code, again.status_code) == (201, 200)
+    assert created.json()["id"] == again.json()["id"]
+    assert again.json()["totalPatients"] == 0
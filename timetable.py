@@ -0,0 +1,169 @@
+"""
+Conflict detection for doctor schedules.
+
+Schedules are grouped by doctor and by slot (a specific date, or a weekday for
+recurring schedules). Each group is a list of (start, end, id) intervals kept
+sorted by start time, with the running maximum end time alongside, so checking
+a new slot is a binary search followed by a short backward scan. Groups may
+contain overlaps written before the check existed; those are logged on load
+and still checked correctly. The index is
+loaded once per worker and updated in place by the write path; it is reloaded
+only when another process changed the schedules (see cache.py versions).
+"""
+import bisect
+import logging
+import threading
+from itertools import accumulate
+from sqlalchemy.orm import Session
+import crud
+import models
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleConflict(ValueError):
+    def __init__(self, schedule_id: int):
+        super().__init__(f"Schedule overlaps existing schedule {schedule_id}")
+        self.schedule_id = schedule_id
+
+
+def slot_key(doctor_id, name, day_of_week, specific_date):
+    """Group key: the doctor (by id, or by name for unlinked rows) and the day the slot applies to"""
+    doctor = ("id", doctor_id) if doctor_id is not None else ("name", crud.normalize_doctor_name(name))
+    if specific_date is not None:
+        return doctor, ("date", specific_date)
+    return doctor, ("day", (day_of_week or "").strip().lower())
+
+
+def validate_range(start_time, end_time):
+    if end_time <= start_time:
+        raise ValueError("end_time must be after start_time")
+
+
+class ScheduleIntervals:
+    def __init__(self):
+        self.version = None
+        self._slots = {}     # key -> sorted [(start, end, id)]
+        self._max_ends = {}  # key -> running maximum of the ends in _slots[key]
+        self._by_id = {}     # id -> (key, start, end)
+        self._lock = threading.RLock()
+
+    def load(self, db: Session, version):
+        """Rebuild the index from the database"""
+        columns = models.DoctorSchedule
+        rows = db.query(
+            columns.id, columns.doctor_id, columns.name, columns.day_of_week,
+            columns.specific_date, columns.start_time, columns.end_time
+        ).all()
+        with self._lock:
+            self._slots = {}
+            self._max_ends = {}
+            self._by_id = {}
+            for row in rows:
+                key = slot_key(row.doctor_id, row.name, row.day_of_week, row.specific_date)
+                bisect.insort(self._slots.setdefault(key, []), (row.start_time, row.end_time, row.id))
+                self._by_id[row.id] = (key, row.start_time, row.end_time)
+            for key in self._slots:
+                self._update_max_ends(key)
+            self.version = version
+
+            overlapping = self.overlapping_groups()
+            if overlapping:
+                logger.warning(
+                    "%d schedule groups contain overlapping slots (see GET /schedules/conflicts)", len(overlapping)
+                )
+
+    def sync(self, db: Session, version):
+        """Make sure the index reflects `version`, reloading only if it is behind"""
+        with self._lock:
+            if self.version != version:
+                self.load(db, version)
+
+    def find_conflict(self, key, start_time, end_time, exclude_id=None):
+        """Id of a schedule in `key` overlapping [start_time, end_time), or None"""
+        with self._lock:
+            intervals = self._slots.get(key, [])
+            max_ends = self._max_ends.get(key, [])
+            # Candidates start before end_time; scan back until no earlier interval reaches start_time
+            position = bisect.bisect_left(intervals, (end_time,))
+            while position > 0:
+                position -= 1
+                if max_ends[position] <= start_time:
+                    return None
+                start, end, schedule_id = intervals[position]
+                if end > start_time and schedule_id != exclude_id:
+                    return schedule_id
+            return None
+
+    def overlapping_groups(self):
+        """Keys of groups that already contain overlapping slots"""
+        with self._lock:
+            return [
+                key for key, intervals in self._slots.items()
+                if any(intervals[i][0] < self._max_ends[key][i - 1] for i in range(1, len(intervals)))
+            ]
+
+    def apply(self, version, schedule_id, key=None, start_time=None, end_time=None):
+        """
+        Record a committed write (key=None means the schedule was deleted).
+        Ignored unless the index is exactly one version behind; otherwise it is reloaded on the next check.
+        """
+        with self._lock:
+            if self.version != version - 1:
+                return
+            self._remove(schedule_id)
+            if key is not None:
+                self._insert(key, start_time, end_time, schedule_id)
+            self.version = version
+
+    def _insert(self, key, start_time, end_time, schedule_id):
+        bisect.insort(self._slots.setdefault(key, []), (start_time, end_time, schedule_id))
+        self._by_id[schedule_id] = (key, start_time, end_time)
+        self._update_max_ends(key)
+
+    def _remove(self, schedule_id):
+        entry = self._by_id.pop(schedule_id, None)
+        if entry is not None:
+            key, start_time, end_time = entry
+            self._slots[key].remove((start_time, end_time, schedule_id))
+            self._update_max_ends(key)
+
+    def _update_max_ends(self, key):
+        # Groups are one doctor's slots on one day, so recomputing is cheap
+        self._max_ends[key] = list(accumulate((end for _, end, _ in self._slots[key]), max))
+
+
+schedule_intervals = ScheduleIntervals()
+
+
+def find_all_conflicts(db: Session):
+    """
+    Validate the whole timetable in one pass: returns overlapping pairs and
+    schedules whose end is not after their start.
+    """
+    columns = models.DoctorSchedule
+    rows = db.query(
+        columns.id, columns.doctor_id, columns.name, columns.day_of_week,
+        columns.specific_date, columns.start_time, columns.end_time
+    ).all()
+
+    groups = {}
+    invalid_ranges = []
+    for row in rows:
+        if row.end_time <= row.start_time:
+            invalid_ranges.append(row.id)
+            continue
+        key = slot_key(row.doctor_id, row.name, row.day_of_week, row.specific_date)
+        groups.setdefault(key, []).append((row.start_time, row.end_time, row.id))
+
+    conflicts = []
+    for intervals in groups.values():
+        intervals.sort()
+        active = []   # intervals that may still overlap the next start
+        for start, end, schedule_id in intervals:
+            active = [interval for interval in active if interval[1] > start]
+            for _, _, other_id in active:
+                conflicts.append({"schedule_id": other_id, "conflicting_schedule_id": schedule_id})
+            active.append((start, end, schedule_id))
+
+    return {"conflicts": conflicts, "invalid_ranges": invalid_ranges}